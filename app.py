@@ -1,7 +1,9 @@
+import logging
 import os
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 
@@ -16,19 +18,69 @@ app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1) # needed for url_for to generate with https
 
+# Threads that use the database: bot update workers plus everything counted below
+BOT_WORKER_THREADS = int(os.environ.get("BOT_WORKER_THREADS", 2))
+PAYMENT_LANE_THREADS = int(os.environ.get("PAYMENT_LANE_THREADS", 1))
+MEDIA_INGEST_CONCURRENCY = int(os.environ.get("MEDIA_INGEST_CONCURRENCY", 4))
+DB_BACKGROUND_THREADS = (
+    PAYMENT_LANE_THREADS
+    + 1  # fulfillment worker
+    + 1  # catalog refresher
+    + 2  # post scheduler loader and sender
+    + 1  # Flask request thread
+    + 2  # owner snapshot/restore and export jobs
+    + MEDIA_INGEST_CONCURRENCY  # media ingest and catalog import upload workers
+)
+
+def build_engine_options(database_url):
+    """Build SQLAlchemy engine options from the environment.
+
+    Pool sizes default to one connection per database thread. Instead of pinging
+    on every checkout, dropped connections are detected when a query fails and the
+    pool is invalidated so the next checkout reconnects.
+    """
+    options = {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", BOT_WORKER_THREADS + DB_BACKGROUND_THREADS)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", BOT_WORKER_THREADS)),
+        "pool_timeout": int(os.environ.get("DB_POOL_TIMEOUT", 10)),
+    }
+    if not database_url.startswith("sqlite"):
+        options["pool_recycle"] = int(os.environ.get("DB_POOL_RECYCLE", 300))
+        options["pool_pre_ping"] = os.environ.get("DB_POOL_PRE_PING", "false").lower() == "true"
+    return options
+
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    """Apply SQLite pragmas to every new connection"""
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers run alongside the writer; NORMAL sync is safe under WAL
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA mmap_size={int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))}")
+    cursor.execute(f"PRAGMA busy_timeout={int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))}")
+    cursor.close()
+
+def handle_database_error(context):
+    """Log lost connections; SQLAlchemy then invalidates the pool so the next checkout reconnects"""
+    if context.is_disconnect:
+        logging.getLogger(__name__).warning(f"Database connection lost, reconnecting: {context.original_exception}")
+        context.invalidate_pool_on_disconnect = True
+
 # configure the database with fallback to SQLite
 DATABASE_URL = os.environ.get("DATABASE_URL")
 if DATABASE_URL:
     # PostgreSQL configuration
     app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-        "pool_recycle": 300,
-        "pool_pre_ping": True,
-    }
 else:
     # SQLite fallback
     app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///content_bot.db"
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {}
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = build_engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
+
+# Optional read replica for analytics and listing queries
+DATABASE_REPLICA_URL = os.environ.get("DATABASE_REPLICA_URL")
+if DATABASE_REPLICA_URL:
+    app.config["SQLALCHEMY_BINDS"] = {
+        "replica": dict(url=DATABASE_REPLICA_URL, **build_engine_options(DATABASE_REPLICA_URL))
+    }
 # initialize the app with the extension, flask-sqlalchemy >= 3.0.x
 db.init_app(app)
 
@@ -36,4 +88,15 @@ with app.app_context():
     # Make sure to import the models here or their tables won't be created
     import models  # noqa: F401
 
-    db.create_all()
\ No newline at end of file
+    for engine in db.engines.values():
+        if engine.dialect.name == "sqlite":
+            event.listen(engine, "connect", configure_sqlite_connection)
+        event.listen(engine, "handle_error", handle_database_error)
+
+    # Tables live on the primary only; the replica is populated by replication
+    db.create_all(bind_key=None)
+
+    # create_all skips tables that already exist, so add any indexes they are missing
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
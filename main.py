@@ -1,20 +1,41 @@
 import os
 import threading
+import multiprocessing
+import asyncio
 import datetime
 import telebot
-from telebot import types
-from flask import render_template_string, has_app_context, make_response, jsonify
-from app import app, db
+from telebot import types, apihelper
+from telebot.handler_backends import BaseMiddleware
+from flask import render_template_string, has_app_context, make_response, jsonify, g
+from app import app, db, BOT_WORKER_THREADS, PAYMENT_LANE_THREADS, MEDIA_INGEST_CONCURRENCY
 from models import *
-from sqlalchemy import and_, func, or_, case
+from sqlalchemy import and_, func, or_, case, event, select, insert, literal, type_coerce, cast
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
 import logging
 from functools import wraps
+from contextlib import contextmanager
+from collections import namedtuple, deque
 import socket
 import ipaddress
 import requests
 import tempfile
 from urllib.parse import urlparse
 import mimetypes
+import json
+import gzip
+import csv
+import io
+import zipfile
+import posixpath
+import bisect
+import concurrent.futures
+import hashlib
+import heapq
+import queue
+import itertools
+import re
+import shlex
 import fcntl
 import time
 
@@ -80,15 +101,108 @@ def patch_telebot_registration():
     bot.register_message_handler = safe_register_message_handler
     bot.register_callback_query_handler = safe_register_callback_query_handler
 
+class AppContextMiddleware(BaseMiddleware):
+    """Run each update in one app context and DB session.
+
+    Handler filters and the handler itself run inside the context, and every helper
+    they call reuses it through app_context_scope() instead of pushing its own.
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self.update_types = telebot.util.update_types
+    
+    def pre_process(self, message, data):
+        context = app.app_context()
+        context.push()
+        data['app_context'] = context
+        from_user = getattr(message, 'from_user', None)
+        g.actor_id = from_user.id if from_user else None  # read-your-writes is tracked per user
+    
+    def post_process(self, message, data, exception):
+        data['app_context'].pop(exception)
+
+@contextmanager
+def app_context_scope():
+    """Reuse the current app context and session, or push one when called outside an update"""
+    if has_app_context():
+        try:
+            yield
+        except Exception:
+            # The session is shared with the rest of the update, so don't leave it in a failed
+            # transaction; the caller's uncommitted changes are discarded along with this block's
+            db.session.rollback()
+            raise
+    else:
+        with app.app_context():
+            yield
+
+# Read replica routing - heavy owner reads go to DATABASE_REPLICA_URL when it is configured
+
+REPLICA_READ_AFTER_WRITE_SECONDS = int(os.getenv('REPLICA_READ_AFTER_WRITE_SECONDS', '10'))
+recent_primary_writes = {}  # user id -> monotonic time of that user's last committed write
+recent_primary_writes_lock = threading.Lock()
+
+@event.listens_for(Session, 'after_flush')
+def mark_session_wrote(session, flush_context):
+    """Remember that this transaction changed data on the primary"""
+    session.info['wrote_primary'] = True
+
+@event.listens_for(Session, 'after_commit')
+def record_primary_write(session):
+    """Record when the user behind the current update last committed changes, for read-your-writes routing"""
+    if not session.info.pop('wrote_primary', False) or not has_app_context():
+        return
+    actor_id = g.get('actor_id')
+    if actor_id is None:
+        return
+    now = time.monotonic()
+    with recent_primary_writes_lock:
+        recent_primary_writes[actor_id] = now
+        if len(recent_primary_writes) > 10000:
+            for user_id, wrote_at in list(recent_primary_writes.items()):
+                if now - wrote_at >= REPLICA_READ_AFTER_WRITE_SECONDS:
+                    del recent_primary_writes[user_id]
+
+@event.listens_for(Session, 'after_rollback')
+def clear_session_wrote(session):
+    """Forget writes that were rolled back"""
+    session.info.pop('wrote_primary', None)
+
+def get_read_session():
+    """Get the session to use for read-only analytics and listing queries.
+
+    Returns a replica session when a replica is configured, or db.session otherwise.
+    Right after the current user wrote something (e.g. the owner marking a loyal fan)
+    their reads stay on the primary until the replica has had time to catch up, so
+    they see their own change. Other users' writes don't affect the routing.
+    """
+    if 'replica' not in db.engines:
+        return db.session
+    actor_id = g.get('actor_id')
+    if actor_id is not None:
+        with recent_primary_writes_lock:
+            wrote_at = recent_primary_writes.get(actor_id)
+        if wrote_at is not None and time.monotonic() - wrote_at < REPLICA_READ_AFTER_WRITE_SECONDS:
+            return db.session
+    if 'read_session' not in g:
+        g.read_session = Session(bind=db.engines['replica'])
+    return g.read_session
+
+@app.teardown_appcontext
+def close_read_session(exception=None):
+    """Close the replica session opened for this app context"""
+    read_session = g.pop('read_session', None)
+    if read_session is not None:
+        read_session.close()
+
 # Universal safety decorator for TeleBot handlers
 def safe_handler(fn):
     """Universal decorator that ensures Flask app context and catches all exceptions for TeleBot handlers"""
     @wraps(fn)
     def wrapper(*args, **kwargs):
         try:
-            if has_app_context():
-                return fn(*args, **kwargs)
-            with app.app_context():
+            with app_context_scope():
                 return fn(*args, **kwargs)
         except NameError as e:
             if 'sqlite3' in str(e):
@@ -184,85 +298,595 @@ def notify_all_owners(message, parse_mode=None):
         except:
             pass
 
+# Shared HTTP transport - one pooled keep-alive session for Telegram API calls and media downloads
+
+# One connection per thread that talks to Telegram: update workers, fulfillment, catalog refresh and Flask
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', BOT_WORKER_THREADS + 4))
+# (connect, read) timeouts per Telegram method - uploads get a longer read timeout
+TELEGRAM_DEFAULT_TIMEOUT = (5, int(os.getenv('TELEGRAM_READ_TIMEOUT', '30')))
+TELEGRAM_UPLOAD_TIMEOUT = (5, int(os.getenv('TELEGRAM_UPLOAD_TIMEOUT', '120')))
+TELEGRAM_UPLOAD_METHODS = {
+    'sendPhoto', 'sendVideo', 'sendDocument', 'sendAnimation', 'sendAudio',
+    'sendVoice', 'sendVideoNote', 'sendMediaGroup'
+}
+# Base URL of a self-hosted Bot API server (or a local fake for load tests); api.telegram.org by default
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+
+# External media hosts - resolved once, validated, and then connected to by address
+DNS_CACHE_TTL_SECONDS = int(os.getenv('DNS_CACHE_TTL_SECONDS', '300'))
+BLOCKED_HOSTNAMES = {'metadata.google.internal', '169.254.169.254', 'metadata'}
+
+def is_internal_address(ip):
+    """True for addresses an outbound fetch must never reach"""
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return (ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_multicast
+            or ip.is_reserved or ip.is_unspecified)
+
+class DnsCache:
+    """TTL-bound cache of validated host addresses.
+
+    Every address a hostname resolves to (IPv4 and IPv6, via getaddrinfo) must be
+    public or the host is rejected with ValueError. Callers connect to the address
+    that was checked rather than resolving again, which closes the DNS rebinding
+    window. The resolver takes getaddrinfo's signature so it can be stubbed.
+    """
+    
+    def __init__(self, ttl, resolver=socket.getaddrinfo, max_entries=1024):
+        self.ttl = ttl
+        self.resolver = resolver
+        self.max_entries = max_entries
+        self._entries = {}  # hostname -> (expires_at, address)
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+    
+    def resolve(self, hostname):
+        """Return the validated address for hostname (raises ValueError or socket.gaierror)"""
+        hostname = hostname.lower().rstrip('.')
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(hostname)
+            if entry and entry[0] > now:
+                self.stats['hits'] += 1
+                return entry[1]
+        
+        address = self._lookup(hostname)
+        with self._lock:
+            self.stats['misses'] += 1
+            if len(self._entries) >= self.max_entries:
+                self._entries = {host: item for host, item in self._entries.items() if item[0] > now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.pop(next(iter(self._entries)))
+            self._entries[hostname] = (now + self.ttl, address)
+        return address
+    
+    def _lookup(self, hostname):
+        if hostname in BLOCKED_HOSTNAMES:
+            raise ValueError("Access to metadata endpoints is not allowed")
+        
+        infos = self.resolver(hostname, None, 0, socket.SOCK_STREAM)
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        if not addresses:
+            raise socket.gaierror(f"No addresses for {hostname}")
+        # One internal record is enough to reject the host - the client could pick any of them
+        for address in addresses:
+            if is_internal_address(ipaddress.ip_address(address.split('%')[0])):
+                raise ValueError("Access to internal/private networks is not allowed")
+        return addresses[0]
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries))
+
+dns_cache = DnsCache(DNS_CACHE_TTL_SECONDS)
+
+class PinnedAddressAdapter(requests.adapters.HTTPAdapter):
+    """HTTPAdapter that connects to the dns_cache-validated address of every host.
+
+    The URL keeps its hostname, so the Host header, TLS SNI and certificate checks
+    still use the name while the socket goes to the checked address. Redirects
+    pass through the adapter as well, so they are validated the same way.
+    """
+    
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        hostname = host_params['host']
+        host_params['host'] = dns_cache.resolve(hostname)
+        if host_params['scheme'] == 'https':
+            pool_kwargs['server_hostname'] = hostname
+            pool_kwargs['assert_hostname'] = hostname
+        return host_params, pool_kwargs
+    
+    def add_headers(self, request, **kwargs):
+        if 'Host' not in request.headers:
+            request.headers['Host'] = urlparse(request.url).netloc.rsplit('@', 1)[-1]
+
+http_session = None
+http_adapter = None
+media_session = None
+http_metrics = {'requests': 0, 'errors': 0, 'by_method': {}}
+http_metrics_lock = threading.Lock()
+
+def install_http_session():
+    """Create the pooled sessions and route telebot's API calls and file downloads through them"""
+    global http_session, http_adapter, media_session
+    http_adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=HTTP_POOL_SIZE)
+    http_session = requests.Session()
+    http_session.mount('https://', http_adapter)
+    http_session.mount('http://', http_adapter)
+    
+    # Downloads from user-supplied URLs only ever connect to validated addresses
+    media_adapter = PinnedAddressAdapter(pool_connections=10, pool_maxsize=HTTP_POOL_SIZE)
+    media_session = requests.Session()
+    media_session.mount('https://', media_adapter)
+    media_session.mount('http://', media_adapter)
+    
+    apihelper.session = http_session
+    apihelper.CUSTOM_REQUEST_SENDER = send_telegram_request
+    if TELEGRAM_API_URL:
+        apihelper.API_URL = TELEGRAM_API_URL.rstrip('/') + '/bot{0}/{1}'
+        apihelper.FILE_URL = TELEGRAM_API_URL.rstrip('/') + '/file/bot{0}/{1}'
+    return http_session
+
+# Outbound rate governor - every send to a chat passes through shared token buckets
+
+# Lower number wins when sends compete for the global budget
+OUTBOUND_PRIORITIES = {'interactive': 0, 'fulfillment': 1, 'broadcast': 2}
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))  # messages per second
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '1'))  # messages per second per chat
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', '3'))
+TELEGRAM_RATE_LIMIT_RETRIES = 3
+
+outbound_context = threading.local()
+
+@contextmanager
+def outbound_priority(priority):
+    """Send every Telegram call made inside the block with the given priority class"""
+    previous = getattr(outbound_context, 'priority', 'interactive')
+    outbound_context.priority = priority
+    try:
+        yield
+    finally:
+        outbound_context.priority = previous
+
+def current_outbound_priority():
+    return getattr(outbound_context, 'priority', 'interactive')
+
+class OutboundGovernor:
+    """Global and per-chat token buckets shared by all outbound sends.
+
+    Buckets are tracked as theoretical arrival times (GCRA), so each chat costs
+    one float. Waiting senders are served in priority order, but a sender whose
+    own chat is still cooling down never blocks others behind it. A 429 pauses
+    all sends for retry_after and halves the global rate, which then recovers
+    gradually as sends succeed.
+    
+    The global bucket is [theoretical arrival time, paused until, current rate].
+    share_global_bucket() swaps it for a multiprocessing array so shard workers
+    and the receiver draw on one budget. Broadcasts get no burst allowance from
+    it, so interactive sends from any process can still go ahead of them.
+    """
+    
+    def __init__(self, global_rate, chat_rate, chat_burst):
+        self.max_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._bucket = [0.0, 0.0, global_rate]
+        self._bucket_lock = threading.Lock()
+        self._chat_tat = {}
+        self._waiting = []  # sorted (priority, seq, chat_id) tickets
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.stats = {'sends': 0, 'delayed': 0, 'wait_seconds': 0.0, 'rate_limited': 0}
+    
+    def share_global_bucket(self, bucket):
+        """Use a multiprocessing Array('d', 3) as the global bucket (call before any sends)"""
+        self._bucket = bucket.get_obj()
+        self._bucket_lock = bucket.get_lock()
+    
+    @property
+    def global_rate(self):
+        return self._bucket[2]
+    
+    def _global_ready_at(self, priority):
+        tat, paused_until, rate = self._bucket
+        # One second of burst at the current rate, except for broadcasts
+        tolerance = max(rate - 1, 0) / rate if priority < OUTBOUND_PRIORITIES['broadcast'] else 0
+        return max(paused_until, tat - tolerance)
+    
+    def _chat_ready_at(self, chat_id):
+        tolerance = (self.chat_burst - 1) / self.chat_rate
+        return self._chat_tat.get(chat_id, 0.0) - tolerance
+    
+    def _wait_time(self, ticket, now):
+        global_wait = self._global_ready_at(ticket[0]) - now
+        own_wait = max(global_wait, self._chat_ready_at(ticket[2]) - now)
+        if own_wait > 0:
+            return own_wait
+        # Give way to an earlier (higher priority or older) sender that could go now
+        for other in self._waiting:
+            if other >= ticket:
+                break
+            if self._chat_ready_at(other[2]) <= now:
+                return 1 / self.global_rate
+        return 0
+    
+    def _consume(self, chat_id, now):
+        self._bucket[0] = max(self._bucket[0], now) + 1 / self._bucket[2]
+        self._chat_tat[chat_id] = max(self._chat_tat.get(chat_id, 0.0), now) + 1 / self.chat_rate
+        self.stats['sends'] += 1
+        if len(self._chat_tat) > 10000:
+            # Drop chats whose bucket has fully refilled
+            self._chat_tat = {chat: tat for chat, tat in self._chat_tat.items() if tat > now}
+    
+    def acquire(self, chat_id, priority='interactive'):
+        """Block until a message to chat_id may be sent"""
+        ticket = (OUTBOUND_PRIORITIES.get(priority, 0), next(self._seq), chat_id)
+        started = time.monotonic()
+        with self._cond:
+            bisect.insort(self._waiting, ticket)
+            try:
+                while True:
+                    # time.monotonic() is system-wide on Linux, so a shared bucket's times compare across processes
+                    with self._bucket_lock:
+                        now = time.monotonic()
+                        wait = self._wait_time(ticket, now)
+                        if wait <= 0:
+                            self._consume(chat_id, now)
+                            break
+                    self._cond.wait(wait)
+            finally:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+            
+            waited = time.monotonic() - started
+            if waited > 0.001:
+                self.stats['delayed'] += 1
+                self.stats['wait_seconds'] += waited
+    
+    def try_acquire(self, chat_id, priority='broadcast'):
+        """Non-blocking acquire for the asyncio runtime - returns 0 when sent, else seconds to wait"""
+        ticket = (OUTBOUND_PRIORITIES.get(priority, 0), float('inf'), chat_id)
+        with self._cond, self._bucket_lock:
+            now = time.monotonic()
+            wait = self._wait_time(ticket, now)
+            if wait <= 0:
+                self._consume(chat_id, now)
+                return 0
+            return wait
+    
+    def record_success(self):
+        """Let the global rate creep back up after a rate limit"""
+        if self.global_rate < self.max_rate:
+            with self._bucket_lock:
+                self._bucket[2] = min(self.max_rate, self._bucket[2] + 0.1)
+    
+    def record_rate_limit(self, retry_after):
+        """Telegram answered 429 - pause everything and halve the global rate"""
+        with self._cond:
+            with self._bucket_lock:
+                self._bucket[1] = max(self._bucket[1], time.monotonic() + retry_after)
+                self._bucket[2] = max(1.0, self._bucket[2] / 2)
+            self.stats['rate_limited'] += 1
+            self._cond.notify_all()
+    
+    def get_stats(self):
+        with self._cond:
+            return dict(self.stats, global_rate=round(self.global_rate, 2), waiting=len(self._waiting),
+                        wait_seconds=round(self.stats['wait_seconds'], 2))
+
+outbound_governor = OutboundGovernor(TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+
+def new_outbound_bucket(ctx):
+    """Global send bucket for the governors of every process started from ctx"""
+    return ctx.Array('d', [0.0, 0.0, TELEGRAM_GLOBAL_RATE])
+
+def get_retry_after(result_json, default=1):
+    """Read retry_after from a Telegram error response"""
+    try:
+        return int(result_json.get('parameters', {}).get('retry_after', default))
+    except (AttributeError, TypeError, ValueError):
+        return default
+
+def _rewind_files(files):
+    """Rewind upload file objects so a rate limited request can be resent"""
+    for value in (files or {}).values():
+        file_obj = value[1] if isinstance(value, tuple) else value
+        if hasattr(file_obj, 'seek'):
+            file_obj.seek(0)
+
+def send_telegram_request(method, url, params=None, files=None, timeout=None, proxies=None):
+    """telebot request hook - rate limits sends and runs every API call on the shared session"""
+    api_method = url.rsplit('/', 1)[-1]
+    if api_method != 'getUpdates':
+        # Long polling already sizes its own read timeout
+        timeout = TELEGRAM_UPLOAD_TIMEOUT if api_method in TELEGRAM_UPLOAD_METHODS else TELEGRAM_DEFAULT_TIMEOUT
+    # Only calls that deliver something to a chat count against Telegram's send limits
+    chat_id = (params or {}).get('chat_id') if api_method.startswith(('send', 'forward', 'copy')) else None
+    
+    with http_metrics_lock:
+        http_metrics['requests'] += 1
+        http_metrics['by_method'][api_method] = http_metrics['by_method'].get(api_method, 0) + 1
+    
+    for attempt in range(TELEGRAM_RATE_LIMIT_RETRIES + 1):
+        if chat_id is not None:
+            outbound_governor.acquire(chat_id, current_outbound_priority())
+        try:
+            response = http_session.request(method, url, params=params, files=files, timeout=timeout, proxies=proxies)
+        except requests.exceptions.RequestException:
+            with http_metrics_lock:
+                http_metrics['errors'] += 1
+            raise
+        
+        if response.status_code != 429:
+            outbound_governor.record_success()
+            return response
+        
+        try:
+            retry_after = get_retry_after(response.json())
+        except ValueError:
+            retry_after = 1
+        outbound_governor.record_rate_limit(retry_after)
+        logger.warning(f"Telegram rate limit on {api_method} (chat {chat_id}), retrying after {retry_after}s")
+        if attempt < TELEGRAM_RATE_LIMIT_RETRIES:
+            # Calls without a chat never pass through the governor, so wait here for every method
+            time.sleep(retry_after)
+            _rewind_files(files)
+    
+    return response
+
+def get_http_metrics():
+    """Connection reuse statistics for the shared HTTP session"""
+    pools = http_adapter.poolmanager.pools
+    pool_stats = [pools[key] for key in list(pools.keys())]
+    pool_requests = sum(pool.num_requests for pool in pool_stats)
+    connections_opened = sum(pool.num_connections for pool in pool_stats)
+    
+    with http_metrics_lock:
+        return {
+            'telegram_requests': http_metrics['requests'],
+            'telegram_errors': http_metrics['errors'],
+            'requests_by_method': dict(http_metrics['by_method']),
+            'pool_requests': pool_requests,
+            'connections_opened': connections_opened,
+            'connection_reuse_rate': round(1 - connections_opened / pool_requests, 3) if pool_requests else None,
+            'pool_maxsize': HTTP_POOL_SIZE,
+            'governor': outbound_governor.get_stats(),
+            'dns_cache': dns_cache.get_stats()
+        }
+
+install_http_session()
+
 # Initialize bot with proper token handling
 if BOT_TOKEN and BOT_TOKEN != "dummy_token_for_web_mode":
-    bot = telebot.TeleBot(BOT_TOKEN)
+    bot = telebot.TeleBot(BOT_TOKEN, num_threads=BOT_WORKER_THREADS, use_class_middlewares=True)
 else:
     # Create a dummy bot object for web-only mode - need valid format
-    bot = telebot.TeleBot("12345:DUMMY_TOKEN_FOR_WEB_MODE")
+    bot = telebot.TeleBot("12345:DUMMY_TOKEN_FOR_WEB_MODE", use_class_middlewares=True)
 
 # Apply registration-time safety patching immediately after bot initialization
 # This must happen BEFORE any @bot.message_handler decorators are processed
 clear_existing_handlers()
 patch_telebot_registration()
+bot.setup_middleware(AppContextMiddleware())
 
-# Dictionary to store temporary upload data for guided content creation
-upload_sessions = {}
-
-# Dictionary to store notification composition sessions
-notification_sessions = {}
+# Session stores - owner conversation state (guided uploads, notification drafts)
 
 # Session timeout in seconds (30 minutes)
 SESSION_TIMEOUT = 30 * 60
+# Abandoned guided uploads are dropped after a day
+UPLOAD_SESSION_TIMEOUT = 24 * 60 * 60
+# 'memory' keeps sessions in this process; 'sql' shares them between worker processes
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory').lower()
 
-def cleanup_expired_sessions():
-    """Clean up expired notification sessions"""
-    current_time = time.time()
-    expired_chats = []
+class MemorySessionStore:
+    """Sessions kept in process memory, expired through a heap of deadlines.
+
+    Every set/touch pushes a (deadline, seq, key) entry; eviction pops entries
+    whose deadline has passed and drops the session only if that entry is still
+    its current deadline, so each eviction costs O(log n) instead of a full scan.
+    """
+    
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._sessions = {}  # key -> (deadline, data)
+        self._expiry_heap = []
+        self._seq = itertools.count()
+        self._lock = threading.RLock()
+    
+    def _evict_expired(self, now):
+        evicted = 0
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            deadline, _, key = heapq.heappop(self._expiry_heap)
+            entry = self._sessions.get(key)
+            if entry and entry[0] == deadline:
+                del self._sessions[key]
+                evicted += 1
+        return evicted
+    
+    def get(self, key):
+        with self._lock:
+            self._evict_expired(time.time())
+            entry = self._sessions.get(key)
+            return entry[1] if entry else None
+    
+    def set(self, key, data):
+        with self._lock:
+            deadline = time.time() + self.ttl
+            self._sessions[key] = (deadline, data)
+            heapq.heappush(self._expiry_heap, (deadline, next(self._seq), key))
+    
+    def touch(self, key):
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry:
+                self.set(key, entry[1])
+    
+    def delete(self, key):
+        with self._lock:
+            return self._sessions.pop(key, None) is not None
+    
+    def cleanup(self):
+        with self._lock:
+            return self._evict_expired(time.time())
+
+class PersistedSession(dict):
+    """Session dict that writes itself back to its store whenever it changes"""
+    
+    def __init__(self, store, key, data):
+        super().__init__(data)
+        self._store = store
+        self._key = key
+    
+    def _save(self):
+        self._store.set(self._key, dict(self))
+    
+    def __setitem__(self, name, value):
+        super().__setitem__(name, value)
+        self._save()
+    
+    def __delitem__(self, name):
+        super().__delitem__(name)
+        self._save()
+    
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._save()
+    
+    def pop(self, name, *default):
+        value = super().pop(name, *default)
+        self._save()
+        return value
+
+class SqlSessionStore:
+    """Sessions persisted in the bot_sessions table so every worker process sees them.
+
+    Uses its own short transactions so saving a session never commits (or waits
+    on) the calling handler's pending work.
+    """
     
-    for chat_id, session in notification_sessions.items():
-        if isinstance(session, dict) and 'timestamp' in session:
-            if current_time - session['timestamp'] > SESSION_TIMEOUT:
-                expired_chats.append(chat_id)
+    def __init__(self, namespace, ttl):
+        self.namespace = namespace
+        self.ttl = ttl
     
-    for chat_id in expired_chats:
-        del notification_sessions[chat_id]
-        logger.info(f"Cleaned up expired notification session for chat {chat_id}")
+    @contextmanager
+    def _session(self):
+        with app_context_scope():
+            with Session(db.engine) as session:
+                yield session
     
-    return len(expired_chats)
+    def get(self, key):
+        with self._session() as session:
+            row = session.get(BotSession, (self.namespace, str(key)))
+            if not row or row.expires_at <= datetime.datetime.now():
+                return None
+            return PersistedSession(self, key, json.loads(row.data))
+    
+    def set(self, key, data):
+        with self._session() as session:
+            row = BotSession()
+            row.namespace = self.namespace
+            row.key = str(key)
+            row.data = json.dumps(data)
+            row.expires_at = datetime.datetime.now() + datetime.timedelta(seconds=self.ttl)
+            session.merge(row)
+            session.commit()
+    
+    def touch(self, key):
+        with self._session() as session:
+            session.query(BotSession).filter_by(namespace=self.namespace, key=str(key)).update(
+                {BotSession.expires_at: datetime.datetime.now() + datetime.timedelta(seconds=self.ttl)},
+                synchronize_session=False
+            )
+            session.commit()
+    
+    def delete(self, key):
+        with self._session() as session:
+            deleted = session.query(BotSession).filter_by(namespace=self.namespace, key=str(key)).delete(synchronize_session=False)
+            session.commit()
+            return deleted > 0
+    
+    def cleanup(self):
+        with self._session() as session:
+            evicted = session.query(BotSession).filter(
+                BotSession.namespace == self.namespace,
+                BotSession.expires_at <= datetime.datetime.now()
+            ).delete(synchronize_session=False)
+            session.commit()
+            return evicted
+
+def create_session_store(namespace, ttl):
+    """Create a session store for the configured SESSION_BACKEND"""
+    if SESSION_BACKEND == 'sql':
+        return SqlSessionStore(namespace, ttl)
+    if SESSION_BACKEND != 'memory':
+        logger.warning(f"Unknown SESSION_BACKEND '{SESSION_BACKEND}', using memory")
+    return MemorySessionStore(ttl)
+
+# Temporary upload data for guided content creation
+upload_sessions = create_session_store('upload', UPLOAD_SESSION_TIMEOUT)
+
+# Notification composition sessions
+notification_sessions = create_session_store('notification', SESSION_TIMEOUT)
+
+def cleanup_expired_sessions():
+    """Clean up expired notification sessions"""
+    expired = notification_sessions.cleanup()
+    if expired:
+        logger.info(f"Cleaned up {expired} expired notification session(s)")
+    return expired
+
+def start_notification_session(chat_id, session_data):
+    """Start (or replace) the notification session for a chat"""
+    session_data['timestamp'] = time.time()
+    notification_sessions.set(chat_id, session_data)
+
+def get_notification_session(chat_id):
+    """Get the notification session for a chat - returns None if missing or expired"""
+    session = notification_sessions.get(chat_id)
+    if not isinstance(session, dict):
+        return None
+    return session
+
+def clear_notification_session(chat_id):
+    """Clear the notification session for a chat"""
+    notification_sessions.delete(chat_id)
 
 def is_session_valid(chat_id):
     """Check if notification session is valid and not expired"""
-    if chat_id not in notification_sessions:
-        return False
-    
-    session = notification_sessions[chat_id]
-    if not isinstance(session, dict):
+    session = get_notification_session(chat_id)
+    if session is None:
         return False
     
-    # Check if session has timestamp
-    if 'timestamp' not in session:
-        # Add timestamp to legacy sessions
-        session['timestamp'] = time.time()
-        return True
-    
     # Check if session is expired
-    current_time = time.time()
-    if current_time - session['timestamp'] > SESSION_TIMEOUT:
+    if time.time() - session.get('timestamp', 0) > SESSION_TIMEOUT:
         return False
     
     return True
 
 def update_session_timestamp(chat_id):
     """Update session timestamp to keep it alive"""
-    if chat_id in notification_sessions:
-        notification_sessions[chat_id]['timestamp'] = time.time()
+    session = get_notification_session(chat_id)
+    if session is not None:
+        session['timestamp'] = time.time()
+        notification_sessions.touch(chat_id)
 
 def get_session_info(chat_id):
     """Get session information for debugging"""
-    if chat_id not in notification_sessions:
+    session = get_notification_session(chat_id)
+    if session is None:
         return "No session found"
     
-    session = notification_sessions[chat_id]
-    if not isinstance(session, dict):
-        return "Invalid session format"
-    
     current_time = time.time()
     session_age = current_time - session.get('timestamp', current_time)
     
     info = {
         'target_group': session.get('target_group', 'unknown'),
-        'users_count': len(session.get('users', [])),
+        'users_count': session.get('user_count', 0),
         'waiting_for_message': session.get('waiting_for_message', False),
         'has_message_text': bool(session.get('message_text')),
         'session_age_seconds': int(session_age),
@@ -274,23 +898,15 @@ def get_session_info(chat_id):
 def recover_session_state(chat_id, target_group):
     """Attempt to recover session state after errors"""
     try:
-        # Get fresh user list for the target group
-        if target_group == 'all':
-            users = get_all_users()
-        elif target_group == 'vip':
-            users = get_vip_subscribers()
-        elif target_group == 'non_vip':
-            users = get_non_vip_users()
-        else:
+        if target_group not in ('all', 'vip', 'non_vip'):
             return False
         
         # Recreate session
-        notification_sessions[chat_id] = {
+        start_notification_session(chat_id, {
             'target_group': target_group,
-            'users': users,
-            'waiting_for_message': True,
-            'timestamp': time.time()
-        }
+            'user_count': count_audience(target_group),
+            'waiting_for_message': True
+        })
         
         logger.info(f"Recovered notification session for chat {chat_id}, target: {target_group}")
         return True
@@ -302,7 +918,7 @@ def recover_session_state(chat_id, target_group):
 # Helper functions for session management
 def start_upload_session(owner_id, session_data):
     """Start an upload session for a specific owner"""
-    upload_sessions[owner_id] = session_data
+    upload_sessions.set(owner_id, session_data)
     logger.info(f"Started upload session for owner {owner_id}: {session_data.get('type', 'unknown')}")
 
 def get_upload_session(owner_id):
@@ -314,15 +930,13 @@ def get_upload_session(owner_id):
 
 def clear_upload_session(owner_id):
     """Clear upload session for a specific owner"""
-    if owner_id in upload_sessions:
-        session_type = upload_sessions[owner_id].get('type', 'unknown')
-        del upload_sessions[owner_id]
-        logger.info(f"Cleared upload session for owner {owner_id}: {session_type}")
+    session = upload_sessions.get(owner_id)
+    if session is not None:
+        upload_sessions.delete(owner_id)
+        logger.info(f"Cleared upload session for owner {owner_id}: {session.get('type', 'unknown')}")
 
 def has_upload_session(owner_id, session_type=None, step=None):
     """Check if owner has an upload session with optional type/step filters"""
-    if owner_id not in upload_sessions:
-        return False
     session = upload_sessions.get(owner_id)
     if not isinstance(session, dict):
         return False
@@ -335,7 +949,7 @@ def has_upload_session(owner_id, session_type=None, step=None):
 # Database setup
 def init_database():
     """Initialize PostgreSQL database with required tables and default data"""
-    with app.app_context():
+    with app_context_scope():
         # Tables are already created by models.py, now add default data
     
         # Insert default VIP settings
@@ -371,6 +985,18 @@ def init_database():
     
         
         db.session.commit()
+        
+        # Load the catalog price index used by pre-checkout
+        refresh_catalog_index(force=True)
+        
+        # Seed the payments ledger for databases that predate it
+        if not Payment.query.first() and (UserPurchase.query.first() or VipSubscription.query.first()):
+            backfill_payment_ledger()
+        
+        # Seed analytics counters for databases that predate the counters table
+        if not AnalyticsCounter.query.first() and User.query.first():
+            rebuild_analytics_counters()
+        
         logger.info("Database initialized successfully")
 
 def get_db_connection():
@@ -431,7 +1057,7 @@ def add_or_update_user(user):
         logger.warning(f"Could not get bot info: {e}")
         # Continue processing if we can't get bot info
     
-    with app.app_context():
+    with app_context_scope():
         now = datetime.datetime.now()
         
         # Check if user exists
@@ -453,6 +1079,7 @@ def add_or_update_user(user):
             new_user.last_interaction = now
             new_user.interaction_count = 1
             db.session.add(new_user)
+            bump_analytics_counter('users', when=now)
             
             # Send welcome notification to all owners
             try:
@@ -461,16 +1088,19 @@ def add_or_update_user(user):
                 pass
         
         db.session.commit()
+        if not existing_user:
+            # Bump only once the new row is visible, or a concurrent reader could cache the old audience
+            bump_audience_version()
 
 def check_user_owns_content(user_id, content_name):
     """Check if user has already purchased specific content"""
-    with app.app_context():
+    with app_context_scope():
         purchase = UserPurchase.query.filter_by(user_id=user_id, content_name=content_name).first()
         return purchase is not None
 
 def get_user_purchased_content(user_id):
     """Get all BROWSE content purchased by a user - does not include VIP content"""
-    with app.app_context():
+    with app_context_scope():
         purchases = db.session.query(UserPurchase, ContentItem).join(
             ContentItem, UserPurchase.content_name == ContentItem.name
         ).filter(
@@ -482,60 +1112,286 @@ def get_user_purchased_content(user_id):
                  p.UserPurchase.price_paid, p.ContentItem.description, 
                  p.ContentItem.file_path) for p in purchases]
 
-def get_vip_subscribers():
-    """Get all active VIP subscribers for notifications"""
-    with app.app_context():
-        from sqlalchemy import and_, func
-        
-        # Get active VIP subscribers
-        vip_users = db.session.query(User.user_id, User.first_name, User.username).join(
-        VipSubscription, User.user_id == VipSubscription.user_id
-    ).filter(
-        and_(
+# Audience segments - each predicate compiles to one indexed filter on the users table
+
+def _active_vip_ids():
+    return select(VipSubscription.user_id).where(
+        VipSubscription.is_active == True,
+        VipSubscription.expiry_date > func.now()
+    )
+
+def _segment_filter(name, arg):
+    """Compile one segment predicate into a SQL filter.
+
+    Membership predicates use user_id IN (subquery) so the database can drive
+    the lookup from the smaller purchases / VIP / loyal fan index.
+    """
+    now = datetime.datetime.now()
+    if name == 'spent':
+        return User.total_stars_spent > arg
+    if name == 'active':
+        return User.last_interaction >= now - datetime.timedelta(days=arg)
+    if name == 'owns':
+        return User.user_id.in_(select(UserPurchase.user_id).where(UserPurchase.content_name == arg))
+    if name == 'loyal':
+        return User.user_id.in_(select(LoyalFan.user_id))
+    if name == 'vip':
+        return User.user_id.in_(_active_vip_ids())
+    if name == 'non_vip':
+        return User.user_id.not_in(_active_vip_ids())
+    if name == 'vip_expiring':
+        return User.user_id.in_(select(VipSubscription.user_id).where(
             VipSubscription.is_active == True,
-            VipSubscription.expiry_date > func.now(),
-            User.user_id != OWNER_ID,
-            or_(User.username.is_(None), ~func.lower(User.username).like('%bot'))
-        )
-    ).all()
+            VipSubscription.expiry_date > now,
+            VipSubscription.expiry_date <= now + datetime.timedelta(days=arg)
+        ))
+    if name == 'never_purchased':
+        # Older rows may have no total yet
+        return func.coalesce(User.total_stars_spent, 0) == 0
+    raise ValueError(f"Unknown predicate: {name}")
+
+# Predicate name -> (operator, help text); operator is '>' / '<' for numeric, ':' for text, None for flags
+SEGMENT_PREDICATES = {
+    'spent': ('>', 'spent>N - spent more than N Stars'),
+    'active': ('<', 'active<D - interacted within the last D days'),
+    'owns': (':', 'owns:"Content Name" - purchased that content'),
+    'loyal': (None, 'loyal - marked as a loyal fan'),
+    'vip': (None, 'vip - active VIP member'),
+    'non_vip': (None, 'non_vip - no active VIP subscription'),
+    'vip_expiring': ('<', 'vip_expiring<D - VIP expires within D days'),
+    'never_purchased': (None, 'never_purchased - has never paid'),
+}
+
+# The fixed notification groups are just predefined segments
+AUDIENCE_GROUPS = {
+    'all': '',
+    'vip': 'vip',
+    'non_vip': 'non_vip',
+}
+
+def parse_segment(text):
+    """Parse 'spent>100 active<30 owns:"Name"' into a list of (name, arg) predicates.
+
+    Raises ValueError with a user-facing message on bad input.
+    """
+    try:
+        tokens = shlex.split(text or '')
+    except ValueError as e:
+        raise ValueError(f"Could not parse segment: {e}")
+    
+    predicates = []
+    for token in tokens:
+        match = re.match(r'([A-Za-z_]+)([<>:]?)(.*)', token, re.S)
+        name = match.group(1).lower() if match else token
+        if name not in SEGMENT_PREDICATES:
+            raise ValueError(f"Unknown predicate: {token}")
+        
+        operator, usage = SEGMENT_PREDICATES[name]
+        raw = match.group(3).strip()
+        if (match.group(2) or None) != operator or (operator is None and raw):
+            raise ValueError(f"Expected {usage}")
+        
+        if operator is None:
+            predicates.append((name, None))
+        elif operator == ':':
+            if not raw:
+                raise ValueError(f"Expected {usage}")
+            predicates.append((name, raw))
+        else:
+            if not raw.isdigit():
+                raise ValueError(f"Expected {usage}")
+            predicates.append((name, int(raw)))
+    
+    # One entry per predicate/argument, in a stable order so equal segments share a cache entry
+    return sorted(set(predicates), key=lambda p: (p[0], str(p[1])))
+
+def format_segment(predicates):
+    """Render parsed predicates back to their canonical text form"""
+    parts = []
+    for name, arg in predicates:
+        operator = SEGMENT_PREDICATES[name][0]
+        if operator is None:
+            parts.append(name)
+        elif operator == ':':
+            parts.append(f"{name}:{shlex.quote(arg)}")
+        else:
+            parts.append(f"{name}{operator}{arg}")
+    return ' '.join(parts)
+
+def get_audience_query(target_group, session=None, segment=None):
+    """Build the (user_id, first_name, username) recipient query for a notification group.
+
+    target_group is 'all', 'vip', 'non_vip' or 'segment' (with segment holding the
+    predicate text). Returns None for unknown groups. Nothing is loaded until the
+    caller runs the query.
+    """
+    spec = segment if target_group == 'segment' else AUDIENCE_GROUPS.get(target_group)
+    if spec is None:
+        return None
     
-    return vip_users
+    session = session or db.session
+    recipients = session.query(User.user_id, User.first_name, User.username)
+    # Never notify the owner or bot accounts
+    filters = [
+        User.user_id != OWNER_ID,
+        or_(User.username.is_(None), ~func.lower(User.username).like('%bot'))
+    ]
+    filters.extend(_segment_filter(name, arg) for name, arg in parse_segment(spec))
+    return recipients.filter(and_(*filters))
+
+AUDIENCE_COUNT_TTL_SECONDS = 60
+audience_count_cache = {}
+audience_count_cache_lock = threading.Lock()
+# Bumped on writes that move users between segments (new users, payments, loyal fan changes)
+audience_version = 0
+
+def bump_audience_version():
+    """Invalidate cached audience counts"""
+    global audience_version
+    with audience_count_cache_lock:
+        audience_version += 1
+
+def count_audience(target_group, segment=None):
+    """Count recipients in a notification group with a single COUNT query.
+
+    This is a cache over an O(n) COUNT, not a maintained segment-size table:
+    segments combine arbitrary predicates and VIP membership lapses with time,
+    so no write path could keep their sizes exact. Counts are cached per
+    catalog/audience version; the TTL covers the time-based predicates and
+    writes made by other processes.
+    """
+    key = (target_group, segment, catalog_index['version'], audience_version)
+    with audience_count_cache_lock:
+        cached = audience_count_cache.get(key)
+    if cached and time.time() - cached[1] < AUDIENCE_COUNT_TTL_SECONDS:
+        return cached[0]
+    
+    with app_context_scope():
+        query = get_audience_query(target_group, get_read_session(), segment)
+        count = query.with_entities(func.count(User.user_id)).scalar() if query is not None else 0
+    
+    # Only keep the latest entry per audience
+    with audience_count_cache_lock:
+        for stale in [k for k in audience_count_cache if k[:2] == key[:2]]:
+            del audience_count_cache[stale]
+        audience_count_cache[key] = (count, time.time())
+    return count
+
+def get_audience_users(target_group, segment=None):
+    """Load the recipients of a notification group - only called when actually sending"""
+    with app_context_scope():
+        query = get_audience_query(target_group, segment=segment)
+        return query.all() if query is not None else []
+
+def get_vip_subscribers():
+    """Get all active VIP subscribers for notifications"""
+    return get_audience_users('vip')
 
 def get_non_vip_users():
     """Get all non-VIP users (users without active VIP subscriptions) for notifications"""
-    with app.app_context():
-        from sqlalchemy import and_, func, or_
-        
-        # Get users who are not VIP subscribers (no active subscription or expired)
-        non_vip_users = db.session.query(User.user_id, User.first_name, User.username).outerjoin(
-        VipSubscription, User.user_id == VipSubscription.user_id
-    ).filter(
-        and_(
-            or_(
-                VipSubscription.user_id.is_(None),
-                VipSubscription.is_active == False,
-                VipSubscription.expiry_date <= func.now()
-            ),
-            User.user_id != OWNER_ID,
-            or_(User.username.is_(None), ~func.lower(User.username).like('%bot'))
+    return get_audience_users('non_vip')
+
+# Optional asyncio runtime for broadcasts: with TELEGRAM_RUNTIME=async, notifications and
+# scheduled posts go out through AsyncTeleBot on one shared event loop, so a large send
+# keeps many API calls in flight without a thread per call. Update handlers, payments and
+# fulfillment always stay on the synchronous TeleBot
+TELEGRAM_RUNTIME = os.getenv('TELEGRAM_RUNTIME', 'sync').lower()
+ASYNC_SEND_CONCURRENCY = int(os.getenv('ASYNC_SEND_CONCURRENCY', '50'))
+
+async_runtime = {'loop': None, 'bot': None}
+async_runtime_lock = threading.Lock()
+
+def get_async_runtime():
+    """Start the shared event loop thread and AsyncTeleBot on first use"""
+    with async_runtime_lock:
+        if async_runtime['loop'] is None:
+            # Imported here so the default sync runtime does not need aiohttp installed
+            from telebot import asyncio_helper
+            from telebot.async_telebot import AsyncTeleBot
+            
+            loop = asyncio.new_event_loop()
+            loop_thread = threading.Thread(target=loop.run_forever, name='telegram-async-loop')
+            loop_thread.daemon = True
+            loop_thread.start()
+            # One aiohttp connection per concurrent sender
+            asyncio_helper.REQUEST_LIMIT = ASYNC_SEND_CONCURRENCY
+            if TELEGRAM_API_URL:
+                asyncio_helper.API_URL = TELEGRAM_API_URL.rstrip('/') + '/bot{0}/{1}'
+            async_runtime['bot'] = AsyncTeleBot(BOT_TOKEN)
+            async_runtime['loop'] = loop
+            logger.info(f"Async Telegram runtime started ({ASYNC_SEND_CONCURRENCY} concurrent sends)")
+    return async_runtime['loop'], async_runtime['bot']
+
+def run_async(coroutine):
+    """Run a coroutine on the shared event loop and wait for its result"""
+    loop, _ = get_async_runtime()
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+def send_notification(user_id, message_text, markup=None, pin_message=False):
+    """Send (and optionally pin) one notification - returns the send error, or None on success"""
+    try:
+        sent_message = bot.send_message(
+            user_id, 
+            message_text, 
+            reply_markup=markup, 
+            parse_mode='HTML',
+            disable_notification=False
         )
-    ).all()
+    except Exception as e:
+        return e
     
-    return non_vip_users
-
-def get_all_users():
-    """Get all users for general notifications"""
-    with app.app_context():
-        from sqlalchemy import and_, func, or_
+    # Pin message if requested and successfully sent
+    if pin_message and sent_message:
+        try:
+            bot.pin_chat_message(user_id, sent_message.message_id, disable_notification=True)
+        except Exception as pin_error:
+            logger.warning(f"Failed to pin message for user {user_id}: {pin_error}")
+    return None
+
+async def send_notification_async(async_bot, user_id, message_text, markup=None, pin_message=False):
+    """Async twin of send_notification for the asyncio runtime"""
+    for attempt in range(TELEGRAM_RATE_LIMIT_RETRIES + 1):
+        # Broadcasts yield to interactive replies and fulfillment in the shared governor
+        wait = outbound_governor.try_acquire(user_id, 'broadcast')
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = outbound_governor.try_acquire(user_id, 'broadcast')
         
-        all_users = db.session.query(User.user_id, User.first_name, User.username).filter(
-            and_(
-                User.user_id != OWNER_ID,
-                or_(User.username.is_(None), ~func.lower(User.username).like('%bot'))
+        try:
+            sent_message = await async_bot.send_message(
+                user_id,
+                message_text,
+                reply_markup=markup,
+                parse_mode='HTML',
+                disable_notification=False
             )
-        ).order_by(User.last_interaction.desc()).all()
-        
-        return all_users
+            outbound_governor.record_success()
+            break
+        except Exception as e:
+            if getattr(e, 'error_code', None) != 429 or attempt == TELEGRAM_RATE_LIMIT_RETRIES:
+                return e
+            outbound_governor.record_rate_limit(get_retry_after(getattr(e, 'result_json', None)))
+    
+    if pin_message and sent_message:
+        try:
+            await async_bot.pin_chat_message(user_id, sent_message.message_id, disable_notification=True)
+        except Exception as pin_error:
+            logger.warning(f"Failed to pin message for user {user_id}: {pin_error}")
+    return None
+
+async def send_notifications_async(recipients, message_text, markup=None, pin_message=False):
+    """Send to every recipient with ASYNC_SEND_CONCURRENCY sends in flight; returns errors in order"""
+    _, async_bot = get_async_runtime()
+    results = [None] * len(recipients)
+    # Fixed pool of senders pulling from one shared iterator - no task per recipient
+    pending = iter(range(len(recipients)))
+    
+    async def sender():
+        for index in pending:
+            results[index] = await send_notification_async(async_bot, recipients[index][0], message_text, markup, pin_message)
+    
+    await asyncio.gather(*(sender() for _ in range(max(1, min(ASYNC_SEND_CONCURRENCY, len(recipients))))))
+    return results
 
 def send_notification_to_users(user_list, message_text, markup=None, pin_message=False):
     """
@@ -555,42 +1411,32 @@ def send_notification_to_users(user_list, message_text, markup=None, pin_message
     blocked_count = 0
     failed_users = []
     
-    for user_id, first_name, username in user_list:
-        try:
-            # Don't send to bot owner to avoid spam
-            if is_owner(user_id):
-                continue
-                
-            # Send the notification
-            sent_message = bot.send_message(
-                user_id, 
-                message_text, 
-                reply_markup=markup, 
-                parse_mode='HTML',
-                disable_notification=False
-            )
-            
-            # Pin message if requested and successfully sent
-            if pin_message and sent_message:
-                try:
-                    bot.pin_chat_message(user_id, sent_message.message_id, disable_notification=True)
-                except Exception as pin_error:
-                    logger.warning(f"Failed to pin message for user {user_id}: {pin_error}")
-            
+    # Don't send to bot owner to avoid spam
+    recipients = [user for user in user_list if not is_owner(user[0])]
+    
+    if TELEGRAM_RUNTIME == 'async':
+        errors = run_async(send_notifications_async(recipients, message_text, markup, pin_message))
+    else:
+        # Broadcasts yield to interactive replies and fulfillment
+        with outbound_priority('broadcast'):
+            errors = [send_notification(user_id, message_text, markup, pin_message) for user_id, _, _ in recipients]
+    
+    for (user_id, first_name, username), error in zip(recipients, errors):
+        if error is None:
             sent_count += 1
             logger.info(f"Notification sent to {first_name} (@{username}) - ID: {user_id}")
-            
-        except Exception as e:
-            # Check if it's a Telegram API exception indicating user blocked the bot
-            error_str = str(e).lower()
-            if "403" in error_str or "forbidden" in error_str or "blocked" in error_str:
-                # User blocked the bot
-                blocked_count += 1
-                logger.info(f"User {first_name} (@{username}) has blocked the bot")
-            else:
-                failed_count += 1
-                failed_users.append((user_id, first_name, username, str(e)))
-                logger.error(f"Failed to send notification to {first_name} (@{username}): {e}")
+            continue
+        
+        # Check if it's a Telegram API exception indicating user blocked the bot
+        error_str = str(error).lower()
+        if "403" in error_str or "forbidden" in error_str or "blocked" in error_str:
+            # User blocked the bot
+            blocked_count += 1
+            logger.info(f"User {first_name} (@{username}) has blocked the bot")
+        else:
+            failed_count += 1
+            failed_users.append((user_id, first_name, username, str(error)))
+            logger.error(f"Failed to send notification to {first_name} (@{username}): {error}")
     
     return {
         'sent': sent_count,
@@ -600,6 +1446,12 @@ def send_notification_to_users(user_list, message_text, markup=None, pin_message
         'total_targeted': len(user_list)
     }
 
+def start_broadcast_job(notify, *args):
+    """Run a notification broadcast in a background thread instead of the update's thread"""
+    broadcast_thread = threading.Thread(target=notify, args=args)
+    broadcast_thread.daemon = True
+    broadcast_thread.start()
+
 def notify_vip_teaser_uploaded(teaser_description):
     """Send notification to all VIP subscribers about new VIP teaser"""
     vip_users = get_vip_subscribers()
@@ -711,7 +1563,7 @@ def deliver_owned_content(chat_id, user_id, content_name):
         return False
     
     # Get content details
-    with app.app_context():
+    with app_context_scope():
         content_item = ContentItem.query.filter_by(name=content_name).first()
         
         if not content_item:
@@ -757,14 +1609,8 @@ def deliver_owned_content(chat_id, user_id, content_name):
                     except:
                         bot.send_message(chat_id, f"🎁 Your content: {content_name}\n\nFile ID: {file_path}\n\n⚠️ If you have trouble accessing this content, please contact me!")
         else:
-            # It's a local file path
-            with open(file_path, 'rb') as file:
-                if any(ext in file_path.lower() for ext in ['.jpg', '.jpeg', '.png', '.gif']):
-                    bot.send_photo(chat_id, file, caption=f"🎁 {content_name}")
-                elif any(ext in file_path.lower() for ext in ['.mp4', '.mov', '.avi']):
-                    bot.send_video(chat_id, file, caption=f"🎁 {content_name}")
-                else:
-                    bot.send_document(chat_id, file, caption=f"🎁 {content_name}")
+            # It's a local file path - uploaded once, then sent by its registered file_id
+            send_local_media(chat_id, file_path, f"🎁 {content_name}")
     except Exception as e:
         bot.send_message(chat_id, f"🎁 Your owned content: {content_name}\n\n⚠️ There was an issue delivering your content. Please contact me and I'll send it manually!")
         logger.error(f"Error sending owned content {content_name}: {e}")
@@ -828,34 +1674,375 @@ Step into my world and Browse the exclusive content you’ve been craving.
     
     bot.send_message(chat_id, library_text, reply_markup=markup, parse_mode='HTML')
 
+# Analytics counters - maintained incrementally so dashboards read a few rows instead of scanning users
+
+ANALYTICS_TOTAL_BUCKET = 'all'
+
+def _upsert_increment(model, keys, increments):
+    """Atomically add increments to the row of model identified by keys, creating it if missing (does not commit)"""
+    table = model.__table__
+    dialect = db.session.get_bind().dialect.name
+    values = dict(keys, **increments)
+
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+        stmt = dialect_insert(table).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={column: table.c[column] + stmt.excluded[column] for column in increments}
+        )
+        db.session.execute(stmt)
+        return
+
+    # Generic fallback for other databases
+    updated = model.query.filter_by(**keys).update(
+        {table.c[column]: table.c[column] + amount for column, amount in increments.items()},
+        synchronize_session=False
+    )
+    if not updated:
+        db.session.execute(table.insert().values(**values))
+
+def _increment_analytics_row(bucket, metric, amount):
+    """Atomically add amount to one counter row, creating it if missing (does not commit)"""
+    _upsert_increment(AnalyticsCounter, {'bucket': bucket, 'metric': metric}, {'value': amount})
+
+def bump_analytics_counter(metric, amount=1, when=None):
+    """Add amount to today's bucket and the running total for metric.
+
+    Runs inside the caller's session so the counter update commits (or rolls back)
+    together with the change it describes.
+    """
+    if not amount:
+        return
+    day = (when or datetime.datetime.now()).date().isoformat()
+    _increment_analytics_row(day, metric, amount)
+    _increment_analytics_row(ANALYTICS_TOTAL_BUCKET, metric, amount)
+
+def record_payment_counters(first_payment, amount, kind):
+    """Update revenue counters for a payment; first_payment is True when the user had spent nothing before it"""
+    if first_payment and amount > 0:
+        bump_analytics_counter('paying_users')
+    bump_analytics_counter('revenue_stars', amount)
+    bump_analytics_counter(f'{kind}_revenue_stars', amount)
+
+def get_analytics_totals():
+    """Get running totals for all analytics metrics as a dict"""
+    with app_context_scope():
+        read_db = get_read_session()
+        rows = read_db.query(AnalyticsCounter).filter_by(bucket=ANALYTICS_TOTAL_BUCKET).all()
+        return {row.metric: row.value for row in rows}
+
+def get_analytics_day(day=None):
+    """Get counter values for a single day bucket (defaults to today) as a dict"""
+    bucket = (day or datetime.date.today()).isoformat()
+    with app_context_scope():
+        read_db = get_read_session()
+        rows = read_db.query(AnalyticsCounter).filter_by(bucket=bucket).all()
+        return {row.metric: row.value for row in rows}
+
+def compute_analytics_totals():
+    """Compute running totals from the source tables (full scan - used by rebuild and consistency check)"""
+    with app_context_scope():
+        return {
+            'users': User.query.count(),
+            'paying_users': User.query.filter(User.total_stars_spent > 0).count(),
+            'revenue_stars': db.session.query(func.coalesce(func.sum(User.total_stars_spent), 0)).scalar(),
+            'content_revenue_stars': db.session.query(func.coalesce(func.sum(UserPurchase.price_paid), 0)).scalar(),
+            'purchases': UserPurchase.query.count(),
+            'vip_payments': db.session.query(func.coalesce(func.sum(VipSubscription.total_payments), 0)).scalar(),
+        }
+
+def rebuild_analytics_counters():
+    """Rebuild the analytics counters table from scratch"""
+    with app_context_scope():
+        totals = compute_analytics_totals()
+        # Running totals stay anchored to total_stars_spent, so VIP revenue is the remainder
+        totals['vip_revenue_stars'] = max(totals['revenue_stars'] - totals['content_revenue_stars'], 0)
+
+        rows = {}
+
+        def add(bucket, metric, value):
+            if value:
+                rows[(str(bucket), metric)] = rows.get((str(bucket), metric), 0) + int(value)
+
+        for metric, value in totals.items():
+            add(ANALYTICS_TOTAL_BUCKET, metric, value)
+
+        # Daily buckets that can be reconstructed from timestamps
+        joins = db.session.query(func.date(User.join_date), func.count(User.user_id)).group_by(func.date(User.join_date)).all()
+        for day, count in joins:
+            if day:
+                add(day, 'users', count)
+
+        purchases = db.session.query(
+            func.date(UserPurchase.purchase_date), func.count(UserPurchase.id)
+        ).group_by(func.date(UserPurchase.purchase_date)).all()
+        for day, count in purchases:
+            if day:
+                add(day, 'purchases', count)
+
+        # Daily revenue comes from the payments ledger, which covers VIP payments too
+        revenue = db.session.query(
+            func.date(Payment.paid_at), Payment.kind, func.sum(Payment.amount)
+        ).group_by(func.date(Payment.paid_at), Payment.kind).all()
+        for day, kind, amount in revenue:
+            if day:
+                add(day, 'revenue_stars', amount)
+                add(day, f'{kind}_revenue_stars', amount)
+
+        try:
+            AnalyticsCounter.query.delete()
+            for (bucket, metric), value in rows.items():
+                counter = AnalyticsCounter()
+                counter.bucket = bucket
+                counter.metric = metric
+                counter.value = value
+                db.session.add(counter)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        logger.info(f"Rebuilt analytics counters: {len(rows)} rows")
+        return len(rows)
+
+def check_analytics_counters():
+    """Compare stored running totals against the source tables.
+
+    Returns:
+        list: (metric, stored_value, actual_value) tuples for every metric that drifted
+    """
+    # Compare against the primary so replica lag is not reported as drift
+    with app_context_scope():
+        rows = AnalyticsCounter.query.filter_by(bucket=ANALYTICS_TOTAL_BUCKET).all()
+        stored = {row.metric: row.value for row in rows}
+    actual = compute_analytics_totals()
+    return [(metric, stored.get(metric, 0), value) for metric, value in actual.items() if stored.get(metric, 0) != value]
+
+# Payments ledger - every Stars payment is appended here and folded into revenue and cohort rollups
+
+REVENUE_PERIODS = ('day', 'week', 'month')
+
+def period_start(period, when):
+    """Get the first day of the day/week/month bucket containing when"""
+    day = when.date() if isinstance(when, datetime.datetime) else when
+    if period == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return day
+
+def _revenue_increments(kind, amount):
+    """Column increments applied to a revenue rollup row for one payment"""
+    increments = {'payments': 1, 'revenue': amount}
+    if kind in ('content', 'vip'):
+        increments[f'{kind}_revenue'] = amount
+    return increments
+
+def record_payment(user_id, kind, amount, content_name=None, charge_id=None, when=None):
+    """Append a payment to the ledger and update revenue and cohort rollups.
+
+    Runs inside the caller's session (does not commit) so the ledger row and
+    rollups land in the same transaction as the purchase they describe.
+    """
+    when = when or datetime.datetime.now()
+    month = period_start('month', when)
+
+    # Cohort is the month of the user's first payment; count the user once per active month
+    first_paid = db.session.query(func.min(Payment.paid_at)).filter(Payment.user_id == user_id).scalar()
+    if first_paid is None:
+        cohort = month
+        new_in_month = True
+    else:
+        cohort = period_start('month', first_paid)
+        month_begin = datetime.datetime.combine(month, datetime.time.min)
+        new_in_month = db.session.query(Payment.id).filter(
+            Payment.user_id == user_id, Payment.paid_at >= month_begin
+        ).first() is None
+
+    payment = Payment()
+    payment.user_id = user_id
+    payment.kind = kind
+    payment.content_name = content_name
+    payment.amount = amount
+    payment.telegram_payment_charge_id = charge_id
+    payment.paid_at = when
+    db.session.add(payment)
+
+    increments = _revenue_increments(kind, amount)
+    for period in REVENUE_PERIODS:
+        _upsert_increment(RevenueRollup, {'period': period, 'bucket_start': period_start(period, when)}, increments)
+
+    _upsert_increment(CohortActivity, {'cohort_month': cohort, 'activity_month': month},
+                      {'users': 1 if new_in_month else 0, 'revenue': amount})
+    return payment
+
+def backfill_payment_ledger():
+    """Seed an empty ledger from purchase and VIP history recorded before the ledger existed.
+
+    Content purchases are copied one-to-one. VIP renewals were never stored individually,
+    so each subscriber gets a single VIP entry at their start date for whatever part of
+    total_stars_spent is not explained by content purchases.
+    """
+    with app_context_scope():
+        if Payment.query.first():
+            return 0
+
+        content_spent = {}
+        added = 0
+        for purchase in UserPurchase.query.order_by(UserPurchase.id).yield_per(500):
+            payment = Payment()
+            payment.user_id = purchase.user_id
+            payment.kind = 'content'
+            payment.content_name = purchase.content_name
+            payment.amount = purchase.price_paid or 0
+            payment.paid_at = purchase.purchase_date or datetime.datetime.now()
+            db.session.add(payment)
+            content_spent[purchase.user_id] = content_spent.get(purchase.user_id, 0) + payment.amount
+            added += 1
+
+        vip_history = db.session.query(
+            VipSubscription.user_id, VipSubscription.start_date, User.total_stars_spent
+        ).join(User, User.user_id == VipSubscription.user_id).filter(VipSubscription.total_payments > 0).all()
+        for user_id, start_date, total_spent in vip_history:
+            amount = (total_spent or 0) - content_spent.get(user_id, 0)
+            if amount <= 0:
+                continue
+            # start_date is a DateTime column; only subscriptions without one are dated now
+            paid_at = start_date or datetime.datetime.now()
+            payment = Payment()
+            payment.user_id = user_id
+            payment.kind = 'vip'
+            payment.amount = amount
+            payment.paid_at = paid_at
+            db.session.add(payment)
+            added += 1
+
+        db.session.commit()
+        logger.info(f"Backfilled payments ledger with {added} entries")
+
+    rebuild_revenue_rollups()
+    return added
+
+def rebuild_revenue_rollups():
+    """Rebuild revenue and cohort rollups from the payments ledger"""
+    with app_context_scope():
+        rollups = {}
+        cohorts = {}
+        first_month = {}
+        active_months = set()
+
+        ledger = db.session.query(Payment.user_id, Payment.kind, Payment.amount, Payment.paid_at).order_by(Payment.paid_at, Payment.id)
+        for user_id, kind, amount, paid_at in ledger.yield_per(1000):
+            for column, value in _revenue_increments(kind, amount).items():
+                for period in REVENUE_PERIODS:
+                    key = (period, period_start(period, paid_at))
+                    rollups.setdefault(key, {})
+                    rollups[key][column] = rollups[key].get(column, 0) + value
+
+            month = period_start('month', paid_at)
+            cohort_key = (first_month.setdefault(user_id, month), month)
+            cohort = cohorts.setdefault(cohort_key, {'users': 0, 'revenue': 0})
+            if (user_id, month) not in active_months:
+                active_months.add((user_id, month))
+                cohort['users'] += 1
+            cohort['revenue'] += amount
+
+        try:
+            RevenueRollup.query.delete()
+            CohortActivity.query.delete()
+            for (period, bucket_start), values in rollups.items():
+                rollup = RevenueRollup()
+                rollup.period = period
+                rollup.bucket_start = bucket_start
+                rollup.payments = values.get('payments', 0)
+                rollup.revenue = values.get('revenue', 0)
+                rollup.content_revenue = values.get('content_revenue', 0)
+                rollup.vip_revenue = values.get('vip_revenue', 0)
+                db.session.add(rollup)
+            for (cohort_month, activity_month), values in cohorts.items():
+                cell = CohortActivity()
+                cell.cohort_month = cohort_month
+                cell.activity_month = activity_month
+                cell.users = values['users']
+                cell.revenue = values['revenue']
+                db.session.add(cell)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        logger.info(f"Rebuilt revenue rollups: {len(rollups)} buckets, {len(cohorts)} cohort cells")
+        return len(rollups)
+
+def get_revenue_series(period='day', limit=14):
+    """Get the most recent revenue rollup buckets for period, newest first"""
+    with app_context_scope():
+        read_db = get_read_session()
+        rows = read_db.query(RevenueRollup).filter_by(period=period).order_by(RevenueRollup.bucket_start.desc()).limit(limit).all()
+        return [(row.bucket_start, row.payments, row.revenue, row.content_revenue, row.vip_revenue) for row in rows]
+
+def get_cohort_retention(months=6):
+    """Get paying-user retention for the most recent cohorts.
+
+    Returns:
+        list: (cohort_month, cohort_size, [users active in month 0, 1, 2, ...]) oldest cohort first
+    """
+    with app_context_scope():
+        read_db = get_read_session()
+        cohort_months = [row[0] for row in read_db.query(CohortActivity.cohort_month).distinct()
+                         .order_by(CohortActivity.cohort_month.desc()).limit(months).all()]
+        if not cohort_months:
+            return []
+
+        cells = read_db.query(CohortActivity).filter(CohortActivity.cohort_month.in_(cohort_months)).all()
+
+    grid = {}
+    for cell in cells:
+        offset = (cell.activity_month.year - cell.cohort_month.year) * 12 + cell.activity_month.month - cell.cohort_month.month
+        grid.setdefault(cell.cohort_month, {})[offset] = cell.users
+
+    retention = []
+    for cohort_month in sorted(cohort_months):
+        row = grid.get(cohort_month, {})
+        width = max(row) + 1 if row else 1
+        retention.append((cohort_month, row.get(0, 0), [row.get(offset, 0) for offset in range(width)]))
+    return retention
+
 def show_analytics_dashboard(chat_id):
     """Show comprehensive analytics dashboard"""
-    with app.app_context():
+    with app_context_scope():
+        read_db = get_read_session()
         from sqlalchemy import func
         from datetime import timedelta
         
-        # Get user statistics
-        total_users = User.query.count()
+        # Get user statistics from the incrementally maintained counters
+        totals = get_analytics_totals()
+        today = get_analytics_day()
+        total_users = totals.get('users', 0)
+        paying_users = totals.get('paying_users', 0)
         
         week_ago = datetime.datetime.now() - timedelta(days=7)
-        active_users_7d = User.query.filter(User.last_interaction >= week_ago).count()
-        
-        paying_users = User.query.filter(User.total_stars_spent > 0).count()
+        active_users_7d = read_db.query(User).filter(User.last_interaction >= week_ago).count()
         
         # Get VIP statistics
-        active_vips = VipSubscription.query.filter_by(is_active=True).count()
+        active_vips = read_db.query(VipSubscription).filter_by(is_active=True).count()
         
         # Get content statistics
-        browse_content_count = ContentItem.query.filter_by(content_type='browse').count()
-        vip_content_count = ContentItem.query.filter_by(content_type='vip').count()
-        teaser_count = Teaser.query.count()
+        browse_content_count = read_db.query(ContentItem).filter_by(content_type='browse').count()
+        vip_content_count = read_db.query(ContentItem).filter_by(content_type='vip').count()
+        teaser_count = read_db.query(Teaser).count()
         
         # Get revenue statistics
-        total_revenue = db.session.query(func.sum(User.total_stars_spent)).scalar() or 0
-        avg_spent = db.session.query(func.avg(User.total_stars_spent)).filter(User.total_stars_spent > 0).scalar() or 0
+        total_revenue = totals.get('revenue_stars', 0)
+        avg_spent = total_revenue / paying_users if paying_users else 0
         
         # Get top customers
-        top_customers_query = User.query.filter(User.total_stars_spent > 0).order_by(User.total_stars_spent.desc()).limit(5).all()
+        top_customers_query = read_db.query(User).filter(User.total_stars_spent > 0).order_by(User.total_stars_spent.desc()).limit(5).all()
         top_customers = [(u.first_name, u.username, u.total_stars_spent, u.interaction_count) for u in top_customers_query]
     
     analytics_text = f"""📊 <b>ANALYTICS DASHBOARD</b> 📊
@@ -871,6 +2058,10 @@ def show_analytics_dashboard(chat_id):
 • Average per Customer: {avg_spent:,.0f} Stars
 • Conversion Rate: {(paying_users/max(total_users,1)*100):.1f}%
 
+📅 <b>Today:</b>
+• New Users: {today.get('users', 0):,}
+• Revenue: {today.get('revenue_stars', 0):,} Stars
+
 📱 <b>Content:</b>
 • Browse Content: {browse_content_count}
 • VIP Content: {vip_content_count}
@@ -895,7 +2086,7 @@ def show_analytics_dashboard(chat_id):
 
 def get_ai_response(message_text):
     """Get response based on message content"""
-    with app.app_context():
+    with app_context_scope():
         message_lower = message_text.lower()
         
         # Determine response type based on keywords
@@ -917,44 +2108,76 @@ def get_ai_response(message_text):
         
         return response
 
-def get_teasers():
-    """Get all regular (non-VIP) teasers from database"""
-    with app.app_context():
-        teasers = Teaser.query.filter_by(vip_only=False).order_by(Teaser.created_date.desc()).all()
-        return [(t.file_path, t.file_type, t.description) for t in teasers]
-
 def get_teasers_with_id():
     """Get all regular (non-VIP) teasers with IDs for management"""
-    with app.app_context():
+    with app_context_scope():
         teasers = Teaser.query.filter_by(vip_only=False).order_by(Teaser.created_date.desc()).all()
         return [(t.id, t.file_path, t.file_type, t.description, t.created_date) for t in teasers]
 
-def get_vip_teasers():
-    """Get all VIP-only teasers from database"""
-    with app.app_context():
-        teasers = Teaser.query.filter_by(vip_only=True).order_by(Teaser.created_date.desc()).all()
-        return [(t.file_path, t.file_type, t.description) for t in teasers]
-
 def get_vip_teasers_with_id():
     """Get all VIP-only teasers with IDs for management"""
-    with app.app_context():
+    with app_context_scope():
         teasers = Teaser.query.filter_by(vip_only=True).order_by(Teaser.created_date.desc()).all()
         return [(t.id, t.file_path, t.file_type, t.description, t.created_date) for t in teasers]
 
+# Teaser pages are cached per catalog version, so /teaser needs no queries until a teaser changes
+TEASER_COLLECTION_SIZE = 5
+teaser_cache = {}  # (kind, vip_only) -> (catalog version, value)
+
+def cached_teaser_lookup(kind, vip_only, loader):
+    """Return a cached teaser lookup, reloading it when the catalog version has moved on"""
+    if catalog_index['version'] is None:
+        refresh_catalog_index()
+    version = catalog_index['version']
+    
+    cached = teaser_cache.get((kind, vip_only))
+    if cached and cached[0] == version:
+        return cached[1]
+    
+    with app_context_scope():
+        value = loader()
+    teaser_cache[(kind, vip_only)] = (version, value)
+    return value
+
+def get_teaser_page(vip_only=False, limit=TEASER_COLLECTION_SIZE, offset=0):
+    """Get one newest-first page of teasers for a tier as (file_path, file_type, description) tuples"""
+    rows = db.session.query(Teaser.file_path, Teaser.file_type, Teaser.description) \
+        .filter(Teaser.vip_only == vip_only) \
+        .order_by(Teaser.created_date.desc(), Teaser.id.desc()) \
+        .limit(limit).offset(offset).all()
+    return [tuple(row) for row in rows]
+
+def get_latest_teaser(vip_only=False):
+    """Get the most recent teaser for a tier, or None"""
+    def load():
+        page = get_teaser_page(vip_only, limit=1)
+        return page[0] if page else None
+    return cached_teaser_lookup('latest', vip_only, load)
+
+def get_teaser_collection(vip_only=True):
+    """Get (total count, first TEASER_COLLECTION_SIZE teasers) for a tier"""
+    def load():
+        total = db.session.query(func.count(Teaser.id)).filter(Teaser.vip_only == vip_only).scalar()
+        return total, get_teaser_page(vip_only)
+    return cached_teaser_lookup('collection', vip_only, load)
+
 def delete_teaser(teaser_id):
     """Delete a teaser by ID"""
-    with app.app_context():
+    with app_context_scope():
         teaser = Teaser.query.filter_by(id=teaser_id).first()
-        if teaser:
-            db.session.delete(teaser)
-            db.session.commit()
-            return True
-        return False
+        if not teaser:
+            return False
+        db.session.delete(teaser)
+        db.session.commit()
+    
+    # Teaser caches follow the catalog version, in this process and the others
+    bump_catalog_version()
+    return True
 
 def add_teaser(file_path, file_type, description, vip_only=False):
     """Add a teaser to the database"""
     try:
-        with app.app_context():
+        with app_context_scope():
             logger.info(f"Creating teaser object: file_path={file_path}, file_type={file_type}, vip_only={vip_only}")
             new_teaser = Teaser()
             new_teaser.file_path = file_path
@@ -970,6 +2193,9 @@ def add_teaser(file_path, file_type, description, vip_only=False):
             db.session.commit()
             
             logger.info(f"Teaser saved successfully with ID: {new_teaser.id}")
+        
+        # Teaser caches follow the catalog version, in this process and the others
+        bump_catalog_version()
             
     except Exception as e:
         logger.error(f"Error in add_teaser function: {e}")
@@ -988,7 +2214,7 @@ def start_vip_upload_session(chat_id, user_id):
         return
     
     # Initialize VIP upload session
-    upload_sessions[OWNER_ID] = {
+    start_upload_session(OWNER_ID, {
         'type': 'vip_content',
         'step': 'waiting_for_file',
         'content_type': 'vip',
@@ -997,7 +2223,7 @@ def start_vip_upload_session(chat_id, user_id):
         'description': None,
         'file_path': None,
         'file_type': None
-    }
+    })
     
     upload_text = """
 💎 <b>VIP CONTENT UPLOAD</b> 💎
@@ -1026,7 +2252,7 @@ Send me the file you want to add as VIP content:
 def handle_vip_file_upload(message, file_id, file_type):
     """Handle VIP content file upload"""
     logger.info(f"VIP content handler called - Content type: {message.content_type}, File type: {file_type}")
-    session = upload_sessions[OWNER_ID]
+    session = get_upload_session(OWNER_ID)
     
     # Store file information
     session['file_path'] = file_id
@@ -1079,7 +2305,7 @@ Choose a unique name for this VIP content:
 
 def handle_vip_name_input(message):
     """Handle VIP content name input"""
-    session = upload_sessions[OWNER_ID]
+    session = get_upload_session(OWNER_ID)
     name = message.text.strip()
     
     # Basic validation - just check if name is not empty
@@ -1088,7 +2314,7 @@ def handle_vip_name_input(message):
         return
     
     # Check if name already exists
-    with app.app_context():
+    with app_context_scope():
         existing = ContentItem.query.filter_by(name=name).first()
     
     if existing:
@@ -1173,7 +2399,7 @@ def handle_vip_settings_input(message):
                     return
                 
                 # Update VIP price setting
-                with app.app_context():
+                with app_context_scope():
                     setting = VipSetting.query.filter_by(key='vip_price_stars').first()
                     if setting:
                         setting.value = str(price)
@@ -1215,7 +2441,7 @@ def handle_vip_settings_input(message):
                     return
                 
                 # Update VIP duration setting
-                with app.app_context():
+                with app_context_scope():
                     setting = VipSetting.query.filter_by(key='vip_duration_days').first()
                     if setting:
                         setting.value = str(duration)
@@ -1265,7 +2491,7 @@ def handle_vip_settings_input(message):
                 return
             
             # Update VIP description setting
-            with app.app_context():
+            with app_context_scope():
                 setting = VipSetting.query.filter_by(key='vip_description').first()
                 if setting:
                     setting.value = user_input
@@ -1324,18 +2550,18 @@ def complete_vip_upload_with_defaults(session):
 
 def get_vip_content_count():
     """Get count of VIP-only content"""
-    with app.app_context():
+    with app_context_scope():
         return ContentItem.query.filter_by(content_type='vip').count()
 
 def get_vip_content_list():
     """Get all VIP-only content with details"""
-    with app.app_context():
+    with app_context_scope():
         content_items = ContentItem.query.filter_by(content_type='vip').order_by(ContentItem.created_date.desc()).all()
         return [(c.name, c.price_stars, c.file_path, c.description, c.created_date) for c in content_items]
 
 def add_vip_content(name, price_stars, file_path, description):
     """Add new VIP-only content"""
-    with app.app_context():
+    with app_context_scope():
         new_content = ContentItem()
         new_content.name = name
         new_content.price_stars = price_stars
@@ -1345,32 +2571,36 @@ def add_vip_content(name, price_stars, file_path, description):
         new_content.content_type = 'vip'
         db.session.add(new_content)
         db.session.commit()
+    
+    bump_catalog_version()
 
 def update_vip_content(name, price_stars, file_path, description):
     """Update existing VIP content"""
-    with app.app_context():
+    with app_context_scope():
         content = ContentItem.query.filter_by(name=name, content_type='vip').first()
         if content:
             content.price_stars = price_stars
             content.file_path = file_path
             content.description = description
             db.session.commit()
+            bump_catalog_version()
             return True
         return False
 
 def delete_vip_content(name):
     """Delete VIP content by name"""
-    with app.app_context():
+    with app_context_scope():
         content = ContentItem.query.filter_by(name=name, content_type='vip').first()
         if content:
             db.session.delete(content)
             db.session.commit()
+            bump_catalog_version()
             return True
         return False
 
 def get_vip_content_by_name(name):
     """Get specific VIP content by name"""
-    with app.app_context():
+    with app_context_scope():
         content = ContentItem.query.filter_by(name=name, content_type='vip').first()
         if content:
             return (content.name, content.price_stars, content.file_path, content.description, content.created_date)
@@ -1380,7 +2610,7 @@ def get_vip_content_by_name(name):
 
 def check_vip_status(user_id):
     """Check if user has active VIP subscription"""
-    with app.app_context():
+    with app_context_scope():
         subscription = VipSubscription.query.filter_by(
             user_id=user_id, 
             is_active=True
@@ -1402,7 +2632,7 @@ def check_vip_status(user_id):
 
 def deactivate_expired_vip(user_id):
     """Deactivate expired VIP subscription"""
-    with app.app_context():
+    with app_context_scope():
         subscription = VipSubscription.query.filter_by(user_id=user_id).first()
         if subscription:
             subscription.is_active = False
@@ -1410,14 +2640,14 @@ def deactivate_expired_vip(user_id):
 
 def get_vip_settings(key):
     """Get VIP setting value"""
-    with app.app_context():
+    with app_context_scope():
         setting = VipSetting.query.filter_by(key=key).first()
         return setting.value if setting else None
 
 
 def update_vip_settings(key, value):
     """Update VIP setting"""
-    with app.app_context():
+    with app_context_scope():
         setting = VipSetting.query.filter_by(key=key).first()
         if setting:
             setting.value = value
@@ -1427,46 +2657,107 @@ def update_vip_settings(key, value):
             setting.value = value
             db.session.add(setting)
         db.session.commit()
+    
+    if key == 'vip_price_stars':
+        bump_catalog_version()
+
+# Catalog price index - pre-checkout is answered from memory and the index is rebuilt when the catalog version changes
+
+CATALOG_VERSION_KEY = 'catalog_version'
+CATALOG_REFRESH_SECONDS = 30
+catalog_index = {'version': None, 'content': {}, 'vip_price': None}
+
+def bump_catalog_version():
+    """Record a change to content prices or availability and rebuild this process's price index"""
+    with app_context_scope():
+        # Increment in the database so concurrent bumps from other threads and processes are never lost
+        increment = {VipSetting.value: cast(cast(VipSetting.value, Integer) + 1, Text)}
+        updated = VipSetting.query.filter_by(key=CATALOG_VERSION_KEY).update(increment, synchronize_session=False)
+        if not updated:
+            try:
+                with db.session.begin_nested():
+                    setting = VipSetting()
+                    setting.key = CATALOG_VERSION_KEY
+                    setting.value = '1'
+                    db.session.add(setting)
+            except IntegrityError:
+                # Another process created the row first - bump theirs
+                VipSetting.query.filter_by(key=CATALOG_VERSION_KEY).update(increment, synchronize_session=False)
+        db.session.commit()
+    
+    refresh_catalog_index(force=True)
 
-def activate_vip_subscription(user_id):
-    """Activate or renew VIP subscription for user"""
-    with app.app_context():
-        # Get VIP duration from settings
-        duration_days = int(get_vip_settings('vip_duration_days') or 30)
+def refresh_catalog_index(force=False):
+    """Rebuild the in-memory price index if the stored catalog version changed.
+
+    Returns:
+        bool: True if the index was rebuilt
+    """
+    global catalog_index
+    with app_context_scope():
+        version = get_vip_settings(CATALOG_VERSION_KEY) or '0'
+        if not force and version == catalog_index['version']:
+            return False
         
-        now = datetime.datetime.now()
+        items = db.session.query(ContentItem.name, ContentItem.price_stars, ContentItem.content_type).all()
+        vip_price = int(get_vip_settings('vip_price_stars') or 399)
+    
+    # Swap in a new dict so readers never see a half-built index
+    catalog_index = {
+        'version': version,
+        'content': {name: (price_stars, content_type) for name, price_stars, content_type in items},
+        'vip_price': vip_price
+    }
+    logger.info(f"Catalog price index rebuilt at version {version} ({len(items)} items)")
+    return True
+
+def run_catalog_refresher():
+    """Pick up catalog changes made by other processes"""
+    while True:
+        time.sleep(CATALOG_REFRESH_SECONDS)
+        try:
+            refresh_catalog_index()
+        except Exception as e:
+            logger.error(f"Error refreshing catalog index: {e}")
+
+def extend_vip_subscription(user_id):
+    """Activate or extend user's VIP subscription in the caller's session (does not commit)"""
+    # Get VIP duration from settings
+    duration_days = int(get_vip_settings('vip_duration_days') or 30)
+    
+    now = datetime.datetime.now()
+    
+    # Check if user already has a subscription (a lapsed one is renewed in place)
+    existing_subscription = VipSubscription.query.filter_by(user_id=user_id).first()
+    
+    if existing_subscription:
+        # Extend existing subscription
+        try:
+            # If still active, extend from expiry date, otherwise from now
+            extend_from = max(existing_subscription.expiry_date, now) if existing_subscription.is_active else now
+        except:
+            extend_from = now
         
-        # Check if user already has an active subscription
-        existing_subscription = VipSubscription.query.filter_by(user_id=user_id, is_active=True).first()
+        new_expiry = extend_from + datetime.timedelta(days=duration_days)
         
-        if existing_subscription:
-            # Extend existing subscription
-            try:
-                # If still active, extend from expiry date, otherwise from now
-                extend_from = max(existing_subscription.expiry_date, now)
-            except:
-                extend_from = now
-            
-            new_expiry = extend_from + datetime.timedelta(days=duration_days)
-            
-            existing_subscription.expiry_date = new_expiry
-            existing_subscription.is_active = True
-            existing_subscription.total_payments += 1
-            
-        else:
-            # Create new subscription
-            expiry_date = now + datetime.timedelta(days=duration_days)
-            
-            new_subscription = VipSubscription()
-            new_subscription.user_id = user_id
-            new_subscription.start_date = now
-            new_subscription.expiry_date = expiry_date
-            new_subscription.is_active = True
-            new_subscription.total_payments = 1
-            db.session.add(new_subscription)
+        existing_subscription.expiry_date = new_expiry
+        existing_subscription.is_active = True
+        existing_subscription.total_payments += 1
         
-        db.session.commit()
-        return duration_days
+    else:
+        # Create new subscription
+        expiry_date = now + datetime.timedelta(days=duration_days)
+        
+        new_subscription = VipSubscription()
+        new_subscription.user_id = user_id
+        new_subscription.start_date = now
+        new_subscription.expiry_date = expiry_date
+        new_subscription.is_active = True
+        new_subscription.total_payments = 1
+        db.session.add(new_subscription)
+    
+    bump_analytics_counter('vip_payments', when=now)
+    return duration_days
 
 def deliver_vip_content(chat_id, user_id, content_name):
     """Deliver VIP-only content for free to VIP users"""
@@ -1477,7 +2768,7 @@ def deliver_vip_content(chat_id, user_id, content_name):
         return
     
     # Get content details - ONLY access VIP content type
-    with app.app_context():
+    with app_context_scope():
         content_item = ContentItem.query.filter_by(name=content_name, content_type='vip').first()
         
         if not content_item:
@@ -1529,14 +2820,8 @@ def deliver_vip_content(chat_id, user_id, content_name):
                     except:
                         bot.send_message(chat_id, f"💎 Your VIP content: {content_name}\n\nFile ID: {file_path}\n\n⚠️ If you have trouble accessing this content, please contact me!")
         else:
-            # It's a local file path
-            with open(file_path, 'rb') as file:
-                if any(ext in file_path.lower() for ext in ['.jpg', '.jpeg', '.png', '.gif']):
-                    bot.send_photo(chat_id, file, caption=f"💎 VIP: {content_name}")
-                elif any(ext in file_path.lower() for ext in ['.mp4', '.mov', '.avi']):
-                    bot.send_video(chat_id, file, caption=f"💎 VIP: {content_name}")
-                else:
-                    bot.send_document(chat_id, file, caption=f"💎 VIP: {content_name}")
+            # It's a local file path - uploaded once, then sent by its registered file_id
+            send_local_media(chat_id, file_path, f"💎 VIP: {content_name}")
     except Exception as e:
         bot.send_message(chat_id, f"💎 Your VIP content: {content_name}\n\n⚠️ There was an issue delivering your content. Please contact me and I'll send it manually!")
         logger.error(f"Error sending VIP content {content_name}: {e}")
@@ -1567,196 +2852,658 @@ def validate_url_security(url):
         url (str): URL to validate
         
     Returns:
-        tuple: (is_safe, error_message)
+        tuple: (is_safe, error_message, validated_ip) - downloads through media_session connect to validated_ip
     """
     try:
         parsed = urlparse(url)
         
         # Only allow http and https
         if parsed.scheme.lower() not in ('http', 'https'):
-            return False, "Only HTTP and HTTPS URLs are allowed"
+            return False, "Only HTTP and HTTPS URLs are allowed", None
         
-        # Resolve hostname to IP address
         hostname = parsed.hostname
         if not hostname:
-            return False, "Invalid hostname"
-        
-        # Get IP address
-        ip_str = socket.gethostbyname(hostname)
-        ip = ipaddress.ip_address(ip_str)
-        
-        # Block private, loopback, link-local, and multicast addresses
-        if ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_multicast:
-            return False, "Access to internal/private networks is not allowed"
+            return False, "Invalid hostname", None
         
-        # Block common metadata endpoints
-        if hostname.lower() in ['metadata.google.internal', '169.254.169.254', 'metadata']:
-            return False, "Access to metadata endpoints is not allowed"
-        
-        return True, ""
+        # Resolve through the shared cache, which rejects private, loopback, link-local,
+        # multicast and metadata addresses
+        return True, "", dns_cache.resolve(hostname)
         
     except socket.gaierror:
-        return False, "Could not resolve hostname"
+        return False, "Could not resolve hostname", None
+    except ValueError as e:
+        return False, str(e), None
     except Exception as e:
-        return False, f"URL validation error: {str(e)}"
+        return False, f"URL validation error: {str(e)}", None
 
-def download_and_upload_image(url, chat_id=None):
-    """
-    Download an image from an external URL and upload it to Telegram to get a permanent file_id.
-    
-    Args:
-        url (str): The external image URL to download
-        chat_id (int): Optional chat ID for progress notifications
-    
-    Returns:
-        tuple: (success, file_id_or_error_message, file_type)
+# Media registry - each distinct file is uploaded once and reused by content, VIP content and teasers
+
+MediaRef = namedtuple('MediaRef', ['file_id', 'file_type'])
+local_hash_cache = {}  # path -> (mtime_ns, size, sha256)
+local_hash_cache_lock = threading.Lock()
+
+def find_media_asset(content_hash=None, file_unique_id=None):
+    """Look up a registered file by content hash or Telegram file_unique_id"""
+    if not content_hash and not file_unique_id:
+        return None
+    with app_context_scope():
+        conditions = []
+        if content_hash:
+            conditions.append(MediaAsset.content_hash == content_hash)
+        if file_unique_id:
+            conditions.append(MediaAsset.file_unique_id == file_unique_id)
+        asset = MediaAsset.query.filter(or_(*conditions)).order_by(MediaAsset.id).first()
+        return MediaRef(asset.file_id, asset.file_type) if asset else None
+
+def register_media(file_id, file_type, file_unique_id=None, content_hash=None, source=None):
+    """Record a file in the registry and return its canonical file_id.
+
+    When the file is already known by either key, the stored file_id wins and any
+    key the row was missing is filled in.
     """
+    if not file_unique_id and not content_hash:
+        return file_id
     try:
-        # Validate URL format
-        parsed_url = urlparse(url)
-        if not parsed_url.scheme or not parsed_url.netloc:
-            return False, "❌ Invalid URL format", None
-        
-        # Security validation to prevent SSRF
-        is_safe, security_error = validate_url_security(url)
-        if not is_safe:
-            return False, f"❌ Security error: {security_error}", None
-        
-        # Send progress notification if chat_id provided
-        if chat_id:
-            bot.send_message(chat_id, "⏳ Downloading image from external URL...", parse_mode='HTML')
-        
-        # Download the image with appropriate headers
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate',
-            'DNT': '1',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-        }
+        with app_context_scope():
+            conditions = []
+            if content_hash:
+                conditions.append(MediaAsset.content_hash == content_hash)
+            if file_unique_id:
+                conditions.append(MediaAsset.file_unique_id == file_unique_id)
+            asset = MediaAsset.query.filter(or_(*conditions)).order_by(MediaAsset.id).first()
+            
+            if asset:
+                if asset.file_type and asset.file_type != file_type:
+                    # Same bytes registered as another kind of media - its file_id can't be sent as this one
+                    return file_id
+                if content_hash and not asset.content_hash:
+                    asset.content_hash = content_hash
+                if file_unique_id and not asset.file_unique_id:
+                    asset.file_unique_id = file_unique_id
+                db.session.commit()
+                return asset.file_id
+            
+            asset = MediaAsset()
+            asset.file_id = file_id
+            asset.file_unique_id = file_unique_id
+            asset.content_hash = content_hash
+            asset.file_type = file_type
+            asset.source = source
+            db.session.add(asset)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Another worker registered the same file first - use theirs
+                db.session.rollback()
+                known = find_media_asset(content_hash, file_unique_id)
+                return known.file_id if known and known.file_type == file_type else file_id
+            return file_id
+    except Exception as e:
+        logger.error(f"Error registering media {file_id}: {e}")
+        return file_id
+
+def message_media_ids(message):
+    """Return (file_id, file_unique_id) of the media in a Telegram message, or (None, None)"""
+    if message.photo:
+        media = message.photo[-1]  # Highest resolution
+    else:
+        media = message.video or message.animation or message.document
+    if not media:
+        return None, None
+    return media.file_id, getattr(media, 'file_unique_id', None)
+
+def register_uploaded_media(message, file_type):
+    """Register media the owner sent and return (file_id, already_known).
+
+    Sending the same file again gives a new file_id but the same file_unique_id,
+    so repeats resolve to the file_id that is already stored.
+    """
+    file_id, file_unique_id = message_media_ids(message)
+    known = find_media_asset(file_unique_id=file_unique_id)
+    if known:
+        return known.file_id, True
+    return register_media(file_id, file_type, file_unique_id=file_unique_id), False
+
+def hash_local_file(file_path):
+    """sha256 of a local file, cached until its size or mtime changes"""
+    stat = os.stat(file_path)
+    with local_hash_cache_lock:
+        cached = local_hash_cache.get(file_path)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    with local_hash_cache_lock:
+        local_hash_cache[file_path] = (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+    return digest.hexdigest()
+
+def sent_media_ids(result):
+    """Return (file_id, file_unique_id) of the media in a sent message"""
+    media = result.photo[-1] if result.photo else (result.video or result.animation or result.document)
+    return (media.file_id, media.file_unique_id) if media else (None, None)
+
+def send_local_media(chat_id, file_path, caption):
+    """Send a local media file, uploading its bytes only the first time they are seen"""
+    lowered = file_path.lower()
+    if any(ext in lowered for ext in ['.jpg', '.jpeg', '.png', '.gif']):
+        send, file_type = bot.send_photo, 'photo'
+    elif any(ext in lowered for ext in ['.mp4', '.mov', '.avi']):
+        send, file_type = bot.send_video, 'video'
+    else:
+        send, file_type = bot.send_document, 'document'
+    
+    content_hash = hash_local_file(file_path)
+    known = find_media_asset(content_hash=content_hash)
+    if known and known.file_type == file_type:
+        return send(chat_id, known.file_id, caption=caption)
+    
+    with open(file_path, 'rb') as file:
+        result = send(chat_id, file, caption=caption)
+    file_id, file_unique_id = sent_media_ids(result)
+    if file_id:
+        register_media(file_id, file_type, file_unique_id=file_unique_id, content_hash=content_hash, source=file_path)
+    return result
+
+# Media ingestion - external image URLs are downloaded and re-uploaded to get permanent file_ids
+
+MEDIA_MAX_BYTES = 50 * 1024 * 1024  # Telegram's upload limit for bots
+MEDIA_SPOOL_BYTES = 5 * 1024 * 1024  # smaller downloads never touch disk
+MEDIA_INGEST_MAX_URLS = 20  # keeps the results in one message
+media_job_lock = threading.Lock()  # one ingest or import at a time, matching the pool's MEDIA_INGEST_CONCURRENCY share
+IMAGE_DOWNLOAD_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'gzip, deflate',
+    'DNT': '1',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+}
+
+FetchedImage = namedtuple('FetchedImage', ['data', 'file_type', 'extension', 'sha256', 'size'])
+
+def image_type_for(content_type, url_path):
+    """Return (file_type, extension) from the response content type, falling back to the URL"""
+    for markers, file_type, extension in ((('jpeg', 'jpg'), 'photo', '.jpg'), (('png',), 'photo', '.png'),
+                                          (('gif',), 'animation', '.gif'), (('webp',), 'photo', '.webp')):
+        if any(marker in content_type for marker in markers):
+            return file_type, extension
+    for markers, file_type, extension in ((('.jpg', '.jpeg'), 'photo', '.jpg'), (('.png',), 'photo', '.png'),
+                                          (('.gif',), 'animation', '.gif'), (('.webp',), 'photo', '.webp')):
+        if any(marker in url_path for marker in markers):
+            return file_type, extension
+    return 'photo', '.jpg'  # Default fallback
+
+def fetch_image(url):
+    """
+    Download an external image into a spooled buffer, hashing it as it streams in.
+    
+    Args:
+        url (str): The external image URL to download
+    
+    Returns:
+        tuple: (success, FetchedImage_or_error_message) - the caller closes FetchedImage.data
+    """
+    response = None
+    try:
+        # Validate URL format
+        parsed_url = urlparse(url)
+        if not parsed_url.scheme or not parsed_url.netloc:
+            return False, "❌ Invalid URL format"
+        
+        # Security validation to prevent SSRF
+        is_safe, security_error, _ = validate_url_security(url)
+        if not is_safe:
+            return False, f"❌ Security error: {security_error}"
         
-        # Download with timeout and size limit
-        response = requests.get(url, headers=headers, timeout=30, stream=True)
+        # media_session connects to the address validated above without resolving again
+        response = media_session.get(url, headers=IMAGE_DOWNLOAD_HEADERS, timeout=30, stream=True)
         response.raise_for_status()
         
         # Check content type
         content_type = response.headers.get('content-type', '').lower()
         if not content_type.startswith('image/'):
-            return False, "❌ URL does not point to an image file", None
+            return False, "❌ URL does not point to an image file"
         
-        # Check file size (limit to 50MB to stay within Telegram limits)
+        # Check file size up front when the server tells us
         content_length = response.headers.get('content-length')
-        if content_length and int(content_length) > 50 * 1024 * 1024:
-            return False, "❌ Image file too large (max 50MB)", None
-        
-        # Determine file extension and type
-        file_extension = None
-        file_type = "photo"  # Default to photo
-        
-        if 'jpeg' in content_type or 'jpg' in content_type:
-            file_extension = '.jpg'
-            file_type = "photo"
-        elif 'png' in content_type:
-            file_extension = '.png'
-            file_type = "photo"
-        elif 'gif' in content_type:
-            file_extension = '.gif'
-            file_type = "animation"
-        elif 'webp' in content_type:
-            file_extension = '.webp'
-            file_type = "photo"
-        else:
-            # Try to get extension from URL
-            url_path = parsed_url.path.lower()
-            if any(ext in url_path for ext in ['.jpg', '.jpeg']):
-                file_extension = '.jpg'
-                file_type = "photo"
-            elif '.png' in url_path:
-                file_extension = '.png'
-                file_type = "photo"
-            elif '.gif' in url_path:
-                file_extension = '.gif'
-                file_type = "animation"
-            elif '.webp' in url_path:
-                file_extension = '.webp'
-                file_type = "photo"
-            else:
-                file_extension = '.jpg'  # Default fallback
-                file_type = "photo"
-        
-        # Update progress
-        if chat_id:
-            bot.send_message(chat_id, "📤 Uploading to Telegram...", parse_mode='HTML')
-        
-        # Create temporary file and download content
-        with tempfile.NamedTemporaryFile(suffix=file_extension, delete=False) as temp_file:
-            # Download in chunks to handle large files
-            downloaded_size = 0
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    temp_file.write(chunk)
-                    downloaded_size += len(chunk)
-                    # Stop if file gets too large
-                    if downloaded_size > 50 * 1024 * 1024:
-                        temp_file.close()
-                        os.unlink(temp_file.name)
-                        return False, "❌ Image file too large (max 50MB)", None
-            
-            temp_file_path = temp_file.name
-        
-        # Upload to Telegram based on file type
-        try:
-            with open(temp_file_path, 'rb') as file:
-                if file_type == "animation":
-                    # Upload as animation (GIF)
-                    result = bot.send_animation(OWNER_ID, file)
-                    if result and result.animation:
-                        file_id = result.animation.file_id
-                    else:
-                        raise Exception("Failed to get animation file_id from Telegram")
-                else:
-                    # Upload as photo
-                    result = bot.send_photo(OWNER_ID, file)
-                    if result and result.photo:
-                        file_id = result.photo[-1].file_id  # Get highest resolution
-                    else:
-                        raise Exception("Failed to get photo file_id from Telegram")
-                
-                # Delete the temporary file
-                os.unlink(temp_file_path)
-                
-                # Send success notification
-                if chat_id:
-                    bot.send_message(chat_id, "✅ Image successfully uploaded to Telegram!", parse_mode='HTML')
-                
-                logger.info(f"Successfully converted URL to file_id: {url} -> {file_id}")
-                return True, file_id, file_type
-                
-        except Exception as upload_error:
-            # Clean up temp file on upload error
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
-            logger.error(f"Error uploading to Telegram: {upload_error}")
-            return False, f"❌ Failed to upload to Telegram: {str(upload_error)}", None
+        if content_length and int(content_length) > MEDIA_MAX_BYTES:
+            return False, "❌ Image file too large (max 50MB)"
+        
+        file_type, extension = image_type_for(content_type, parsed_url.path.lower())
+        
+        data = tempfile.SpooledTemporaryFile(max_size=MEDIA_SPOOL_BYTES)
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in response.iter_content(chunk_size=65536):
+            size += len(chunk)
+            # Stop if file gets too large
+            if size > MEDIA_MAX_BYTES:
+                data.close()
+                return False, "❌ Image file too large (max 50MB)"
+            data.write(chunk)
+            digest.update(chunk)
+        data.seek(0)
+        
+        return True, FetchedImage(data, file_type, extension, digest.hexdigest(), size)
     
     except requests.exceptions.Timeout:
-        return False, "❌ Download timed out. Please try again or use a different URL.", None
+        return False, "❌ Download timed out. Please try again or use a different URL."
     except requests.exceptions.ConnectionError:
-        return False, "❌ Connection error. Please check the URL and try again.", None
+        return False, "❌ Connection error. Please check the URL and try again."
     except requests.exceptions.HTTPError as e:
         if e.response.status_code == 403:
-            return False, "❌ Access forbidden. The image may have hotlink protection.", None
+            return False, "❌ Access forbidden. The image may have hotlink protection."
         elif e.response.status_code == 404:
-            return False, "❌ Image not found (404). Please check the URL.", None
+            return False, "❌ Image not found (404). Please check the URL."
         else:
-            return False, f"❌ HTTP error {e.response.status_code}. Please try a different URL.", None
+            return False, f"❌ HTTP error {e.response.status_code}. Please try a different URL."
     except requests.exceptions.RequestException as e:
-        return False, f"❌ Download failed: {str(e)}", None
+        return False, f"❌ Download failed: {str(e)}"
+    except Exception as e:
+        logger.error(f"Unexpected error in fetch_image: {e}")
+        return False, f"❌ Unexpected error: {str(e)}"
+    finally:
+        # Hand the connection back to the shared pool even on early returns
+        if response is not None:
+            response.close()
+
+def upload_image(image, source=None):
+    """Return a permanent file_id for a fetched image, uploading it only if its bytes are new"""
+    known = find_media_asset(content_hash=image.sha256)
+    if known and known.file_type == image.file_type:
+        logger.info(f"Reusing registered file_id for {source or image.sha256}")
+        return known.file_id
+    
+    upload = types.InputFile(image.data, file_name=f"image{image.extension}")
+    if image.file_type == "animation":
+        result = bot.send_animation(OWNER_ID, upload, disable_notification=True)
+        if not result or not result.animation:
+            raise Exception("Failed to get animation file_id from Telegram")
+        media = result.animation
+    else:
+        result = bot.send_photo(OWNER_ID, upload, disable_notification=True)
+        if not result or not result.photo:
+            raise Exception("Failed to get photo file_id from Telegram")
+        media = result.photo[-1]  # Get highest resolution
+    
+    return register_media(media.file_id, image.file_type, file_unique_id=media.file_unique_id,
+                          content_hash=image.sha256, source=source)
+
+def send_progress(chat_id, text, message_id=None):
+    """Send a progress message, or edit it in place once it exists; returns its message id"""
+    try:
+        if message_id:
+            bot.edit_message_text(text, chat_id, message_id, parse_mode='HTML')
+            return message_id
+        return bot.send_message(chat_id, text, parse_mode='HTML').message_id
+    except Exception as e:
+        # "message is not modified" and friends should never break the ingestion itself
+        logger.warning(f"Could not update progress message in {chat_id}: {e}")
+        return message_id
+
+def download_and_upload_image(url, chat_id=None):
+    """
+    Download an image from an external URL and upload it to Telegram to get a permanent file_id.
+    
+    Args:
+        url (str): The external image URL to download
+        chat_id (int): Optional chat ID for a progress message
+    
+    Returns:
+        tuple: (success, file_id_or_error_message, file_type)
+    """
+    progress_id = send_progress(chat_id, "⏳ Downloading image from external URL...") if chat_id else None
+    
+    success, fetched = fetch_image(url)
+    if not success:
+        if progress_id:
+            send_progress(chat_id, fetched, progress_id)
+        return False, fetched, None
+    
+    try:
+        if progress_id:
+            send_progress(chat_id, "📤 Uploading to Telegram...", progress_id)
+        file_id = upload_image(fetched, url)
+    except Exception as upload_error:
+        logger.error(f"Error uploading to Telegram: {upload_error}")
+        if progress_id:
+            send_progress(chat_id, "❌ Failed to upload to Telegram", progress_id)
+        return False, f"❌ Failed to upload to Telegram: {str(upload_error)}", None
+    finally:
+        fetched.data.close()
+    
+    if progress_id:
+        send_progress(chat_id, "✅ Image successfully uploaded to Telegram!", progress_id)
+    logger.info(f"Successfully converted URL to file_id: {url} -> {file_id}")
+    return True, file_id, fetched.file_type
+
+def start_media_job(target, *args):
+    """Run target(*args) in a background thread unless a media ingest or catalog import is already running.
+    
+    Returns False without starting anything when another job holds media_job_lock.
+    """
+    if not media_job_lock.acquire(blocking=False):
+        return False
+    
+    def run():
+        try:
+            target(*args)
+        finally:
+            media_job_lock.release()
+    
+    job_thread = threading.Thread(target=run)
+    job_thread.daemon = True
+    job_thread.start()
+    return True
+
+def ingest_media_urls(urls, chat_id=None):
+    """
+    Download and upload a batch of image URLs with bounded concurrency.
+    
+    Repeated URLs are fetched once, and URLs whose bytes hash the same are uploaded
+    once and share the file_id. Progress is reported in a single edited message.
+    
+    Args:
+        urls (list): External image URLs
+        chat_id (int): Optional chat ID for the progress message
+    
+    Returns:
+        list: (url, success, file_id_or_error_message, file_type) per distinct URL, in input order
+    """
+    unique_urls = list(dict.fromkeys(url.strip() for url in urls if url.strip()))
+    if not unique_urls:
+        return []
+    
+    uploads_by_hash = {}
+    uploads_lock = threading.Lock()
+    
+    def ingest(url):
+        success, fetched = fetch_image(url)
+        if not success:
+            return False, fetched, None
+        try:
+            # The first URL with these bytes uploads them; identical content waits for its file_id
+            with uploads_lock:
+                upload = uploads_by_hash.get(fetched.sha256)
+                is_first = upload is None
+                if is_first:
+                    upload = uploads_by_hash[fetched.sha256] = concurrent.futures.Future()
+            if is_first:
+                try:
+                    upload.set_result((True, upload_image(fetched, url), fetched.file_type))
+                except Exception as e:
+                    logger.error(f"Error uploading {url} to Telegram: {e}")
+                    upload.set_result((False, f"❌ Failed to upload to Telegram: {str(e)}", None))
+            return upload.result()
+        finally:
+            fetched.data.close()
+    
+    progress_id = send_progress(chat_id, f"⏳ Ingesting {len(unique_urls)} URLs...") if chat_id else None
+    results = {}
+    last_progress = time.monotonic()
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(MEDIA_INGEST_CONCURRENCY, len(unique_urls))) as pool:
+        futures = {pool.submit(ingest, url): url for url in unique_urls}
+        for future in concurrent.futures.as_completed(futures):
+            results[futures[future]] = future.result()
+            # Edit at most once a second to stay clear of Telegram's edit limits
+            if progress_id and time.monotonic() - last_progress >= 1:
+                last_progress = time.monotonic()
+                failed = sum(1 for result in results.values() if not result[0])
+                send_progress(chat_id, f"⏳ Ingesting {len(unique_urls)} URLs... {len(results)} done, {failed} failed", progress_id)
+    
+    ingested = [(url,) + results[url] for url in unique_urls]
+    if progress_id:
+        send_progress(chat_id, format_ingest_results(ingested, len(urls), len(uploads_by_hash)), progress_id)
+    return ingested
+
+def format_ingest_results(ingested, requested, distinct_files):
+    """Render batch ingestion results for the progress message"""
+    succeeded = sum(1 for _, success, _, _ in ingested if success)
+    lines = [
+        f"📥 <b>Media ingestion finished</b>: {succeeded}/{len(ingested)} succeeded",
+        f"🔁 {requested - len(ingested)} duplicate URLs skipped, {distinct_files} distinct files fetched",
+        ""
+    ]
+    for index, (url, success, result, file_type) in enumerate(ingested, 1):
+        short_url = url if len(url) <= 60 else url[:57] + '...'
+        short_url = short_url.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        safe_result = result.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        if success:
+            lines.append(f"{index}. ✅ {short_url} ({file_type})\n<code>{safe_result}</code>")
+        else:
+            lines.append(f"{index}. {short_url}\n{safe_result}")
+    return "\n".join(lines)
+
+# Catalog import - a manifest (optionally zipped with its images) becomes many ContentItem rows in one transaction
+
+IMPORT_MAX_ITEMS = 500
+IMPORT_MAX_BYTES = 20 * 1024 * 1024  # Bot API download limit
+IMPORT_MAX_UNZIPPED_BYTES = 200 * 1024 * 1024
+IMPORT_IMAGE_TYPES = {
+    '.jpg': ('photo', '.jpg'), '.jpeg': ('photo', '.jpg'), '.png': ('photo', '.png'),
+    '.webp': ('photo', '.webp'), '.gif': ('animation', '.gif'),
+}
+CATALOG_CONTENT_TYPES = ('browse', 'vip')
+
+def read_import_manifest(file_name, data):
+    """Parse an uploaded .csv or .json manifest, or a .zip holding one plus its images.
+
+    Returns (rows, archive, manifest directory inside the archive). Raises ValueError
+    with a user-facing message on bad input.
+    """
+    archive = None
+    manifest_dir = ''
+    if file_name.lower().endswith('.zip'):
+        try:
+            archive = zipfile.ZipFile(io.BytesIO(data))
+        except zipfile.BadZipFile:
+            raise ValueError("The zip file is damaged")
+        if sum(info.file_size for info in archive.infolist()) > IMPORT_MAX_UNZIPPED_BYTES:
+            raise ValueError(f"The zip unpacks to more than {IMPORT_MAX_UNZIPPED_BYTES // 1024 // 1024}MB")
+        manifests = [name for name in archive.namelist() if posixpath.basename(name).lower() in ('manifest.csv', 'manifest.json')]
+        if len(manifests) != 1:
+            raise ValueError("The zip must contain exactly one manifest.csv or manifest.json")
+        file_name = manifests[0]
+        manifest_dir = posixpath.dirname(file_name)
+        data = archive.read(file_name)
+    
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise ValueError("The manifest must be UTF-8 text")
+    
+    if file_name.lower().endswith('.json'):
+        try:
+            rows = json.loads(text)
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON manifest: {e}")
+        if isinstance(rows, dict):
+            rows = rows.get('items')
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError("The JSON manifest must be a list of objects (or {\"items\": [...]})")
+    elif file_name.lower().endswith('.csv'):
+        rows = list(csv.DictReader(io.StringIO(text)))
+    else:
+        raise ValueError("Send the manifest as a .csv, .json or .zip file")
+    
+    return rows, archive, manifest_dir
+
+def validate_import_rows(rows, archive=None, manifest_dir=''):
+    """Check every manifest row before anything is uploaded or saved.
+
+    Returns (items, errors); items are only usable when errors is empty.
+    """
+    if not rows:
+        return [], ["The manifest has no items"]
+    if len(rows) > IMPORT_MAX_ITEMS:
+        return [], [f"The manifest has {len(rows)} items; import at most {IMPORT_MAX_ITEMS} at a time"]
+    
+    members = set(archive.namelist()) if archive else set()
+    items, errors, seen = [], [], set()
+    for number, row in enumerate(rows, 1):
+        row = {str(key).strip().lower(): str(value).strip() for key, value in row.items() if key is not None and value is not None}
+        name = row.get('name', '')
+        price = row.get('price', '')
+        file_path = row.get('file', '')
+        content_type = (row.get('type') or 'browse').lower()
+        
+        problems = []
+        if not name:
+            problems.append("missing name")
+        elif len(name) > 200:
+            problems.append("name is longer than 200 characters")
+        elif name in seen:
+            problems.append("name appears more than once")
+        if not price.isdigit() or int(price) <= 0:
+            problems.append("price must be a positive whole number of Stars")
+        if content_type not in CATALOG_CONTENT_TYPES:
+            problems.append("type must be browse or vip")
+        
+        # Anything that isn't a URL or a file in the zip is taken as a file_id or local path, like /owner_add_content
+        member = None
+        extension = posixpath.splitext(file_path.lower())[1]
+        zip_path = posixpath.normpath(posixpath.join(manifest_dir, file_path)) if archive is not None and file_path else None
+        if not file_path:
+            problems.append("missing file")
+        elif zip_path in members:
+            member = zip_path
+            if extension not in IMPORT_IMAGE_TYPES:
+                problems.append("only JPG, PNG, WebP and GIF images can be imported from a zip")
+        elif zip_path and not file_path.startswith('http') and ('/' in file_path or extension in IMPORT_IMAGE_TYPES):
+            problems.append(f"{file_path} is not in the zip")
+        
+        seen.add(name)
+        if problems:
+            errors.append(f"Item {number} ({name or 'no name'}): {', '.join(problems)}")
+            continue
+        items.append({
+            'name': name,
+            'price_stars': int(price),
+            'file_path': file_path,
+            'member': member,
+            'description': row.get('description') or "Exclusive content",
+            'content_type': content_type,
+        })
+    
+    if items:
+        with app_context_scope():
+            taken = {name for name, in db.session.query(ContentItem.name).filter(ContentItem.name.in_([item['name'] for item in items]))}
+        errors.extend(f"{name}: content with this name already exists" for name in sorted(taken))
+    return items, errors
+
+def upload_import_media(items, archive):
+    """Turn zip images and external URLs into file_ids, uploading in parallel.
+
+    Updates each item's file_path in place and returns a list of error messages.
+    """
+    errors = []
+    
+    # Zip members are read and hashed up front so identical images upload once
+    members = {}
+    for item in items:
+        if item['member'] and item['member'] not in members:
+            data = archive.read(item['member'])
+            if len(data) > MEDIA_MAX_BYTES:
+                errors.append(f"{item['member']}: larger than {MEDIA_MAX_BYTES // 1024 // 1024}MB")
+                continue
+            file_type, extension = IMPORT_IMAGE_TYPES[posixpath.splitext(item['member'].lower())[1]]
+            members[item['member']] = FetchedImage(io.BytesIO(data), file_type, extension, hashlib.sha256(data).hexdigest(), len(data))
+    by_hash = {}
+    for image in members.values():
+        by_hash.setdefault(image.sha256, image)
+    
+    def upload(image):
+        try:
+            return True, upload_image(image, source=f"import:{image.sha256[:12]}")
+        except Exception as e:
+            return False, str(e)
+    
+    file_ids = {}
+    if by_hash:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(MEDIA_INGEST_CONCURRENCY, len(by_hash))) as pool:
+            for content_hash, result in zip(by_hash, pool.map(upload, by_hash.values())):
+                file_ids[content_hash] = result
+    
+    urls = [item['file_path'] for item in items if not item['member'] and item['file_path'].startswith('http')]
+    url_results = {url: (success, result) for url, success, result, _ in ingest_media_urls(urls)} if urls else {}
+    
+    for item in items:
+        if item['member']:
+            if item['member'] not in members:
+                continue
+            success, result = file_ids[members[item['member']].sha256]
+            source = item['member']
+        elif item['file_path'] in url_results:
+            success, result = url_results[item['file_path']]
+            source = item['file_path']
+        else:
+            continue
+        if success:
+            item['file_path'] = result
+        else:
+            errors.append(f"{item['name']} ({source}): {result}")
+    return errors
+
+def save_imported_content(items):
+    """Insert all imported items in one transaction and bump the catalog version once"""
+    rows = [{column: item[column] for column in ('name', 'price_stars', 'file_path', 'description', 'content_type')} for item in items]
+    with app_context_scope():
+        try:
+            db.session.execute(insert(ContentItem), rows)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            raise ValueError("Some names were taken while the import was running - nothing was saved")
+    bump_catalog_version()
+
+def run_catalog_import(chat_id, file_name, file_id):
+    """Download a manifest, validate it, upload its media and save every item, reporting back to the owner"""
+    def report_errors(title, errors):
+        lines = [f"❌ <b>{title}</b> - nothing was imported.", ""]
+        lines += [f"• {error}".replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;') for error in errors[:15]]
+        if len(errors) > 15:
+            lines.append(f"...and {len(errors) - 15} more")
+        send_progress(chat_id, "\n".join(lines), progress_id)
+    
+    progress_id = send_progress(chat_id, "⏳ Reading manifest...")
+    try:
+        data = bot.download_file(bot.get_file(file_id).file_path)
+        rows, archive, manifest_dir = read_import_manifest(file_name, data)
+        items, errors = validate_import_rows(rows, archive, manifest_dir)
+        if errors:
+            report_errors(f"{len(errors)} problem(s) in the manifest", errors)
+            return
+        
+        media_count = sum(1 for item in items if item['member'] or item['file_path'].startswith('http'))
+        if media_count:
+            send_progress(chat_id, f"📤 Manifest OK - uploading {media_count} media files for {len(items)} items...", progress_id)
+            errors = upload_import_media(items, archive)
+            if errors:
+                report_errors(f"{len(errors)} media upload(s) failed", errors)
+                return
+        
+        save_imported_content(items)
+    except ValueError as e:
+        report_errors("Import failed", [str(e)])
+        return
     except Exception as e:
-        logger.error(f"Unexpected error in download_and_upload_image: {e}")
-        return False, f"❌ Unexpected error: {str(e)}", None
+        logger.error(f"Catalog import failed: {e}")
+        report_errors("Import failed", [str(e)])
+        return
+    
+    vip_count = sum(1 for item in items if item['content_type'] == 'vip')
+    logger.info(f"Imported {len(items)} catalog items from {file_name}")
+    send_progress(chat_id, f"""✅ <b>CATALOG IMPORT COMPLETE</b>
+
+📦 <b>Items added:</b> {len(items)} ({len(items) - vip_count} browse, {vip_count} VIP)
+🖼 <b>Items with uploaded media:</b> {media_count}
+
+🛒 Everything is live in the catalog now.""", progress_id)
 
 # Bot command handlers
 
@@ -1816,12 +3563,12 @@ def teaser_command(message):
     is_vip = vip_status['is_vip']
     
     if is_vip:
-        # Get VIP teasers first, if none exist show regular message
-        vip_teasers = get_vip_teasers()
+        # Get the latest VIP teaser, if none exist show regular message
+        vip_teaser = get_latest_teaser(vip_only=True)
         
-        if vip_teasers:
+        if vip_teaser:
             # Send VIP teaser (most recent)
-            file_path, file_type, description = vip_teasers[0]
+            file_path, file_type, description = vip_teaser
             
             # Escape HTML characters in description
             safe_description = description.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
@@ -1886,14 +3633,8 @@ def teaser_command(message):
                         logger.error(f"Error sending VIP teaser media: {e}")
                         bot.send_message(message.chat.id, f"💎 Your exclusive VIP teaser is ready, but there was a technical issue. Please contact me directly!")
                 else:
-                    # It's a local file path
-                    with open(file_path, 'rb') as file:
-                        if any(ext in file_path.lower() for ext in ['.jpg', '.jpeg', '.png', '.gif']):
-                            bot.send_photo(message.chat.id, file, caption=f"💎 VIP Exclusive")
-                        elif any(ext in file_path.lower() for ext in ['.mp4', '.mov', '.avi']):
-                            bot.send_video(message.chat.id, file, caption=f"💎 VIP Exclusive")
-                        else:
-                            bot.send_document(message.chat.id, file, caption=f"💎 VIP Exclusive")
+                    # It's a local file path - uploaded once, then sent by its registered file_id
+                    send_local_media(message.chat.id, file_path, f"💎 VIP Exclusive")
             except Exception as e:
                 logger.error(f"Error sending VIP teaser: {e}")
                 bot.send_message(message.chat.id, f"💎 Your exclusive VIP teaser is ready, but there was a technical issue. Please contact me directly!")
@@ -1924,12 +3665,12 @@ def teaser_command(message):
             markup.add(types.InlineKeyboardButton("🔄 Extend VIP Membership", callback_data="vip_access"))
         
     else:
-        # Get teasers from database
-        teasers = get_teasers()
+        # Get the latest free teaser
+        teaser = get_latest_teaser(vip_only=False)
         
-        if teasers:
+        if teaser:
             # Send first teaser (most recent)
-            file_path, file_type, description = teasers[0]
+            file_path, file_type, description = teaser
             
             # Escape HTML characters in description to prevent parsing errors
             safe_description = description.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
@@ -2047,7 +3788,7 @@ def buy_command(message):
 
 def purchase_item(chat_id, user_id, item_name):
     """Process purchase for specific item - ONLY allows purchases of 'browse' content"""
-    with app.app_context():
+    with app_context_scope():
         # Only allow purchases of 'browse' content - VIP content is subscription-only
         item_obj = ContentItem.query.filter_by(name=item_name, content_type='browse').first()
         
@@ -2076,7 +3817,7 @@ def purchase_item(chat_id, user_id, item_name):
             chat_id=chat_id,
             title=f"Browse Content: {name}",
             description=description,
-            invoice_payload=f"content_{name}_{user_id}",
+            invoice_payload=encode_invoice_payload('content', user_id, name),
             provider_token=None,  # None for Telegram Stars
             currency='XTR',  # Telegram Stars currency
             prices=prices,
@@ -2084,7 +3825,7 @@ def purchase_item(chat_id, user_id, item_name):
         )
     else:
         # Check if it's VIP content that user is trying to purchase
-        with app.app_context():
+        with app_context_scope():
             vip_item = ContentItem.query.filter_by(name=item_name).first()
             vip_check = (vip_item.name, vip_item.content_type) if vip_item else None
         
@@ -2165,7 +3906,7 @@ def purchase_vip_subscription(chat_id, user_id):
         chat_id=chat_id,
         title="🌟 VIP Membership Subscription",
         description=f"{vip_description} - 30 days unlimited access",
-        invoice_payload=f"vip_subscription_{user_id}",
+        invoice_payload=encode_invoice_payload('vip', user_id),
         provider_token=None,  # None for Telegram Stars
         currency='XTR',  # Telegram Stars currency
         prices=prices,
@@ -2180,7 +3921,7 @@ def show_content_catalog(chat_id, user_id=None):
         # In practice, we should always pass user_id
         user_id = chat_id  # Assuming direct message context
     
-    with app.app_context():
+    with app_context_scope():
         # Only show content marked as 'browse' type - not VIP-only content
         items_query = ContentItem.query.filter_by(content_type='browse').all()
         items = [(item.name, item.price_stars, item.description) for item in items_query]
@@ -2261,7 +4002,7 @@ This exclusive content is only available to VIP members. Upgrade now to unlock:
         return
     
     # User is VIP - show VIP content library
-    with app.app_context():
+    with app_context_scope():
         # Only show content marked as 'vip' type
         vip_content = ContentItem.query.filter_by(content_type='vip').all()
     
@@ -2396,7 +4137,7 @@ def owner_add_content(message):
         description = parts[4] if len(parts) > 4 else "Exclusive content"
         
         # Check if this name already exists
-        with app.app_context():
+        with app_context_scope():
             existing = ContentItem.query.filter_by(name=name).first()
         
         if existing:
@@ -2423,7 +4164,7 @@ def owner_add_content(message):
                 return
         
         # Save to database (with processed file_path)
-        with app.app_context():
+        with app_context_scope():
             new_content = ContentItem()
             new_content.name = name
             new_content.price_stars = price_stars
@@ -2432,6 +4173,7 @@ def owner_add_content(message):
             new_content.content_type = 'browse'
             db.session.add(new_content)
             db.session.commit()
+        bump_catalog_version()
         
         # Success message with details
         success_message = f"""✅ **CONTENT ADDED SUCCESSFULLY!** ✅
@@ -2455,6 +4197,43 @@ def owner_add_content(message):
         logger.error(f"Error in owner_add_content: {e}")
         bot.send_message(message.chat.id, f"❌ Error adding content: {str(e)}\n\nPlease check your command format and try again.")
 
+IMPORT_USAGE = """📦 <b>BULK CATALOG IMPORT</b> 📦
+
+Send a manifest file with <code>/owner_import</code> as its caption:
+• <b>.csv</b> with columns <code>name,price,file,description,type</code>
+• <b>.json</b> with a list of objects using the same keys
+• <b>.zip</b> holding manifest.csv or manifest.json plus the images it names
+
+<b>file</b> is a Telegram file_id, an image URL or a path inside the zip. <b>type</b> is browse (default) or vip.
+
+Every row is checked first and all items are saved together - if anything is wrong, nothing is imported."""
+
+@bot.message_handler(commands=['owner_import'])
+def owner_import(message):
+    """Handle /owner_import command - explain the bulk import manifest format"""
+    if not is_owner(message.from_user.id):
+        bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
+        return
+    
+    bot.send_message(message.chat.id, IMPORT_USAGE, parse_mode='HTML')
+
+@bot.message_handler(content_types=['document'], func=lambda message: is_owner(message.from_user.id) and (message.caption or '').strip().lower().startswith('/owner_import'))
+def owner_import_manifest(message):
+    """Handle a manifest sent with an /owner_import caption - import many content items at once"""
+    document = message.document
+    file_name = document.file_name or ''
+    if not file_name.lower().endswith(('.csv', '.json', '.zip')):
+        bot.send_message(message.chat.id, IMPORT_USAGE, parse_mode='HTML')
+        return
+    
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        bot.send_message(message.chat.id, f"❌ The file is too large. Bots can only download files up to {IMPORT_MAX_BYTES // 1024 // 1024}MB.")
+        return
+    
+    # Uploads can take a while, so don't hold up the update lane
+    if not start_media_job(run_catalog_import, message.chat.id, file_name, document.file_id):
+        bot.send_message(message.chat.id, "⏳ A media ingestion or catalog import is already running. Try again when it finishes.")
+
 @bot.message_handler(commands=['owner_delete_content'])
 def owner_delete_content(message):
     """Handle /owner_delete_content command"""
@@ -2469,11 +4248,12 @@ def owner_delete_content(message):
     
     name = parts[1]
     
-    with app.app_context():
+    with app_context_scope():
         content_item = ContentItem.query.filter_by(name=name).first()
         if content_item:
             db.session.delete(content_item)
             db.session.commit()
+            bump_catalog_version()
             bot.send_message(message.chat.id, f"✅ Content '{name}' deleted successfully!")
         else:
             bot.send_message(message.chat.id, f"❌ Content '{name}' not found.")
@@ -2574,6 +4354,8 @@ def handle_teaser_upload(message):
                     file_type = None  # Unsupported document type
         
         if file_id and file_type:
+            # A file that is already in the library keeps its stored file_id
+            file_id, already_known = register_uploaded_media(message, file_type)
             session['file_id'] = file_id
             session['file_path'] = file_id  # Store file_id as file_path for consistency with add_teaser function
             session['step'] = 'waiting_for_description'
@@ -2584,9 +4366,10 @@ def handle_teaser_upload(message):
             return
         
         # Ask for description
+        reuse_note = "\n♻️ This file is already in your library - reusing the stored copy.\n" if already_known else ""
         desc_text = f"""
 ✅ **{file_type.title()} received!**
-
+{reuse_note}
 📝 Now send me a description for this teaser (what fans will see):
 
 Examples:
@@ -2668,6 +4451,9 @@ def handle_file_upload(message):
             bot.send_message(message.chat.id, "❌ Unsupported file type. Please send a photo, video, animation")
             return
         
+        # A file that is already in the library keeps its stored file_id
+        file_id, already_known = register_uploaded_media(message, file_type)
+        
         # Check if this is a VIP upload session
         owner_id = message.from_user.id
         session = get_upload_session(owner_id)
@@ -2682,9 +4468,10 @@ def handle_file_upload(message):
         session['step'] = 'waiting_for_name'
         
         # Ask for content name
+        reuse_note = "\n♻️ This file is already in your library - reusing the stored copy.\n" if already_known else ""
         name_text = f"""
 ✅ **{file_type} uploaded successfully!**
-
+{reuse_note}
 <b>Step 2:</b> What should I call this content?
 Type a unique name (no spaces, use underscores):
 
@@ -2731,7 +4518,7 @@ def handle_upload_flow(message):
             return
         
         # Check if name already exists
-        with app.app_context():
+        with app_context_scope():
             existing = ContentItem.query.filter_by(name=name).first()
         
         if existing:
@@ -2852,7 +4639,7 @@ def save_uploaded_content(session):
                 return
         
         # Save to database (with processed file_path) - Enhanced error handling
-        with app.app_context():
+        with app_context_scope():
             try:
                 logger.info(f"Attempting to save content: {session['name']} (type: {content_type})")
                 
@@ -2871,6 +4658,7 @@ def save_uploaded_content(session):
                 new_content.content_type = content_type
                 db.session.add(new_content)
                 db.session.commit()
+                bump_catalog_version()
                 logger.info(f"Content '{session['name']}' saved successfully")
                 
                 # Verify the save by querying back
@@ -2982,10 +4770,10 @@ This will be shown to non-VIP users when they use /teaser command.
     
     bot.send_message(message.chat.id, upload_text, reply_markup=markup)
 
-@bot.message_handler(content_types=['photo', 'video', 'animation', 'document'], func=lambda message: message.from_user.id == OWNER_ID and OWNER_ID in upload_sessions and upload_sessions[OWNER_ID].get('type') == 'vip_content' and upload_sessions[OWNER_ID].get('step') == 'waiting_for_file')
+@bot.message_handler(content_types=['photo', 'video', 'animation', 'document'], func=lambda message: message.from_user.id == OWNER_ID and has_upload_session(OWNER_ID, 'vip_content', 'waiting_for_file'))
 def handle_vip_upload_files(message):
     """Handle VIP content file uploads - photos, videos, and animations only"""
-    logger.info(f"VIP upload handler triggered - Content type: {message.content_type}, Session: {upload_sessions.get(OWNER_ID, 'None')}")
+    logger.info(f"VIP upload handler triggered - Content type: {message.content_type}, Session: {get_upload_session(OWNER_ID)}")
     
     # Get file information
     file_id = None
@@ -3010,14 +4798,16 @@ def handle_vip_upload_files(message):
             return
     
     if file_id and file_type:
+        # A file that is already in the library keeps its stored file_id
+        file_id, _ = register_uploaded_media(message, file_type)
         handle_vip_file_upload(message, file_id, file_type)
     else:
         bot.send_message(message.chat.id, "❌ Unsupported file type for VIP content. Please send photos, videos, or GIFs only.")
 
-@bot.message_handler(content_types=['photo', 'video', 'animation', 'document'], func=lambda message: message.from_user.id == OWNER_ID and OWNER_ID in upload_sessions and upload_sessions[OWNER_ID].get('type') == 'vip_file_update' and upload_sessions[OWNER_ID].get('step') == 'waiting_for_file')
+@bot.message_handler(content_types=['photo', 'video', 'animation', 'document'], func=lambda message: message.from_user.id == OWNER_ID and has_upload_session(OWNER_ID, 'vip_file_update', 'waiting_for_file'))
 def handle_vip_file_update_upload(message):
     """Handle VIP file update uploads - replace existing file"""
-    logger.info(f"VIP file update handler triggered - Content type: {message.content_type}, Session: {upload_sessions.get(OWNER_ID, 'None')}")
+    logger.info(f"VIP file update handler triggered - Content type: {message.content_type}, Session: {get_upload_session(OWNER_ID)}")
     
     # Get file information
     file_id = None
@@ -3042,12 +4832,13 @@ def handle_vip_file_update_upload(message):
             return
     
     if file_id and file_type:
+        file_id, _ = register_uploaded_media(message, file_type)
         owner_id = message.from_user.id
         session = get_upload_session(owner_id)
         content_name = session['content_name']
         
         # Update the VIP content file path directly
-        with app.app_context():
+        with app_context_scope():
             content_item = ContentItem.query.filter_by(name=content_name, content_type='vip').first()
             if content_item:
                 content_item.file_path = file_id
@@ -3079,12 +4870,12 @@ def handle_vip_file_update_upload(message):
     else:
         bot.send_message(message.chat.id, "❌ Unsupported file type for VIP content. Please send photos, videos, or GIFs only.")
 
-@bot.message_handler(content_types=['photo', 'video'], func=lambda message: message.from_user.id == OWNER_ID and f"{OWNER_ID}_vip_teaser" in upload_sessions and upload_sessions.get(f"{OWNER_ID}_vip_teaser", {}).get('type') == 'vip_teaser' and upload_sessions.get(f"{OWNER_ID}_vip_teaser", {}).get('step') == 'waiting_for_file')
+@bot.message_handler(content_types=['photo', 'video'], func=lambda message: message.from_user.id == OWNER_ID and has_upload_session(f"{OWNER_ID}_vip_teaser", 'vip_teaser', 'waiting_for_file'))
 def handle_vip_teaser_upload(message):
     """Handle VIP teaser file upload from owner"""
     teaser_key = f"{OWNER_ID}_vip_teaser"
-    logger.info(f"VIP teaser handler triggered - Content type: {message.content_type}, Session: {upload_sessions.get(teaser_key, 'None')}")
-    session = upload_sessions.get(teaser_key, {})
+    logger.info(f"VIP teaser handler triggered - Content type: {message.content_type}, Session: {get_upload_session(teaser_key)}")
+    session = get_upload_session(teaser_key)
     
     if not session or session.get('step') != 'waiting_for_file':
         bot.send_message(message.chat.id, "❌ No active VIP teaser upload session found. Please restart the VIP teaser upload.")
@@ -3105,7 +4896,8 @@ def handle_vip_teaser_upload(message):
             session['file_type'] = 'video'
         
         if file_id and file_type:
-            # Store file info and move to name input step
+            # Store file info and move to name input step (known files keep their stored file_id)
+            file_id, _ = register_uploaded_media(message, file_type)
             session['file_path'] = file_id
             session['step'] = 'waiting_for_name'
             
@@ -3152,12 +4944,13 @@ def handle_vip_teaser_edit_upload(message):
     if file_id and file_type:
         # Update the teaser in database
         try:
-            with app.app_context():
+            with app_context_scope():
                 teaser = Teaser.query.filter_by(id=session['teaser_id'], vip_only=True).first()
                 if teaser:
                     teaser.file_path = file_id
                     teaser.file_type = file_type
                     db.session.commit()
+            bump_catalog_version()
             
             success_text = f"""
 ✅ <b>VIP TEASER UPDATED SUCCESSFULLY!</b> ✅
@@ -3183,21 +4976,21 @@ def handle_vip_teaser_edit_upload(message):
     else:
         bot.send_message(message.chat.id, "❌ Please send a photo or video file for the VIP teaser.")
 
-@bot.message_handler(func=lambda message: message.from_user.id == OWNER_ID and OWNER_ID in upload_sessions and upload_sessions[OWNER_ID].get('type') == 'vip_content' and upload_sessions[OWNER_ID].get('step') == 'waiting_for_name')
+@bot.message_handler(func=lambda message: message.from_user.id == OWNER_ID and has_upload_session(OWNER_ID, 'vip_content', 'waiting_for_name'))
 def handle_vip_name_message(message):
     """Handle VIP content name input from message"""
     handle_vip_name_input(message)
 
-@bot.message_handler(func=lambda message: message.from_user.id == OWNER_ID and OWNER_ID in upload_sessions and upload_sessions[OWNER_ID].get('type') == 'vip_content' and upload_sessions[OWNER_ID].get('step') == 'waiting_for_description')
+@bot.message_handler(func=lambda message: message.from_user.id == OWNER_ID and has_upload_session(OWNER_ID, 'vip_content', 'waiting_for_description'))
 def handle_vip_description_message(message):
     """Handle VIP content description input from message"""
     handle_vip_description_input(message)
 
-@bot.message_handler(func=lambda message: message.from_user.id == OWNER_ID and f"{OWNER_ID}_vip_teaser" in upload_sessions and upload_sessions.get(f"{OWNER_ID}_vip_teaser", {}).get('type') == 'vip_teaser' and upload_sessions.get(f"{OWNER_ID}_vip_teaser", {}).get('step') == 'waiting_for_name')
+@bot.message_handler(func=lambda message: message.from_user.id == OWNER_ID and has_upload_session(f"{OWNER_ID}_vip_teaser", 'vip_teaser', 'waiting_for_name'))
 def handle_vip_teaser_name(message):
     """Handle VIP teaser name input from owner"""
     teaser_key = f"{OWNER_ID}_vip_teaser"
-    session = upload_sessions.get(teaser_key, {})
+    session = get_upload_session(teaser_key)
     
     if not session or session.get('step') != 'waiting_for_name':
         bot.send_message(message.chat.id, "❌ No active VIP teaser name session found. Please restart the VIP teaser upload.")
@@ -3233,11 +5026,11 @@ Now add a description for this VIP teaser:
     
     bot.send_message(message.chat.id, desc_text, reply_markup=markup, parse_mode='HTML')
 
-@bot.message_handler(func=lambda message: message.from_user.id == OWNER_ID and f"{OWNER_ID}_vip_teaser" in upload_sessions and upload_sessions.get(f"{OWNER_ID}_vip_teaser", {}).get('type') == 'vip_teaser' and upload_sessions.get(f"{OWNER_ID}_vip_teaser", {}).get('step') == 'waiting_for_description')
+@bot.message_handler(func=lambda message: message.from_user.id == OWNER_ID and has_upload_session(f"{OWNER_ID}_vip_teaser", 'vip_teaser', 'waiting_for_description'))
 def handle_vip_teaser_description(message):
     """Handle VIP teaser description from owner"""
     teaser_key = f"{OWNER_ID}_vip_teaser"
-    session = upload_sessions.get(teaser_key, {})
+    session = get_upload_session(teaser_key)
     
     if not session or session.get('step') != 'waiting_for_description':
         bot.send_message(message.chat.id, "❌ No active VIP teaser description session found. Please restart the VIP teaser upload.")
@@ -3258,8 +5051,8 @@ def handle_vip_teaser_description(message):
             
         add_teaser(file_path, file_type, description, vip_only=True)
         
-        # Send notifications to all VIP subscribers about the new VIP teaser
-        notification_stats = notify_vip_teaser_uploaded(description)
+        # The broadcast reports to the owner when it finishes, so don't hold up this update for it
+        start_broadcast_job(notify_vip_teaser_uploaded, description)
         
         success_text = f"""
 🎉 <b>VIP TEASER UPLOADED SUCCESSFULLY!</b> 🎉
@@ -3270,10 +5063,7 @@ def handle_vip_teaser_description(message):
 
 💎 Your VIP teaser is now live! VIP members will see this exclusive content when they use /teaser.
 
-📱 <b>VIP Notifications Sent:</b>
-✅ Delivered to {notification_stats['sent']} VIP members
-🚫 {notification_stats['blocked']} users have blocked the bot
-❌ {notification_stats['failed']} delivery failures
+📱 <b>VIP Notifications:</b> sending to VIP members in the background - you'll get a delivery report.
 
 🔄 You can upload multiple VIP teasers - the most recent one will be shown first to VIP members.
 """
@@ -3288,8 +5078,7 @@ def handle_vip_teaser_description(message):
         bot.send_message(OWNER_ID, f"❌ Error saving VIP teaser: {str(e)}")
     
     # Clear upload session
-    if teaser_key in upload_sessions:
-        del upload_sessions[teaser_key]
+    clear_upload_session(teaser_key)
 
 @bot.message_handler(func=lambda message: is_owner(message.from_user.id) and has_upload_session(message.from_user.id, 'teaser', 'waiting_for_description'))
 def handle_teaser_description(message):
@@ -3309,8 +5098,8 @@ def handle_teaser_description(message):
         add_teaser(session['file_path'], session['file_type'], description)
         logger.info("Teaser saved successfully to database")
         
-        # Send notifications to all non-VIP users about the new free teaser
-        notification_stats = notify_free_teaser_uploaded(description)
+        # The broadcast reports to the owner when it finishes, so don't hold up this update for it
+        start_broadcast_job(notify_free_teaser_uploaded, description)
         
         success_text = f"""
 🎉 <b>FREE TEASER UPLOADED SUCCESSFULLY!</b> 🎉
@@ -3320,10 +5109,7 @@ def handle_teaser_description(message):
 
 🎁 Your free teaser is now live! Non-VIP users will see this when they use /teaser.
 
-📱 <b>Free Teaser Notifications Sent:</b>
-✅ Delivered to {notification_stats['sent']} non-VIP users
-🚫 {notification_stats['blocked']} users have blocked the bot
-❌ {notification_stats['failed']} delivery failures
+📱 <b>Free Teaser Notifications:</b> sending to non-VIP users in the background - you'll get a delivery report.
 
 🔄 You can upload multiple teasers - the most recent one will be shown first.
 """
@@ -3410,6 +5196,66 @@ def owner_delete_teaser_command(message):
     else:
         bot.send_message(message.chat.id, f"❌ Teaser ID {teaser_id} not found.")
 
+# Keyset pagination for owner listing screens - each page is one indexed range query
+
+OWNER_LIST_PAGE_SIZE = 15
+
+# Stands in for a missing date when paging, so undated rows sort last instead of vanishing
+KEYSET_MISSING_DATE = datetime.datetime(1970, 1, 1)
+
+def encode_page_cursor(sort_value, row_id):
+    """Encode a (sort value, id) position for use in callback_data"""
+    if isinstance(sort_value, datetime.datetime):
+        sort_value = sort_value.isoformat()
+    return f"{sort_value}~{row_id}"
+
+def decode_page_cursor(cursor, sort_type):
+    """Decode a cursor made by encode_page_cursor, returning (sort_value, id)"""
+    sort_value, row_id = cursor.rsplit('~', 1)
+    if sort_type is datetime.datetime:
+        sort_value = datetime.datetime.fromisoformat(sort_value)
+    else:
+        sort_value = sort_type(sort_value)
+    return sort_value, int(row_id)
+
+def fetch_keyset_page(query, sort_column, id_column, cursor=None, direction='n', page_size=OWNER_LIST_PAGE_SIZE):
+    """Fetch one page of query ordered by (sort_column, id_column) descending.
+
+    sort_column must never be NULL - comparisons with NULL drop rows after the
+    first page - so wrap nullable columns in coalesce().
+
+    Args:
+        cursor: (sort_value, id) of the row the page starts after ('n') or ends before ('p')
+        direction: 'n' for the next (older/smaller) page, 'p' for the previous page
+
+    Returns:
+        tuple: (rows, has_prev, has_next) with rows always in descending order
+    """
+    if cursor is None:
+        rows = query.order_by(sort_column.desc(), id_column.desc()).limit(page_size + 1).all()
+        return rows[:page_size], False, len(rows) > page_size
+
+    sort_value, row_id = cursor
+    if direction == 'p':
+        rows = query.filter(or_(sort_column > sort_value, and_(sort_column == sort_value, id_column > row_id))) \
+            .order_by(sort_column.asc(), id_column.asc()).limit(page_size + 1).all()
+        has_prev = len(rows) > page_size
+        return list(reversed(rows[:page_size])), has_prev, True
+
+    rows = query.filter(or_(sort_column < sort_value, and_(sort_column == sort_value, id_column < row_id))) \
+        .order_by(sort_column.desc(), id_column.desc()).limit(page_size + 1).all()
+    return rows[:page_size], True, len(rows) > page_size
+
+def add_page_buttons(markup, list_name, rows, has_prev, has_next, cursor_of):
+    """Add Prev/Next buttons carrying keyset cursors for list_name to markup"""
+    buttons = []
+    if has_prev and rows:
+        buttons.append(types.InlineKeyboardButton("⬅️ Prev", callback_data=f"page_{list_name}_p_{cursor_of(rows[0])}"))
+    if has_next and rows:
+        buttons.append(types.InlineKeyboardButton("Next ➡️", callback_data=f"page_{list_name}_n_{cursor_of(rows[-1])}"))
+    if buttons:
+        markup.row(*buttons)
+
 @bot.message_handler(commands=['owner_list_users'])
 def owner_list_users(message):
     """Handle /owner_list_users command - show only paying customers"""
@@ -3417,7 +5263,12 @@ def owner_list_users(message):
         bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
         return
     
-    with app.app_context():
+    show_paying_customers_page(message.chat.id)
+
+def show_paying_customers_page(chat_id, cursor=None, direction='n'):
+    """Show one page of paying customers ordered by stars spent"""
+    with app_context_scope():
+        read_db = get_read_session()
         try:
             bot_info = bot.get_me()
             bot_id = bot_info.id
@@ -3425,28 +5276,23 @@ def owner_list_users(message):
             bot_id = 0
         
         # Get paying customers with loyal fan status
-        paying_customers = db.session.query(
+        customers_query = read_db.query(
             User.user_id, User.username, User.first_name, User.total_stars_spent, 
             User.interaction_count, 
             case((LoyalFan.user_id.is_not(None), 'Yes'), else_='No').label('is_loyal')
         ).outerjoin(LoyalFan, User.user_id == LoyalFan.user_id).filter(
             User.total_stars_spent > 0,
             User.user_id != bot_id
-        ).order_by(User.total_stars_spent.desc()).all()
-        
-        # Get stats
-        stats = db.session.query(
-            func.count(User.user_id),
-            func.sum(User.total_stars_spent)
-        ).filter(
-            User.total_stars_spent > 0,
-            User.user_id != bot_id
-        ).first()
-        
-        if stats and len(stats) >= 2:
-            total_paying_customers, total_revenue = stats[0] or 0, stats[1] or 0
-        else:
-            total_paying_customers, total_revenue = 0, 0
+        )
+        paying_customers, has_prev, has_next = fetch_keyset_page(
+            customers_query, User.total_stars_spent, User.user_id,
+            decode_page_cursor(cursor, int) if cursor else None, direction
+        )
+    
+    # Stats come from the analytics counters instead of a scan over all users
+    totals = get_analytics_totals()
+    total_paying_customers = totals.get('paying_users', 0)
+    total_revenue = totals.get('revenue_stars', 0)
     
     if paying_customers:
         user_text = "💰 <b>PAYING CUSTOMERS</b> 💰\n\n"
@@ -3455,7 +5301,7 @@ def owner_list_users(message):
         user_text += f"💰 Total Revenue: {total_revenue or 0} Stars\n"
         user_text += f"📈 Average Revenue per Customer: {(total_revenue or 0) / max(total_paying_customers or 1, 1):.1f} Stars\n\n"
         
-        for user_id, username, first_name, stars_spent, interactions, is_loyal in paying_customers[:15]:  # Show top 15
+        for user_id, username, first_name, stars_spent, interactions, is_loyal in paying_customers:
             # Escape HTML characters in usernames to prevent parsing errors
             safe_username = (username or 'none').replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
             safe_first_name = (first_name or 'N/A').replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
@@ -3465,12 +5311,13 @@ def owner_list_users(message):
                 user_text += " | ⭐ LOYAL"
             user_text += f"\n   🆔 ID: {user_id}\n\n"
         
-        if len(paying_customers) > 15:
-            user_text += f"... and {len(paying_customers) - 15} more paying customers"
+        markup = types.InlineKeyboardMarkup()
+        add_page_buttons(markup, 'users', paying_customers, has_prev, has_next,
+                         lambda row: encode_page_cursor(row.total_stars_spent, row.user_id))
         
-        bot.send_message(message.chat.id, user_text, parse_mode='HTML')
+        bot.send_message(chat_id, user_text, reply_markup=markup, parse_mode='HTML')
     else:
-        bot.send_message(message.chat.id, "💰 No paying customers yet. Share your content to start earning! 🚀")
+        bot.send_message(chat_id, "💰 No paying customers yet. Share your content to start earning! 🚀")
 
 @bot.message_handler(commands=['owner_analytics'])
 def owner_analytics(message):
@@ -3479,47 +5326,28 @@ def owner_analytics(message):
         bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
         return
     
-    with app.app_context():
+    with app_context_scope():
+        read_db = get_read_session()
         try:
             bot_info = bot.get_me()
             bot_id = bot_info.id
         except:
             bot_id = 0
         
-        # Get paying customers statistics
-        paying_stats = db.session.query(
-            func.count(User.user_id),
-            func.sum(User.total_stars_spent),
-            func.sum(User.interaction_count)
-        ).filter(
-            User.total_stars_spent > 0,
-            User.user_id != bot_id
-        ).first()
-        
-        if paying_stats and len(paying_stats) >= 3:
-            paying_customers, total_revenue, paying_interactions = paying_stats[0] or 0, paying_stats[1] or 0, paying_stats[2] or 0
-        else:
-            paying_customers, total_revenue, paying_interactions = 0, 0, 0
-        
-        # Get all users statistics
-        all_stats = db.session.query(
-            func.count(User.user_id),
-            func.sum(User.interaction_count)
-        ).filter(User.user_id != bot_id).first()
-        
-        if all_stats and len(all_stats) >= 2:
-            total_users, total_interactions = all_stats[0] or 0, all_stats[1] or 0
-        else:
-            total_users, total_interactions = 0, 0
+        # Get user and revenue totals from the analytics counters (bots are never registered as users)
+        totals = get_analytics_totals()
+        paying_customers = totals.get('paying_users', 0)
+        total_revenue = totals.get('revenue_stars', 0)
+        total_users = totals.get('users', 0)
         
         # Get top spenders
-        top_spenders = User.query.filter(
+        top_spenders = read_db.query(User).filter(
             User.total_stars_spent > 0,
             User.user_id != bot_id
         ).order_by(User.total_stars_spent.desc()).limit(5).all()
         
         # Get content performance
-        content_items = ContentItem.query.with_entities(ContentItem.name, ContentItem.price_stars).all()
+        content_items = read_db.query(ContentItem).with_entities(ContentItem.name, ContentItem.price_stars).all()
     
     # Calculate conversion rate
     conversion_rate = (paying_customers / max(total_users or 1, 1)) * 100 if total_users else 0
@@ -3552,71 +5380,549 @@ def owner_analytics(message):
     
     bot.send_message(message.chat.id, analytics_text, parse_mode='Markdown')
 
-@bot.message_handler(commands=['owner_set_response'])
-def owner_set_response(message):
-    """Handle /owner_set_response command"""
+@bot.message_handler(commands=['owner_rebuild_analytics'])
+def owner_rebuild_analytics(message):
+    """Handle /owner_rebuild_analytics command - recompute analytics counters from scratch"""
     if not is_owner(message.from_user.id):
         bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
         return
     
-    parts = message.text.split(' ', 2)
-    if len(parts) < 3:
-        bot.send_message(message.chat.id, "❌ Usage: /owner_set_response [key] [text]\nKeys: greeting, question, compliment, default")
+    try:
+        row_count = rebuild_analytics_counters()
+        bucket_count = rebuild_revenue_rollups()
+        totals = get_analytics_totals()
+        bot.send_message(message.chat.id, f"""✅ Analytics counters rebuilt ({row_count} rows, {bucket_count} revenue buckets)
+
+👥 Users: {totals.get('users', 0):,}
+💰 Paying Customers: {totals.get('paying_users', 0):,}
+⭐ Revenue: {totals.get('revenue_stars', 0):,} Stars""")
+    except Exception as e:
+        logger.error(f"Error rebuilding analytics counters: {e}")
+        bot.send_message(message.chat.id, f"❌ Error rebuilding analytics: {str(e)}")
+
+@bot.message_handler(commands=['owner_check_analytics'])
+def owner_check_analytics(message):
+    """Handle /owner_check_analytics command - verify counters against the source tables"""
+    if not is_owner(message.from_user.id):
+        bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
         return
     
-    key = parts[1]
-    text = parts[2]
+    try:
+        drift = check_analytics_counters()
+    except Exception as e:
+        logger.error(f"Error checking analytics counters: {e}")
+        bot.send_message(message.chat.id, f"❌ Error checking analytics: {str(e)}")
+        return
     
-    valid_keys = ['greeting', 'question', 'compliment', 'default']
-    if key not in valid_keys:
-        bot.send_message(message.chat.id, f"❌ Invalid key. Valid keys: {', '.join(valid_keys)}")
+    if not drift:
+        bot.send_message(message.chat.id, "✅ Analytics counters are consistent with the database.")
         return
     
-    with app.app_context():
-        response = Response.query.filter_by(key=key).first()
-        if response:
-            response.text = text
+    report = "⚠️ Analytics counters have drifted:\n\n"
+    for metric, stored, actual in drift:
+        report += f"• {metric}: counter {stored:,} | actual {actual:,}\n"
+    report += "\n🔄 Run /owner_rebuild_analytics to fix them."
+    bot.send_message(message.chat.id, report)
+
+@bot.message_handler(commands=['owner_revenue'])
+def owner_revenue(message):
+    """Handle /owner_revenue command - revenue time series from the payment rollups"""
+    if not is_owner(message.from_user.id):
+        bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
+        return
+    
+    parts = message.text.split()
+    period = parts[1].lower() if len(parts) > 1 else 'day'
+    if period not in REVENUE_PERIODS:
+        bot.send_message(message.chat.id, "❌ Usage: /owner_revenue [day|week|month]")
+        return
+    
+    limits = {'day': 14, 'week': 8, 'month': 12}
+    series = get_revenue_series(period, limits[period])
+    if not series:
+        bot.send_message(message.chat.id, "📈 No payments recorded yet.")
+        return
+    
+    labels = {'day': 'DAILY', 'week': 'WEEKLY', 'month': 'MONTHLY'}
+    report = f"📈 <b>{labels[period]} REVENUE</b> 📈\n\n"
+    for bucket_start, payments, revenue, content_revenue, vip_revenue in series:
+        if period == 'month':
+            label = bucket_start.strftime('%b %Y')
+        elif period == 'week':
+            label = f"Week of {bucket_start.strftime('%b %d')}"
         else:
-            response = Response()
-            response.key = key
-            response.text = text
-            db.session.add(response)
-        db.session.commit()
+            label = bucket_start.strftime('%a %b %d')
+        report += f"<b>{label}</b>: {revenue:,} ⭐ ({payments} payments)\n"
+        report += f"   🛒 Content {content_revenue:,} | 💎 VIP {vip_revenue:,}\n"
     
-    bot.send_message(message.chat.id, f"✅ AI response for '{key}' updated successfully!")
-
+    report += "\n💡 Use /owner_revenue day, week or month | /owner_cohorts for retention"
+    bot.send_message(message.chat.id, report, parse_mode='HTML')
 
-@bot.message_handler(commands=['owner_help'])
-def owner_help(message):
-    """Handle /owner_help command"""
+@bot.message_handler(commands=['owner_cohorts'])
+def owner_cohorts(message):
+    """Handle /owner_cohorts command - monthly paying-customer retention"""
     if not is_owner(message.from_user.id):
         bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
         return
     
-    help_text = """
-🔧 **OWNER COMMANDS** 🔧
-
-💎 **VIP Management:**
-• `/vip` - VIP content management dashboard
-• VIP content is exclusive to VIP subscribers only
-• VIP members get FREE access to all VIP content
-• Higher revenue potential through monthly subscriptions
-• Focus here first for maximum profitability!
+    retention = get_cohort_retention()
+    if not retention:
+        bot.send_message(message.chat.id, "👥 No payment cohorts yet.")
+        return
+    
+    report = "👥 <b>PAYING CUSTOMER RETENTION</b> 👥\n\n"
+    report += "Customers grouped by month of first payment, with the share who paid again in each following month.\n\n"
+    for cohort_month, size, active in retention:
+        shares = " | ".join(f"M{offset} {users * 100 // max(size, 1)}%" for offset, users in enumerate(active[1:], 1))
+        report += f"<b>{cohort_month.strftime('%b %Y')}</b> ({size} customers)\n"
+        report += f"   {shares or 'No repeat months yet'}\n"
+    
+    bot.send_message(message.chat.id, report, parse_mode='HTML')
 
-📦 **Content Management:**
-• `/owner_upload` - Guided file upload (photos/videos/documents)
-• `/owner_add_content [name] [price] [url] [description]` - Add content via URL
-• `/owner_delete_content [name]` - Remove content
+@bot.message_handler(commands=['owner_segment'])
+def owner_segment(message):
+    """Handle /owner_segment command - preview a custom audience segment and notify it"""
+    if not is_owner(message.from_user.id):
+        bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
+        return
+    
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        usage = "\n".join(
+            "• <code>" + text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;') + "</code>"
+            for _, text in SEGMENT_PREDICATES.values()
+        )
+        bot.send_message(message.chat.id, f"""🧩 <b>AUDIENCE SEGMENTS</b> 🧩
 
-🎬 **Teaser Management:**
-• `/owner_upload_teaser` - Upload teasers for non-VIP users
-• `/owner_list_teasers` - View all uploaded teasers
-• `/owner_delete_teaser [ID]` - Delete teaser by ID
+Combine any of these predicates (all must match):
+{usage}
 
-👥 **User Management:**
+Example: <code>/owner_segment spent&gt;100 active&lt;30</code>""", parse_mode='HTML')
+        return
+    
+    try:
+        segment = format_segment(parse_segment(parts[1]))
+    except ValueError as e:
+        safe_error = str(e).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        bot.send_message(message.chat.id, f"❌ {safe_error}\n\nSend /owner_segment to see the available predicates.", parse_mode='HTML')
+        return
+    
+    user_count = count_audience('segment', segment)
+    notification_sessions.set(f"{message.chat.id}_segment", {'segment': segment})
+    safe_segment = (segment or 'everyone').replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    
+    markup = types.InlineKeyboardMarkup()
+    if user_count:
+        markup.add(types.InlineKeyboardButton("📢 Notify This Segment", callback_data="notify_segment_users"))
+    markup.add(types.InlineKeyboardButton("🔙 Notification Menu", callback_data="notification_management_menu"))
+    
+    bot.send_message(message.chat.id, f"""🧩 <b>SEGMENT PREVIEW</b> 🧩
+
+🎯 <b>Segment:</b> <code>{safe_segment}</code>
+👥 <b>Matching users:</b> {user_count:,}""", reply_markup=markup, parse_mode='HTML')
+
+@bot.message_handler(commands=['owner_fulfillment'])
+def owner_fulfillment(message):
+    """Handle /owner_fulfillment command - show queued deliveries and retry failed ones"""
+    if not is_owner(message.from_user.id):
+        bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
+        return
+    
+    parts = message.text.split()
+    with app_context_scope():
+        if len(parts) > 1 and parts[1].lower() == 'retry':
+            retried = FulfillmentJob.query.filter_by(status='failed').update({
+                FulfillmentJob.status: 'pending',
+                FulfillmentJob.attempts: 0,
+                FulfillmentJob.run_after: datetime.datetime.now()
+            }, synchronize_session=False)
+            db.session.commit()
+            fulfillment_wakeup.set()
+            bot.send_message(message.chat.id, f"🔄 Requeued {retried} failed fulfillment job(s).")
+            return
+        
+        counts = dict(db.session.query(FulfillmentJob.status, func.count(FulfillmentJob.id)).group_by(FulfillmentJob.status).all())
+        failed_jobs = FulfillmentJob.query.filter_by(status='failed').order_by(FulfillmentJob.id.desc()).limit(10).all()
+        failed = [(job.id, job.job_type, job.user_id, job.last_error) for job in failed_jobs]
+    
+    report = f"""📦 <b>PAYMENT FULFILLMENT QUEUE</b> 📦
+
+⏳ Pending: {counts.get('pending', 0)}
+🔄 Running: {counts.get('running', 0)}
+❌ Failed: {counts.get('failed', 0)}
+"""
+    if failed:
+        report += "\n<b>Recent failures:</b>\n"
+        for job_id, job_type, user_id, last_error in failed:
+            safe_error = (last_error or 'Unknown error')[:150].replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+            report += f"• #{job_id} {job_type} for {user_id}: {safe_error}\n"
+        report += "\n🔄 Use /owner_fulfillment retry to requeue failed jobs."
+    
+    bot.send_message(message.chat.id, report, parse_mode='HTML')
+
+@bot.message_handler(commands=['owner_ingest_urls'])
+def owner_ingest_urls(message):
+    """Handle /owner_ingest_urls command - convert many external image URLs to file_ids at once"""
+    if not is_owner(message.from_user.id):
+        bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
+        return
+    
+    urls = [part for part in message.text.split()[1:] if part.startswith('http')]
+    if not urls:
+        bot.send_message(message.chat.id, f"""📥 <b>BULK MEDIA INGESTION</b> 📥
+
+Send up to {MEDIA_INGEST_MAX_URLS} image URLs separated by spaces or new lines:
+<code>/owner_ingest_urls https://example.com/a.jpg https://example.com/b.png</code>
+
+Each image is downloaded and uploaded to Telegram once; duplicates are skipped and you get back permanent file_ids.""", parse_mode='HTML')
+        return
+    
+    if len(urls) > MEDIA_INGEST_MAX_URLS:
+        bot.send_message(message.chat.id, f"❌ Too many URLs ({len(urls)}). Send at most {MEDIA_INGEST_MAX_URLS} per batch.")
+        return
+    
+    # Downloads can take a while, so don't hold up the update lane
+    if not start_media_job(ingest_media_urls, urls, message.chat.id):
+        bot.send_message(message.chat.id, "⏳ A media ingestion or catalog import is already running. Try again when it finishes.")
+
+@bot.message_handler(commands=['owner_schedule'])
+def owner_schedule(message):
+    """Handle /owner_schedule command - schedule a broadcast for later"""
+    if not is_owner(message.from_user.id):
+        bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
+        return
+    
+    head, separator, content = message.text.partition('|')
+    content = content.strip()
+    if not separator or not content:
+        bot.send_message(message.chat.id, """⏰ <b>SCHEDULE A POST</b> ⏰
+
+<b>Usage:</b>
+<code>/owner_schedule in 2h | Your message</code>
+<code>/owner_schedule 18:30 vip | Your message</code>
+<code>/owner_schedule 2025-12-24 20:00 non_vip | Your message</code>
+<code>/owner_schedule in 1d spent&gt;100 active&lt;30 | Your message</code>
+
+The audience is all, vip, non_vip or segment predicates (see /owner_segment); all users by default. The message supports HTML formatting.""", parse_mode='HTML')
+        return
+    
+    if len(content) > 4000:
+        bot.send_message(message.chat.id, "❌ Message is too long. Keep it under 4000 characters.")
+        return
+    
+    try:
+        when, rest = parse_schedule_time(head.split()[1:])
+        audience = ' '.join(rest)
+        if audience.lower() in ('', 'all', 'vip', 'non_vip'):
+            target_group, segment = audience.lower() or 'all', None
+        else:
+            target_group, segment = 'segment', format_segment(parse_segment(audience))
+    except ValueError as e:
+        safe_error = str(e).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        bot.send_message(message.chat.id, f"❌ {safe_error}", parse_mode='HTML')
+        return
+    
+    post_id = queue_scheduled_post(when, content, target_group, segment)
+    
+    audience_label = segment if target_group == 'segment' else target_group
+    safe_audience = audience_label.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    bot.send_message(message.chat.id, f"""✅ <b>POST #{post_id} SCHEDULED</b>
+
+🕐 <b>Sends at:</b> {when.strftime('%Y-%m-%d %H:%M')}
+🎯 <b>Audience:</b> <code>{safe_audience}</code>
+
+❌ Cancel with /owner_unschedule {post_id}""", parse_mode='HTML')
+
+@bot.message_handler(commands=['owner_schedules'])
+def owner_schedules(message):
+    """Handle /owner_schedules command - list upcoming and recent scheduled posts"""
+    if not is_owner(message.from_user.id):
+        bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
+        return
+    
+    with app_context_scope():
+        rows = db.session.query(ScheduledPost, ScheduledPostState).join(
+            ScheduledPostState, ScheduledPostState.post_id == ScheduledPost.id
+        )
+        upcoming = rows.filter(ScheduledPostState.status.in_(['pending', 'sending'])).order_by(ScheduledPost.datetime).limit(15).all()
+        recent = rows.filter(~ScheduledPostState.status.in_(['pending', 'sending'])).order_by(ScheduledPost.datetime.desc()).limit(5).all()
+        upcoming = [(post.id, post.datetime, post.content, state.target_group, state.segment, state.status, state.sent_count) for post, state in upcoming]
+        recent = [(post.id, post.datetime, post.content, state.target_group, state.segment, state.status, state.sent_count) for post, state in recent]
+    
+    if not upcoming and not recent:
+        bot.send_message(message.chat.id, "📭 No scheduled posts. Use /owner_schedule to create one.")
+        return
+    
+    status_icons = {'pending': '⏳', 'sending': '📤', 'sent': '✅', 'cancelled': '🚫', 'missed': '⌛', 'interrupted': '⚠️', 'failed': '❌'}
+    
+    def describe(post_id, when, content, target_group, segment, status, sent_count):
+        audience = segment if target_group == 'segment' else target_group
+        preview = content[:60] + ('...' if len(content) > 60 else '')
+        safe_preview = preview.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        safe_audience = audience.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        line = f"{status_icons.get(status, '•')} #{post_id} {when.strftime('%Y-%m-%d %H:%M')} → <code>{safe_audience}</code> ({status}"
+        line += f", {sent_count} sent)" if status == 'sent' else ")"
+        return line + f"\n    {safe_preview}\n"
+    
+    report = "⏰ <b>SCHEDULED POSTS</b> ⏰\n"
+    if upcoming:
+        report += "\n<b>Upcoming:</b>\n" + ''.join(describe(*row) for row in upcoming)
+    if recent:
+        report += "\n<b>Recent:</b>\n" + ''.join(describe(*row) for row in recent)
+    report += "\n❌ Cancel with /owner_unschedule [id]"
+    
+    bot.send_message(message.chat.id, report, parse_mode='HTML')
+
+@bot.message_handler(commands=['owner_unschedule'])
+def owner_unschedule(message):
+    """Handle /owner_unschedule command - cancel a scheduled post that has not been sent"""
+    if not is_owner(message.from_user.id):
+        bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
+        return
+    
+    parts = message.text.split()
+    if len(parts) < 2 or not parts[1].lstrip('#').isdigit():
+        bot.send_message(message.chat.id, "❌ Usage: /owner_unschedule [id]\n\nSee /owner_schedules for post ids.")
+        return
+    post_id = int(parts[1].lstrip('#'))
+    
+    with app_context_scope():
+        cancelled = ScheduledPostState.query.filter_by(post_id=post_id, status='pending').update({
+            ScheduledPostState.status: 'cancelled',
+            ScheduledPostState.finished_at: datetime.datetime.now()
+        }, synchronize_session=False)
+        db.session.commit()
+    
+    if not cancelled:
+        bot.send_message(message.chat.id, f"❌ Post #{post_id} is not waiting to be sent.")
+        return
+    
+    # Other processes skip it when the claim fails
+    if post_scheduler:
+        post_scheduler.disarm(post_id)
+    bot.send_message(message.chat.id, f"🚫 Scheduled post #{post_id} cancelled.")
+
+@bot.message_handler(commands=['owner_export'])
+def owner_export(message):
+    """Handle /owner_export command - download users, purchases or VIP subscriptions as a compressed file"""
+    if not is_owner(message.from_user.id):
+        bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
+        return
+    
+    options = [part.lower() for part in message.text.split()[1:]]
+    dataset = next((option for option in options if option in EXPORT_QUERIES), 'users')
+    file_format = next((option for option in options if option in SNAPSHOT_FILE_FORMATS), 'csv')
+    if any(option not in EXPORT_QUERIES and option not in SNAPSHOT_FILE_FORMATS and option != 'link' for option in options):
+        bot.send_message(message.chat.id, """❌ Usage: /owner_export [users|purchases|vips] [csv|jsonl] [link]
+
+Sends the data as a gzip file (users as CSV by default). Add <b>link</b> to get a download link instead.""", parse_mode='HTML')
+        return
+    
+    if 'link' in options:
+        bot.send_message(message.chat.id, f"""⬇️ <b>Export of {dataset} ({file_format})</b>
+
+Valid for {EXPORT_LINK_TTL_SECONDS // 60} minutes - keep it private:
+{generate_export_url(dataset, file_format).replace('&', '&amp;')}""", parse_mode='HTML')
+        return
+    
+    bot.send_message(message.chat.id, f"📦 Exporting {dataset}... the file will follow shortly.")
+    export_thread = threading.Thread(target=run_export_job, args=(message.chat.id, dataset, file_format))
+    export_thread.daemon = True
+    export_thread.start()
+
+def run_snapshot_job(chat_id, job, snapshot_id=None, full=False, destination='table'):
+    """Take or restore a user snapshot off the update thread and report back to the owner"""
+    try:
+        if job == 'restore':
+            applied = restore_user_snapshot(snapshot_id)
+            bot.send_message(chat_id, f"♻️ <b>Snapshot #{snapshot_id} restored</b> - {applied:,} user rows applied.", parse_mode='HTML')
+            return
+        
+        snapshot_id = take_user_snapshot(full=full, destination=destination)
+        with app_context_scope():
+            snapshot = db.session.get(UserSnapshot, snapshot_id)
+            kind, row_count, duration_ms, file_path = snapshot.kind, snapshot.row_count, snapshot.duration_ms, snapshot.file_path
+        
+        report = f"""📸 <b>SNAPSHOT #{snapshot_id} COMPLETE</b>
+
+🗂 <b>Type:</b> {kind} → {destination}
+👥 <b>Users copied:</b> {row_count:,}
+⏱ <b>Took:</b> {duration_ms / 1000:.1f}s"""
+        if file_path:
+            report += f"\n📁 <b>File:</b> <code>{file_path}</code>"
+        bot.send_message(chat_id, report, parse_mode='HTML')
+    except Exception as e:
+        logger.error(f"User snapshot {job} failed: {e}")
+        safe_error = str(e)[:300].replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        bot.send_message(chat_id, f"❌ Snapshot {job} failed: {safe_error}", parse_mode='HTML')
+
+@bot.message_handler(commands=['owner_snapshot'])
+def owner_snapshot(message):
+    """Handle /owner_snapshot command - back up users to user_backups or a compressed file"""
+    if not is_owner(message.from_user.id):
+        bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
+        return
+    
+    options = [part.lower() for part in message.text.split()[1:]]
+    unknown = [option for option in options if option not in ('full',) + SNAPSHOT_FILE_FORMATS]
+    if unknown:
+        bot.send_message(message.chat.id, """❌ Usage: /owner_snapshot [full] [jsonl|csv]
+
+Without options, users changed since the last snapshot are copied into the backup table. Add <b>full</b> to copy everyone, or <b>jsonl</b>/<b>csv</b> to write a gzip file instead.""", parse_mode='HTML')
+        return
+    
+    if snapshot_lock.locked():
+        bot.send_message(message.chat.id, "⏳ A snapshot or restore is already running. Try again when it finishes.")
+        return
+    
+    destination = next((option for option in options if option in SNAPSHOT_FILE_FORMATS), 'table')
+    bot.send_message(message.chat.id, "📸 Taking user snapshot... you'll get a report when it's done.")
+    snapshot_thread = threading.Thread(target=run_snapshot_job, args=(message.chat.id, 'snapshot'),
+                                       kwargs={'full': 'full' in options, 'destination': destination})
+    snapshot_thread.daemon = True
+    snapshot_thread.start()
+
+@bot.message_handler(commands=['owner_snapshots'])
+def owner_snapshots(message):
+    """Handle /owner_snapshots command - list recent user snapshots"""
+    if not is_owner(message.from_user.id):
+        bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
+        return
+    
+    with app_context_scope():
+        snapshots = UserSnapshot.query.order_by(UserSnapshot.id.desc()).limit(10).all()
+        snapshots = [(s.id, s.kind, s.destination, s.taken_at, s.status, s.row_count, s.duration_ms) for s in snapshots]
+    
+    if not snapshots:
+        bot.send_message(message.chat.id, "📭 No snapshots yet. Use /owner_snapshot to take one.")
+        return
+    
+    status_icons = {'running': '⏳', 'complete': '✅', 'failed': '❌'}
+    report = "📸 <b>USER SNAPSHOTS</b> 📸\n\n"
+    for snapshot_id, kind, destination, taken_at, status, row_count, duration_ms in snapshots:
+        took = f", {duration_ms / 1000:.1f}s" if duration_ms is not None else ""
+        report += f"{status_icons.get(status, '•')} #{snapshot_id} {taken_at.strftime('%Y-%m-%d %H:%M')} {kind} → {destination} ({row_count:,} users{took})\n"
+    report += "\n♻️ Restore with /owner_restore [id]"
+    
+    bot.send_message(message.chat.id, report, parse_mode='HTML')
+
+@bot.message_handler(commands=['owner_restore'])
+def owner_restore(message):
+    """Handle /owner_restore command - roll users back to a snapshot"""
+    if not is_owner(message.from_user.id):
+        bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
+        return
+    
+    parts = message.text.split()
+    if len(parts) < 2 or not parts[1].lstrip('#').isdigit():
+        bot.send_message(message.chat.id, "❌ Usage: /owner_restore [id] confirm\n\nSee /owner_snapshots for snapshot ids.")
+        return
+    snapshot_id = int(parts[1].lstrip('#'))
+    
+    with app_context_scope():
+        snapshot = db.session.get(UserSnapshot, snapshot_id)
+        found = snapshot is not None and snapshot.status == 'complete'
+        taken_at = snapshot.taken_at if found else None
+    if not found:
+        bot.send_message(message.chat.id, f"❌ Snapshot #{snapshot_id} doesn't exist or didn't complete.")
+        return
+    
+    if len(parts) < 3 or parts[2].lower() != 'confirm':
+        bot.send_message(message.chat.id, f"""⚠️ <b>RESTORE SNAPSHOT #{snapshot_id}</b>
+
+Names, usernames, spend and interaction stats of every user in the snapshot go back to how they were at {taken_at.strftime('%Y-%m-%d %H:%M')}. Users who joined later are kept.
+
+To go ahead, send: <code>/owner_restore {snapshot_id} confirm</code>""", parse_mode='HTML')
+        return
+    
+    if snapshot_lock.locked():
+        bot.send_message(message.chat.id, "⏳ A snapshot or restore is already running. Try again when it finishes.")
+        return
+    
+    bot.send_message(message.chat.id, f"♻️ Restoring snapshot #{snapshot_id}...")
+    restore_thread = threading.Thread(target=run_snapshot_job, args=(message.chat.id, 'restore', snapshot_id))
+    restore_thread.daemon = True
+    restore_thread.start()
+
+@bot.message_handler(commands=['owner_set_response'])
+def owner_set_response(message):
+    """Handle /owner_set_response command"""
+    if not is_owner(message.from_user.id):
+        bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
+        return
+    
+    parts = message.text.split(' ', 2)
+    if len(parts) < 3:
+        bot.send_message(message.chat.id, "❌ Usage: /owner_set_response [key] [text]\nKeys: greeting, question, compliment, default")
+        return
+    
+    key = parts[1]
+    text = parts[2]
+    
+    valid_keys = ['greeting', 'question', 'compliment', 'default']
+    if key not in valid_keys:
+        bot.send_message(message.chat.id, f"❌ Invalid key. Valid keys: {', '.join(valid_keys)}")
+        return
+    
+    with app_context_scope():
+        response = Response.query.filter_by(key=key).first()
+        if response:
+            response.text = text
+        else:
+            response = Response()
+            response.key = key
+            response.text = text
+            db.session.add(response)
+        db.session.commit()
+    
+    bot.send_message(message.chat.id, f"✅ AI response for '{key}' updated successfully!")
+
+
+@bot.message_handler(commands=['owner_help'])
+def owner_help(message):
+    """Handle /owner_help command"""
+    if not is_owner(message.from_user.id):
+        bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
+        return
+    
+    help_text = """
+🔧 **OWNER COMMANDS** 🔧
+
+💎 **VIP Management:**
+• `/vip` - VIP content management dashboard
+• VIP content is exclusive to VIP subscribers only
+• VIP members get FREE access to all VIP content
+• Higher revenue potential through monthly subscriptions
+• Focus here first for maximum profitability!
+
+📦 **Content Management:**
+• `/owner_upload` - Guided file upload (photos/videos/documents)
+• `/owner_add_content [name] [price] [url] [description]` - Add content via URL
+• `/owner_ingest_urls [url] [url] ...` - Convert image URLs to file_ids in bulk
+• `/owner_import` - Bulk import content from a CSV/JSON/zip manifest
+• `/owner_delete_content [name]` - Remove content
+
+🎬 **Teaser Management:**
+• `/owner_upload_teaser` - Upload teasers for non-VIP users
+• `/owner_list_teasers` - View all uploaded teasers
+• `/owner_delete_teaser [ID]` - Delete teaser by ID
+
+👥 **User Management:**
 • `/owner_list_users` - View paying customers only
 • `/owner_analytics` - Detailed analytics dashboard
 • `/owner_list_vips` - View active VIP subscribers
+• `/owner_check_analytics` - Verify analytics counters
+• `/owner_rebuild_analytics` - Rebuild analytics counters
+• `/owner_revenue [day|week|month]` - Revenue over time
+• `/owner_cohorts` - Paying customer retention
+• `/owner_fulfillment [retry]` - Paid delivery queue status
+• `/owner_schedule [when] [audience] | [message]` - Schedule a broadcast
+• `/owner_schedules` - List scheduled posts
+• `/owner_unschedule [id]` - Cancel a scheduled post
+• `/owner_snapshot [full] [jsonl|csv]` - Back up users
+• `/owner_snapshots` - List user snapshots
+• `/owner_restore [id] confirm` - Restore users from a snapshot
+• `/owner_export [users|purchases|vips] [csv|jsonl] [link]` - Export data as a file
 
 ⭐ **Loyal Fan Management:**
 • Mark your best customers as loyal fans
@@ -3627,6 +5933,7 @@ def owner_help(message):
 📢 **Notification System:**
 • Send targeted messages to specific user groups
 • Notify all users, VIP only, or non-VIP only
+• `/owner_segment [predicates]` - Preview and notify a custom segment
 • Interactive message composition interface
 • Track delivery statistics and blocked users
 
@@ -3688,7 +5995,7 @@ Choose an action below to manage your content:
 def show_edit_content_menu(chat_id):
     """Show Edit Content menu with all content items as buttons"""
     # Get only browse content items (VIP content is managed separately)
-    with app.app_context():
+    with app_context_scope():
         items = ContentItem.query.filter_by(content_type='browse').order_by(ContentItem.created_date.desc()).all()
         items = [(item.name, item.price_stars, item.description, item.content_type, item.created_date.isoformat()) for item in items]
     
@@ -3745,7 +6052,7 @@ Found {len(items)} browse content item(s). Click on any item below to edit its d
 def show_delete_content_menu(chat_id):
     """Show Delete Content menu with all content items as buttons"""
     # Get only browse content items (VIP content is managed separately)
-    with app.app_context():
+    with app_context_scope():
         items = ContentItem.query.filter_by(content_type='browse').order_by(ContentItem.created_date.desc()).all()
         items = [(item.name, item.price_stars, item.description, item.content_type, item.created_date.isoformat()) for item in items]
     
@@ -3804,7 +6111,7 @@ Found {len(items)} browse content item(s). Click on any item below to permanentl
 def show_content_edit_interface(chat_id, content_name):
     """Show edit interface for a specific content item"""
     # Get content details
-    with app.app_context():
+    with app_context_scope():
         item = ContentItem.query.filter_by(name=content_name).first()
         if item:
             content = (item.name, item.price_stars, item.file_path, item.description, item.content_type, item.created_date.isoformat())
@@ -3835,7 +6142,7 @@ def show_content_edit_interface(chat_id, content_name):
     def generate_preview_url(content_name):
         """Generate secure preview URL using Flask's url_for within app context"""
         try:
-            with app.app_context():
+            with app_context_scope():
                 from flask import url_for, request
                 # Use url_for to generate the URL properly
                 return url_for('preview_content', content_name=content_name, _external=True)
@@ -4165,7 +6472,7 @@ Please enter either:
     session['step'] = 'waiting_for_reason'
     session['target_id'] = target_id
     session['target_display'] = target_display
-    upload_sessions[owner_id] = session
+    start_upload_session(owner_id, session)
     
     reason_text = f"""
 🚫 <b>BLOCK USER</b> 🚫
@@ -4325,7 +6632,7 @@ Choose an action below to configure bot settings:
 def show_loyal_fan_management_menu(chat_id):
     """Show Loyal Fan Management section menu"""
     # Get loyal fan count
-    with app.app_context():
+    with app_context_scope():
         loyal_count = LoyalFan.query.count()
     
     menu_text = f"""
@@ -4360,6 +6667,7 @@ Send targeted messages to your users.
 • All Users - Everyone who has used the bot
 • VIP Members Only - Active VIP subscribers
 • Non-VIP Users - Users without VIP status
+• Custom Segments - Build one with /owner_segment
 
 Choose who to notify:
 """
@@ -4382,18 +6690,20 @@ def owner_vip_analytics(message):
         bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
         return
     
-    with app.app_context():
+    with app_context_scope():
+        read_db = get_read_session()
         # Get VIP statistics
-        active_vip_count = VipSubscription.query.filter_by(is_active=True).count()
-        total_vip_subscriptions = VipSubscription.query.count()
-        total_vip_payments = db.session.query(func.sum(VipSubscription.total_payments)).scalar() or 0
+        active_vip_count = read_db.query(VipSubscription).filter_by(is_active=True).count()
+        total_vip_subscriptions = read_db.query(VipSubscription).count()
+        total_vip_payments = read_db.query(func.sum(VipSubscription.total_payments)).scalar() or 0
     
     # Get VIP settings
         vip_price = int(get_vip_settings('vip_price_stars') or 399)
-        total_vip_revenue = total_vip_payments * vip_price
+        # Revenue comes from recorded payments so past price changes are respected
+        total_vip_revenue = get_analytics_totals().get('vip_revenue_stars', 0)
         
         # Get VIP users details
-        active_vips = db.session.query(
+        active_vips = read_db.query(
             User.first_name, User.username, VipSubscription.start_date, 
             VipSubscription.expiry_date, VipSubscription.total_payments
         ).join(VipSubscription, User.user_id == VipSubscription.user_id).filter(
@@ -4434,7 +6744,7 @@ def vip_command(message):
     vip_duration = get_vip_settings('vip_duration_days') or '30'
     
     # Get VIP subscriber count
-    with app.app_context():
+    with app_context_scope():
         vip_subscribers = VipSubscription.query.filter_by(is_active=True).count()
         vip_count = ContentItem.query.filter_by(content_type='vip').count()
     
@@ -4607,17 +6917,16 @@ Use the buttons below for guided setup, or use manual commands:
 def show_vip_analytics(chat_id):
     """Show VIP analytics dashboard"""
     # Get VIP statistics
-    with app.app_context():
+    with app_context_scope():
+        read_db = get_read_session()
         # Active VIP subscribers
-        active_vips = VipSubscription.query.filter_by(is_active=True).count()
+        active_vips = read_db.query(VipSubscription).filter_by(is_active=True).count()
         
-        # Total VIP revenue (all time)
-        vip_price = int(get_vip_settings('vip_price_stars') or 399)
-        total_payments = db.session.query(func.sum(VipSubscription.total_payments)).scalar() or 0
-        total_vip_revenue = total_payments * vip_price
+        # Total VIP revenue (all time) from recorded payments
+        total_vip_revenue = get_analytics_totals().get('vip_revenue_stars', 0)
         
         # Top VIP subscribers
-        top_vips = db.session.query(
+        top_vips = read_db.query(
             VipSubscription.user_id, User.first_name, User.username, 
             VipSubscription.total_payments, VipSubscription.expiry_date
         ).outerjoin(User, VipSubscription.user_id == User.user_id).filter(
@@ -4709,11 +7018,11 @@ def start_vip_teaser_upload_session(chat_id, user_id):
     
     # Initialize VIP teaser upload session with dedicated key
     teaser_key = f"{OWNER_ID}_vip_teaser"
-    upload_sessions[teaser_key] = {
+    start_upload_session(teaser_key, {
         'type': 'vip_teaser',
         'step': 'waiting_for_file',
         'data': {}
-    }
+    })
     
     upload_text = """
 🎬 <b>VIP TEASER UPLOAD</b> 🎬
@@ -4838,7 +7147,7 @@ Select which VIP teaser you want to edit (replace photo/video):
 
 def start_vip_teaser_edit_session(chat_id, owner_id, teaser_id):
     """Start VIP teaser edit session"""
-    with app.app_context():
+    with app_context_scope():
         # Get teaser info using SQLAlchemy
         teaser = Teaser.query.filter_by(id=teaser_id, vip_only=True).first()
         
@@ -4907,7 +7216,7 @@ def show_vip_teasers_collection(chat_id, user_id):
         return
     
     # User is VIP, show VIP teasers collection
-    vip_teasers = get_vip_teasers()
+    vip_teaser_count, vip_teasers = get_teaser_collection(vip_only=True)
     
     if not vip_teasers:
         empty_text = f"""
@@ -4936,7 +7245,7 @@ Don't worry, babe! I'm working on creating exclusive VIP content just for my spe
 💎 Welcome to your exclusive VIP teaser collection! These special previews are made just for my VIP members.
 
 📊 <b>Your VIP Status:</b>
-• VIP Teasers Available: {len(vip_teasers)}
+• VIP Teasers Available: {vip_teaser_count}
 • VIP Expires: {vip_status['days_left']} days
 
 💕 Enjoy these exclusive glimpses into my world, beautiful! Each teaser is crafted with love just for VIPs like you.
@@ -4944,7 +7253,7 @@ Don't worry, babe! I'm working on creating exclusive VIP content just for my spe
     
     markup = types.InlineKeyboardMarkup(row_width=1)
     
-    for i, (file_path, file_type, description) in enumerate(vip_teasers[:5]):  # Show first 5
+    for i, (file_path, file_type, description) in enumerate(vip_teasers):  # Newest TEASER_COLLECTION_SIZE
         short_desc = description[:30] + "..." if len(description) > 30 else description
         button_text = f"💎 {file_type.title()} - {short_desc}"
         markup.add(types.InlineKeyboardButton(button_text, callback_data=f"view_vip_teaser_{i}"))
@@ -5040,13 +7349,13 @@ def show_vip_content_edit_interface(chat_id, content_name):
 
 def is_user_blocked(user_id):
     """Check if a user is blocked"""
-    with app.app_context():
+    with app_context_scope():
         blocked_user = BlockedUser.query.filter_by(user_id=user_id).first()
         return blocked_user is not None
 
 def block_user(user_id, reason=None, blocked_by=None):
     """Block a user by user_id"""
-    with app.app_context():
+    with app_context_scope():
         # Check if user is already blocked
         if is_user_blocked(user_id):
             return False, "User is already blocked"
@@ -5069,7 +7378,7 @@ def block_user(user_id, reason=None, blocked_by=None):
 
 def unblock_user(user_id):
     """Unblock a user by user_id"""
-    with app.app_context():
+    with app_context_scope():
         blocked_user = BlockedUser.query.filter_by(user_id=user_id).first()
         
         if not blocked_user:
@@ -5083,7 +7392,7 @@ def unblock_user(user_id):
 
 def get_blocked_users():
     """Get list of all blocked users with details"""
-    with app.app_context():
+    with app_context_scope():
         blocked_users_query = db.session.query(
             BlockedUser.user_id, 
             BlockedUser.blocked_date, 
@@ -5100,7 +7409,7 @@ def get_blocked_users():
 
 def resolve_username_to_user_id(username):
     """Try to resolve @username to user_id from database"""
-    with app.app_context():
+    with app_context_scope():
         # Remove @ if present
         clean_username = username.lstrip('@').lower()
         
@@ -5142,7 +7451,7 @@ def unblock_user_by_username(username):
 
 def get_user_display_name(user_id):
     """Get user's display name for blocking interface"""
-    with app.app_context():
+    with app_context_scope():
         user = User.query.filter_by(user_id=user_id).first()
         if user:
             name = user.first_name or "No name"
@@ -5158,17 +7467,23 @@ def owner_list_vips(message):
         bot.send_message(message.chat.id, "❌ Access denied. This is an owner-only command.")
         return
     
-    with app.app_context():
-        # Get all active VIP users using SQLAlchemy
-        vip_users_query = db.session.query(
+    show_vip_members_page(message.chat.id)
+
+def show_vip_members_page(chat_id, cursor=None, direction='n'):
+    """Show one page of active VIP members ordered by expiry date"""
+    with app_context_scope():
+        read_db = get_read_session()
+        # Get active VIP users using SQLAlchemy
+        vip_users_query = read_db.query(
             User.user_id, User.first_name, User.username, 
             VipSubscription.start_date, VipSubscription.expiry_date, VipSubscription.total_payments
         ).join(VipSubscription, User.user_id == VipSubscription.user_id).filter(
             VipSubscription.is_active == True
-        ).order_by(VipSubscription.expiry_date.desc()).all()
-        
-        vip_users = [(user_id, first_name, username, start_date, expiry_date, total_payments) 
-                     for user_id, first_name, username, start_date, expiry_date, total_payments in vip_users_query]
+        )
+        vip_users, has_prev, has_next = fetch_keyset_page(
+            vip_users_query, VipSubscription.expiry_date, VipSubscription.user_id,
+            decode_page_cursor(cursor, datetime.datetime) if cursor else None, direction
+        )
     
     if vip_users:
         vip_text = "💎 <b>ACTIVE VIP MEMBERS</b> 💎\n\n"
@@ -5179,7 +7494,7 @@ def owner_list_vips(message):
             
             # Calculate days left
             try:
-                expiry_datetime = datetime.datetime.fromisoformat(expiry_date)
+                expiry_datetime = expiry_date if isinstance(expiry_date, datetime.datetime) else datetime.datetime.fromisoformat(expiry_date)
                 days_left = (expiry_datetime - datetime.datetime.now()).days
                 days_text = f"{days_left} days left"
             except:
@@ -5189,9 +7504,13 @@ def owner_list_vips(message):
             vip_text += f"   ⏰ {days_text} | 💰 {payments} payments\n"
             vip_text += f"   🆔 ID: {user_id}\n\n"
         
-        bot.send_message(message.chat.id, vip_text, parse_mode='HTML')
+        markup = types.InlineKeyboardMarkup()
+        add_page_buttons(markup, 'vips', vip_users, has_prev, has_next,
+                         lambda row: encode_page_cursor(row.expiry_date, row.user_id))
+        
+        bot.send_message(chat_id, vip_text, reply_markup=markup, parse_mode='HTML')
     else:
-        bot.send_message(message.chat.id, "💎 No active VIP members yet.")
+        bot.send_message(chat_id, "💎 No active VIP members yet.")
 
 @bot.message_handler(commands=['owner_set_vip_price'])
 def owner_set_vip_price(message):
@@ -5303,11 +7622,12 @@ def owner_edit_price(message):
             return
         
         # Update content price using SQLAlchemy
-        with app.app_context():
+        with app_context_scope():
             content_item = ContentItem.query.filter_by(name=content_name).first()
             if content_item:
                 content_item.price_stars = new_price
                 db.session.commit()
+                bump_catalog_version()
                 updated_count = 1
             else:
                 updated_count = 0
@@ -5344,7 +7664,7 @@ def owner_edit_description(message):
             return
         
         # Update content description using SQLAlchemy
-        with app.app_context():
+        with app_context_scope():
             content_item = ContentItem.query.filter_by(name=content_name).first()
             if content_item:
                 content_item.description = new_description
@@ -5383,7 +7703,7 @@ def owner_edit_file_path(message):
             return
         
         # Update content file path using SQLAlchemy
-        with app.app_context():
+        with app_context_scope():
             content_item = ContentItem.query.filter_by(name=content_name).first()
             if content_item:
                 content_item.file_path = new_file_path
@@ -5404,7 +7724,7 @@ def owner_edit_file_path(message):
 
 def show_mark_loyal_fan_interface(chat_id):
     """Show interface to mark a user as loyal fan"""
-    with app.app_context():
+    with app_context_scope():
         # Get all users (paying customers prioritized) using SQLAlchemy
         non_loyal_users_query = db.session.query(
             User.user_id, User.username, User.first_name, User.total_stars_spent, User.interaction_count
@@ -5463,17 +7783,20 @@ Found {len(non_loyal_users)} user(s) not yet marked as loyal. Top customers show
     
     bot.send_message(chat_id, mark_text, reply_markup=markup, parse_mode='HTML')
 
-def show_loyal_fans_list(chat_id):
-    """Show all loyal fans with their details"""
-    with app.app_context():
-        # Get all loyal fans with user details using SQLAlchemy
-        loyal_fans_query = db.session.query(
+def show_loyal_fans_list(chat_id, cursor=None, direction='n'):
+    """Show a page of loyal fans with their details"""
+    with app_context_scope():
+        read_db = get_read_session()
+        # Get loyal fans with user details using SQLAlchemy
+        loyal_fans_query = read_db.query(
             User.user_id, User.username, User.first_name, User.total_stars_spent,
             LoyalFan.reason, LoyalFan.date_marked
-        ).join(User, LoyalFan.user_id == User.user_id).order_by(LoyalFan.date_marked.desc()).all()
-        
-        loyal_fans = [(user_id, username, first_name, total_stars_spent, reason, date_marked) 
-                     for user_id, username, first_name, total_stars_spent, reason, date_marked in loyal_fans_query]
+        ).join(User, LoyalFan.user_id == User.user_id)
+        loyal_fans, has_prev, has_next = fetch_keyset_page(
+            loyal_fans_query, func.coalesce(LoyalFan.date_marked, KEYSET_MISSING_DATE), LoyalFan.user_id,
+            decode_page_cursor(cursor, datetime.datetime) if cursor else None, direction
+        )
+        loyal_fan_count = read_db.query(LoyalFan).count()
     
     if not loyal_fans:
         empty_text = """
@@ -5493,7 +7816,7 @@ Start marking your best customers as loyal fans to track your VIP community.
     loyal_text = f"""
 📋 <b>LOYAL FANS LIST</b> 📋
 
-⭐ <b>Your {len(loyal_fans)} loyal fan(s):</b>
+⭐ <b>Your {loyal_fan_count} loyal fan(s):</b>
 
 """
     
@@ -5507,7 +7830,7 @@ Start marking your best customers as loyal fans to track your VIP community.
         
         # Format date
         try:
-            date_obj = datetime.datetime.fromisoformat(date_marked)
+            date_obj = date_marked if isinstance(date_marked, datetime.datetime) else datetime.datetime.fromisoformat(date_marked)
             formatted_date = date_obj.strftime("%b %d, %Y")
         except:
             formatted_date = "Unknown"
@@ -5520,6 +7843,8 @@ Start marking your best customers as loyal fans to track your VIP community.
         # Add remove button for each loyal fan
         markup.add(types.InlineKeyboardButton(f"❌ Remove {first_name}", callback_data=f"remove_loyal_{user_id}"))
     
+    add_page_buttons(markup, 'loyal', loyal_fans, has_prev, has_next,
+                     lambda row: encode_page_cursor(row.date_marked or KEYSET_MISSING_DATE, row.user_id))
     markup.add(types.InlineKeyboardButton("⭐ Mark New Loyal Fan", callback_data="mark_loyal_fan"))
     markup.add(types.InlineKeyboardButton("🔙 Back to Loyal Fan Management", callback_data="loyal_fan_management_menu"))
     
@@ -5527,7 +7852,7 @@ Start marking your best customers as loyal fans to track your VIP community.
 
 def show_remove_loyal_fan_interface(chat_id):
     """Show interface to remove loyal fan status"""
-    with app.app_context():
+    with app_context_scope():
         # Get all loyal fans with user details using SQLAlchemy
         loyal_fans_query = db.session.query(
             User.user_id, User.username, User.first_name, LoyalFan.reason, LoyalFan.date_marked
@@ -5584,32 +7909,28 @@ Found {len(loyal_fans)} loyal fan(s). This action cannot be undone!
 
 # Notification System Functions
 
-def show_notification_composer(chat_id, target_group):
+def show_notification_composer(chat_id, target_group, segment=None):
     """Show notification composer interface"""
     target_names = {
         'all': 'All Users',
         'vip': 'VIP Members',
-        'non_vip': 'Non-VIP Users'
+        'non_vip': 'Non-VIP Users',
+        'segment': 'Custom Segment'
     }
     
     target_name = target_names.get(target_group, 'Unknown')
     
-    # Get target user count
-    if target_group == 'all':
-        users = get_all_users()
-    elif target_group == 'vip':
-        users = get_vip_subscribers()
-    elif target_group == 'non_vip':
-        users = get_non_vip_users()
-    else:
-        users = []
-    
-    user_count = len(users)
+    # Size the audience with a COUNT query - recipients are only loaded when sending
+    user_count = count_audience(target_group, segment)
+    segment_line = ""
+    if target_group == 'segment':
+        safe_segment = (segment or 'everyone').replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        segment_line = f"\n🧩 <b>Segment:</b> <code>{safe_segment}</code>"
     
     composer_text = f"""
 📢 <b>NOTIFICATION COMPOSER</b> 📢
 
-🎯 <b>Target Group:</b> {target_name}
+🎯 <b>Target Group:</b> {target_name}{segment_line}
 👥 <b>Recipients:</b> {user_count} users
 
 📝 <b>Instructions:</b>
@@ -5630,12 +7951,12 @@ Send your message in your next message. It will be delivered to all {target_name
     bot.send_message(chat_id, composer_text, reply_markup=markup, parse_mode='HTML')
     
     # Store the notification session with timestamp
-    notification_sessions[chat_id] = {
+    start_notification_session(chat_id, {
         'target_group': target_group,
-        'users': users,
-        'waiting_for_message': True,
-        'timestamp': time.time()
-    }
+        'segment': segment,
+        'user_count': user_count,
+        'waiting_for_message': True
+    })
 
 # Callback query handlers
 
@@ -5951,7 +8272,7 @@ Your teaser is now live! Non-VIP users will see this when they use /teaser.
                 suggested_name = session['suggested_name']
                 
                 # Check if name already exists using SQLAlchemy
-                with app.app_context():
+                with app_context_scope():
                     existing = ContentItem.query.filter_by(name=suggested_name).first()
                 
                 if existing:
@@ -6048,11 +8369,11 @@ Add a description that VIP members will see:
     elif call.data == "vip_set_duration_btn":
         if call.from_user.id == OWNER_ID:
             # Start VIP duration setting session
-            upload_sessions[OWNER_ID] = {
+            start_upload_session(OWNER_ID, {
                 'type': 'vip_settings',
                 'setting': 'duration',
                 'step': 'waiting_for_input'
-            }
+            })
             
             duration_text = """
 ⏰ <b>SET VIP SUBSCRIPTION DURATION</b> ⏰
@@ -6083,11 +8404,11 @@ Add a description that VIP members will see:
     elif call.data == "vip_set_description_btn":
         if call.from_user.id == OWNER_ID:
             # Start VIP description setting session
-            upload_sessions[OWNER_ID] = {
+            start_upload_session(OWNER_ID, {
                 'type': 'vip_settings',
                 'setting': 'description',
                 'step': 'waiting_for_input'
-            }
+            })
             
             desc_text = """
 📝 <b>SET VIP SUBSCRIPTION DESCRIPTION</b> 📝
@@ -6144,15 +8465,15 @@ Add a description that VIP members will see:
             bot.send_message(call.message.chat.id, "❌ Access denied. This is an owner-only command.")
     elif call.data == "skip_vip_teaser_description":
         teaser_key = f"{OWNER_ID}_vip_teaser"
-        if call.from_user.id == OWNER_ID and teaser_key in upload_sessions and upload_sessions[teaser_key].get('type') == 'vip_teaser':
-            session = upload_sessions[teaser_key]
+        if call.from_user.id == OWNER_ID and has_upload_session(teaser_key, 'vip_teaser'):
+            session = get_upload_session(teaser_key)
             description = "Exclusive VIP teaser content"
             
             try:
                 add_teaser(session['file_path'], session['file_type'], description, vip_only=True)
                 
-                # Send notifications to all VIP subscribers about the new VIP teaser
-                notification_stats = notify_vip_teaser_uploaded(description)
+                # The broadcast reports to the owner when it finishes, so don't hold up this update for it
+                start_broadcast_job(notify_vip_teaser_uploaded, description)
                 
                 success_text = f"""
 🎉 <b>VIP TEASER UPLOADED SUCCESSFULLY!</b> 🎉
@@ -6163,10 +8484,7 @@ Add a description that VIP members will see:
 
 💎 Your VIP teaser is now live! VIP members will see this exclusive content when they use /teaser.
 
-📱 <b>VIP Notifications Sent:</b>
-✅ Delivered to {notification_stats['sent']} VIP members
-🚫 {notification_stats['blocked']} users have blocked the bot
-❌ {notification_stats['failed']} delivery failures
+📱 <b>VIP Notifications:</b> sending to VIP members in the background - you'll get a delivery report.
 
 🔄 You can upload multiple VIP teasers - the most recent one will be shown first to VIP members.
 """
@@ -6181,8 +8499,7 @@ Add a description that VIP members will see:
                 bot.send_message(call.message.chat.id, f"❌ Error saving VIP teaser: {str(e)}")
             
             # Clear upload session
-            if teaser_key in upload_sessions:
-                del upload_sessions[teaser_key]
+            clear_upload_session(teaser_key)
     elif call.data.startswith("delete_vip_teaser_"):
         if call.from_user.id == OWNER_ID:
             teaser_id = int(call.data.replace("delete_vip_teaser_", ""))
@@ -6233,13 +8550,13 @@ Add a description that VIP members will see:
         if call.from_user.id == OWNER_ID:
             content_name = call.data.replace("vip_upload_file_", "")
             # Start file upload session for this specific VIP content
-            upload_sessions[OWNER_ID] = {
+            start_upload_session(OWNER_ID, {
                 'type': 'vip_file_update',
                 'step': 'waiting_for_file',
                 'content_name': content_name,
                 'name': content_name,
                 'file_path': None
-            }
+            })
             
             upload_text = f"""
 📁 <b>UPLOAD NEW FILE FOR VIP CONTENT</b> 📁
@@ -6299,11 +8616,12 @@ Add a description that VIP members will see:
         if call.from_user.id == OWNER_ID:
             content_name = call.data.replace("confirm_delete_content_", "")
             # Delete the content using SQLAlchemy
-            with app.app_context():
+            with app_context_scope():
                 content_item = ContentItem.query.filter_by(name=content_name).first()
                 if content_item:
                     db.session.delete(content_item)
                     db.session.commit()
+                    bump_catalog_version()
                     deleted_count = 1
                 else:
                     deleted_count = 0
@@ -6320,11 +8638,12 @@ Add a description that VIP members will see:
         if call.from_user.id == OWNER_ID:
             content_name = call.data.replace("confirm_delete_", "")
             # Delete the content using SQLAlchemy
-            with app.app_context():
+            with app_context_scope():
                 content_item = ContentItem.query.filter_by(name=content_name).first()
                 if content_item:
                     db.session.delete(content_item)
                     db.session.commit()
+                    bump_catalog_version()
                     deleted_count = 1
                 else:
                     deleted_count = 0
@@ -6469,6 +8788,18 @@ Add a description that VIP members will see:
             show_loyal_fans_list(call.message.chat.id)
         else:
             bot.send_message(call.message.chat.id, "❌ Access denied. This is an owner-only command.")
+    elif call.data.startswith("page_"):
+        if call.from_user.id == OWNER_ID:
+            # Keyset pagination: page_<list>_<n|p>_<cursor>
+            _, list_name, direction, cursor = call.data.split('_', 3)
+            if list_name == 'users':
+                show_paying_customers_page(call.message.chat.id, cursor, direction)
+            elif list_name == 'vips':
+                show_vip_members_page(call.message.chat.id, cursor, direction)
+            elif list_name == 'loyal':
+                show_loyal_fans_list(call.message.chat.id, cursor, direction)
+        else:
+            bot.send_message(call.message.chat.id, "❌ Access denied. This is an owner-only command.")
     elif call.data == "remove_loyal_fan":
         if call.from_user.id == OWNER_ID:
             show_remove_loyal_fan_interface(call.message.chat.id)
@@ -6478,14 +8809,14 @@ Add a description that VIP members will see:
         if call.from_user.id == OWNER_ID:
             user_id = int(call.data.replace("select_loyal_", ""))
             # Start reason input session
-            upload_sessions[OWNER_ID] = {
+            start_upload_session(OWNER_ID, {
                 'type': 'loyal_fan_reason',
                 'user_id': user_id,
                 'step': 'waiting_for_reason'
-            }
+            })
             
             # Get user info using SQLAlchemy
-            with app.app_context():
+            with app_context_scope():
                 user = User.query.filter_by(user_id=user_id).first()
             
             if user:
@@ -6521,11 +8852,12 @@ Add a description that VIP members will see:
             user_id = int(call.data.replace("confirm_remove_loyal_", ""))
             
             # Remove loyal fan status using SQLAlchemy
-            with app.app_context():
+            with app_context_scope():
                 loyal_fan = LoyalFan.query.filter_by(user_id=user_id).first()
                 if loyal_fan:
                     db.session.delete(loyal_fan)
                     db.session.commit()
+                    bump_audience_version()
                     removed_count = 1
                 else:
                     removed_count = 0
@@ -6561,6 +8893,16 @@ Add a description that VIP members will see:
             show_notification_composer(call.message.chat.id, 'non_vip')
         else:
             bot.send_message(call.message.chat.id, "❌ Access denied. This is an owner-only command.")
+    elif call.data == "notify_segment_users":
+        if call.from_user.id == OWNER_ID:
+            draft = notification_sessions.get(f"{call.message.chat.id}_segment")
+            segment = draft.get('segment') if draft else None
+            if segment is None:
+                bot.send_message(call.message.chat.id, "❌ No segment defined. Use /owner_segment to build one.")
+            else:
+                show_notification_composer(call.message.chat.id, 'segment', segment)
+        else:
+            bot.send_message(call.message.chat.id, "❌ Access denied. This is an owner-only command.")
     elif call.data.startswith("confirm_send_"):
         if call.from_user.id == OWNER_ID:
             target_group = call.data.replace("confirm_send_", "")
@@ -6570,9 +8912,12 @@ Add a description that VIP members will see:
             
             # Get stored notification session with validation
             if is_session_valid(call.message.chat.id):
-                session = notification_sessions[call.message.chat.id]
+                session = get_notification_session(call.message.chat.id)
                 message_text = session.get('message_text')
-                users = session.get('users', [])
+                audience = session.get('target_group', target_group)
+                segment = session.get('segment')
+                # The audience is sized now rather than when the composer opened
+                audience_size = count_audience(audience, segment)
                 
                 # Validate session data integrity
                 if not message_text:
@@ -6583,27 +8928,15 @@ Add a description that VIP members will see:
                         return
                     else:
                         bot.send_message(call.message.chat.id, "❌ Message text not found and could not recover session. Please restart from notification menu.")
-                        if call.message.chat.id in notification_sessions:
-                            del notification_sessions[call.message.chat.id]
+                        clear_notification_session(call.message.chat.id)
                         return
                 
-                if not users or len(users) == 0:
-                    # Attempt to recover session with fresh user list
-                    target_group = session.get('target_group', '')
-                    if target_group and recover_session_state(call.message.chat.id, target_group):
-                        # Preserve message text if it exists
-                        if message_text:
-                            notification_sessions[call.message.chat.id]['message_text'] = message_text
-                            notification_sessions[call.message.chat.id]['waiting_for_message'] = False
-                        bot.send_message(call.message.chat.id, "🔄 Session recovered with updated user list. You can now send your notification.")
-                        return
-                    else:
-                        bot.send_message(call.message.chat.id, "❌ No target users found and could not recover session. Please restart the notification process.")
-                        if call.message.chat.id in notification_sessions:
-                            del notification_sessions[call.message.chat.id]
-                        return
+                if not audience_size:
+                    bot.send_message(call.message.chat.id, "❌ No target users found. Please restart the notification process.")
+                    clear_notification_session(call.message.chat.id)
+                    return
                 
-                if message_text and users:
+                if message_text and audience_size:
                     # Update session timestamp before sending
                     update_session_timestamp(call.message.chat.id)
                     
@@ -6611,32 +8944,26 @@ Add a description that VIP members will see:
                     target_names = {
                         'all': 'All Users',
                         'vip': 'VIP Members',
-                        'non_vip': 'Non-VIP Users'
+                        'non_vip': 'Non-VIP Users',
+                        'segment': 'Custom Segment'
                     }
                     
                     target_name = target_names.get(target_group, 'Unknown')
                     
-                    # Create basic markup for notifications
-                    notification_markup = types.InlineKeyboardMarkup()
-                    notification_markup.add(types.InlineKeyboardButton("🏠 Back to Main", callback_data="cmd_start"))
-                    
-                    # Send notification to users
-                    pin_message = target_group == 'vip'  # Pin VIP notifications
-                    stats = send_notification_to_users(users, message_text, notification_markup, pin_message)
+                    # The scheduler's sender delivers it (pinned for VIPs), so a long broadcast
+                    # never holds up this update thread or the other chats on its shard
+                    post_id = queue_scheduled_post(datetime.datetime.now(), message_text, audience, segment)
                     
                     # Send confirmation to owner
                     success_text = f"""
-✅ <b>NOTIFICATION SENT SUCCESSFULLY!</b> ✅
+📤 <b>NOTIFICATION QUEUED!</b> 📤
 
 🎯 <b>Target Group:</b> {target_name}
-✅ <b>Delivered:</b> {stats['sent']} users
-❌ <b>Failed:</b> {stats['failed']} users  
-🚫 <b>Blocked:</b> {stats['blocked']} users
-👥 <b>Total Targeted:</b> {stats['total_targeted']} users
+👥 <b>Total Targeted:</b> {audience_size} users
 
-📊 <b>Delivery Rate:</b> {(stats['sent'] / max(stats['total_targeted'], 1) * 100):.1f}%
+📬 Sending now as post #{post_id} - you'll get a delivery report when it finishes.
 
-💡 <b>Message sent:</b> {message_text[:100]}{'...' if len(message_text) > 100 else ''}
+💡 <b>Message:</b> {message_text[:100]}{'...' if len(message_text) > 100 else ''}
 """
                     
                     markup = types.InlineKeyboardMarkup()
@@ -6646,7 +8973,7 @@ Add a description that VIP members will see:
                     bot.send_message(call.message.chat.id, success_text, reply_markup=markup, parse_mode='HTML')
                     
                     # Clear the session
-                    del notification_sessions[call.message.chat.id]
+                    clear_notification_session(call.message.chat.id)
                 else:
                     # This shouldn't happen due to validation above, but keep for safety
                     bot.send_message(call.message.chat.id, "❌ Incomplete notification data. Please try again.")
@@ -6672,46 +8999,201 @@ Add a description that VIP members will see:
 
 # Payment handlers
 
-@bot.pre_checkout_query_handler(func=lambda query: True)
-def pre_checkout_handler(pre_checkout_query):
-    """Handle pre-checkout queries for Telegram Stars payments"""
-    bot.answer_pre_checkout_query(pre_checkout_query.id, ok=True)
+def encode_invoice_payload(kind, user_id, content_name=None):
+    """Build an invoice payload: 'v:<user_id>' for VIP or 'c:<user_id>:<content name>' for content.
 
-@bot.message_handler(content_types=['successful_payment'])
-@safe_handler
-def successful_payment_handler(message):
-    """Handle successful payment and deliver content"""
-    # Check if user is blocked before processing payment
-    if is_user_blocked(message.from_user.id):
-        bot.send_message(message.chat.id, "🚫 You have been blocked from using this bot. Contact the owner if you believe this is an error.")
-        return
-    
+    The content name goes last so it may contain any character, including ':' and '_'.
+    """
+    if kind == 'vip':
+        return f"v:{user_id}"
+    return f"c:{user_id}:{content_name}"
+
+def decode_invoice_payload(payload):
+    """Decode an invoice payload into (kind, user_id, content_name), or None if it is not recognised.
+
+    Also accepts the old 'vip_subscription_<id>' and 'content_<name>_<id>' payloads
+    so invoices issued before the format change can still be paid.
+    """
+    try:
+        if payload.startswith('v:'):
+            return 'vip', int(payload[2:]), None
+        if payload.startswith('c:'):
+            _, user_id, content_name = payload.split(':', 2)
+            return 'content', int(user_id), content_name
+        if payload.startswith('vip_subscription_'):
+            return 'vip', int(payload[len('vip_subscription_'):]), None
+        if payload.startswith('content_'):
+            content_name, user_id = payload[len('content_'):].rsplit('_', 1)
+            return 'content', int(user_id), content_name
+    except ValueError:
+        pass
+    return None
+
+def process_successful_payment(message):
+    """Record a successful payment exactly once and queue its fulfillment.
+
+    The ledger entry, purchase or VIP extension, total_stars_spent update, analytics
+    counters and fulfillment jobs are committed in a single transaction. Telegram can
+    deliver the same update more than once, so a payment whose charge id is already
+    recorded is ignored.
+
+    Returns:
+        dict: kind, user_id, content_name and duration_days - or None for duplicates and unknown payloads
+    """
     payment = message.successful_payment
+    decoded = decode_invoice_payload(payment.invoice_payload)
+    if not decoded:
+        logger.error(f"Unrecognised invoice payload: {payment.invoice_payload}")
+        return None
     
-    # Parse payload to get content info
-    payload_parts = payment.invoice_payload.split('_')
+    kind, user_id, content_name = decoded
+    charge_id = payment.telegram_payment_charge_id
+    amount = payment.total_amount
+    result = {'kind': kind, 'user_id': user_id, 'content_name': content_name, 'duration_days': None}
     
-    # Handle VIP subscription payments
-    if len(payload_parts) >= 2 and payload_parts[0] == 'vip' and payload_parts[1] == 'subscription':
-        user_id = int(payload_parts[2])
-        
-        # Update user's total spent using SQLAlchemy
-        with app.app_context():
-            user = User.query.filter_by(user_id=user_id).first()
-            if user:
-                user.total_stars_spent += payment.total_amount
-                db.session.commit()
-        
-        # Activate VIP subscription
-        duration_days = activate_vip_subscription(user_id)
+    with app_context_scope():
+        if Payment.query.filter_by(telegram_payment_charge_id=charge_id).first():
+            logger.warning(f"Ignoring duplicate payment {charge_id} for user {user_id}")
+            return None
         
-        # Send confirmation message
-        vip_welcome_message = f"""
+        try:
+            record_payment(user_id, kind, amount, content_name=content_name, charge_id=charge_id)
+            
+            # Decide "first payment" from the write itself: the guarded update only matches a user
+            # who has spent nothing, and a concurrent payment waits on the row lock and re-checks it.
+            # Touch last_interaction too so incremental snapshots pick up the new total.
+            now = datetime.datetime.now()
+            first_payment = User.query.filter(
+                User.user_id == user_id, func.coalesce(User.total_stars_spent, 0) == 0
+            ).update({User.total_stars_spent: amount, User.last_interaction: now},
+                     synchronize_session=False) == 1
+            updated = first_payment or User.query.filter_by(user_id=user_id).update(
+                {User.total_stars_spent: func.coalesce(User.total_stars_spent, 0) + amount,
+                 User.last_interaction: now},
+                synchronize_session=False
+            ) == 1
+            if updated:
+                record_payment_counters(first_payment, amount, kind)
+            
+            if kind == 'vip':
+                result['duration_days'] = extend_vip_subscription(user_id)
+                enqueue_fulfillment('vip_welcome', message.chat.id, user_id,
+                                    amount=amount, duration_days=result['duration_days'])
+                enqueue_fulfillment('notify_owner_vip', OWNER_ID, user_id, amount=amount,
+                                    duration_days=result['duration_days'], first_name=message.from_user.first_name)
+            else:
+                enqueue_fulfillment('deliver_content', message.chat.id, user_id, content_name=content_name)
+                enqueue_fulfillment('notify_owner_sale', OWNER_ID, user_id, content_name=content_name, amount=amount)
+            
+            if kind == 'content' and not UserPurchase.query.filter_by(user_id=user_id, content_name=content_name).first():
+                # Record the purchase for permanent access
+                purchase = UserPurchase()
+                purchase.user_id = user_id
+                purchase.content_name = content_name
+                purchase.purchase_date = datetime.datetime.now()
+                purchase.price_paid = amount
+                db.session.add(purchase)
+                bump_analytics_counter('purchases')
+            
+            db.session.commit()
+        except IntegrityError:
+            # Another update recorded the same charge id first
+            db.session.rollback()
+            logger.warning(f"Ignoring duplicate payment {charge_id} for user {user_id}")
+            return None
+        except Exception:
+            db.session.rollback()
+            raise
+    
+    bump_audience_version()
+    fulfillment_wakeup.set()
+    return result
+
+# Post-payment fulfillment - deliveries run on a worker thread so slow uploads never hold up updates
+
+FULFILLMENT_MAX_ATTEMPTS = 5
+FULFILLMENT_POLL_SECONDS = 30
+FULFILLMENT_BATCH_SIZE = 10
+fulfillment_wakeup = threading.Event()
+ClaimedFulfillmentJob = namedtuple('ClaimedFulfillmentJob', 'id job_type chat_id user_id payload attempts')
+
+def enqueue_fulfillment(job_type, chat_id, user_id, **payload):
+    """Add a fulfillment job to the caller's session (does not commit)"""
+    job = FulfillmentJob()
+    job.job_type = job_type
+    job.chat_id = chat_id
+    job.user_id = user_id
+    job.payload = json.dumps(payload)
+    job.status = 'pending'
+    job.attempts = 0
+    job.run_after = datetime.datetime.now()
+    db.session.add(job)
+    return job
+
+def send_content_media(chat_id, file_path, content_name):
+    """Send a content file by URL, Telegram file_id or local path - raises if every attempt fails"""
+    caption = f"🎁 {content_name}"
+    if file_path.startswith('http'):
+        if any(ext in file_path.lower() for ext in ['.jpg', '.jpeg', '.png', '.gif']):
+            bot.send_photo(chat_id, file_path, caption=caption)
+        elif any(ext in file_path.lower() for ext in ['.mp4', '.mov', '.avi']):
+            bot.send_video(chat_id, file_path, caption=caption)
+        else:
+            bot.send_document(chat_id, file_path, caption=caption)
+    elif len(file_path) > 50 and not file_path.startswith('/'):
+        # It's a Telegram file_id - the media type is unknown, so try each send method
+        last_error = None
+        for send in (bot.send_photo, bot.send_video, bot.send_document):
+            try:
+                send(chat_id, file_path, caption=caption)
+                return
+            except Exception as e:
+                last_error = e
+        raise last_error
+    else:
+        send_local_media(chat_id, file_path, caption)
+
+def fulfill_deliver_content(job, payload):
+    """Send purchased content to the buyer"""
+    content_name = payload['content_name']
+    with app_context_scope():
+        content_item = ContentItem.query.filter_by(name=content_name).first()
+        content = (content_item.file_path, content_item.description) if content_item else None
+    
+    if not content:
+        bot.send_message(job.chat_id, f"🎁 Your content: {content_name}\n\n⚠️ There was an issue delivering your content. Please contact me and I'll send it manually!")
+        return
+    
+    file_path, description = content
+    
+    # Only thank the buyer once, even if the media upload is retried or the owner requeues the job
+    if not payload.get('thanked'):
+        thank_you_message = f"""
+🎉 **PAYMENT SUCCESSFUL!** 🎉
+
+Thank you for your purchase! Here's your exclusive content:
+
+**{content_name}**
+{description}
+
+💕 You’re absolutely amazing for supporting me, babe! Now sit back, relax, and enjoy the content made just for YOU.
+"""
+        bot.send_message(job.chat_id, thank_you_message, parse_mode='Markdown')
+        payload['thanked'] = True
+        with app_context_scope():
+            FulfillmentJob.query.filter_by(id=job.id).update({FulfillmentJob.payload: json.dumps(payload)}, synchronize_session=False)
+            db.session.commit()
+    
+    send_content_media(job.chat_id, file_path, content_name)
+
+def fulfill_vip_welcome(job, payload):
+    """Send the VIP welcome message"""
+    vip_welcome_message = f"""
 💎 **VIP SUBSCRIPTION ACTIVATED!** 💎
 
 🎉 Congrats, you’re officially a VIP now!
-⏰ **Duration:** {duration_days} days
-💰 **Amount:** {payment.total_amount} Stars
+⏰ **Duration:** {payload['duration_days']} days
+💰 **Amount:** {payload['amount']} Stars
 
 🌟 **Your VIP Benefits Are Now Active:**
 • Unlimited access to all exclusive content
@@ -6725,149 +9207,945 @@ def successful_payment_handler(message):
 
 Use the buttons below to explore your new VIP privileges:
 """
-        
-        markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton("🛒 Browse All Content", callback_data="browse_content"))
-        markup.add(types.InlineKeyboardButton("🎬 VIP Exclusive Teasers", callback_data="teasers"))
-        markup.add(types.InlineKeyboardButton("🏠 Back to Main", callback_data="cmd_start"))
-        
-        bot.send_message(message.chat.id, vip_welcome_message, reply_markup=markup, parse_mode='Markdown')
-        
-        # Notify owner of new VIP subscription
-        try:
-            # Format date as requested
-            today = datetime.datetime.now()
-            formatted_date = today.strftime("%b %d").upper()
-            
-            # Create enhanced notification with clickable name
-            owner_notification = f"""
+    
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("🛒 Browse All Content", callback_data="browse_content"))
+    markup.add(types.InlineKeyboardButton("🎬 VIP Exclusive Teasers", callback_data="teasers"))
+    markup.add(types.InlineKeyboardButton("🏠 Back to Main", callback_data="cmd_start"))
+    
+    bot.send_message(job.chat_id, vip_welcome_message, reply_markup=markup, parse_mode='Markdown')
+
+def fulfill_notify_owner_vip(job, payload):
+    """Notify the owner of a new VIP subscription"""
+    user_id = job.user_id
+    first_name = payload.get('first_name') or 'N/A'
+    formatted_date = datetime.datetime.now().strftime("%b %d").upper()
+    
+    owner_notification = f"""
 💎 **NEW VIP SUBSCRIPTION!** 💎
 
-👤 [{message.from_user.first_name}](tg://user?id={user_id})
+👤 [{first_name}](tg://user?id={user_id})
 🆔 User ID: {user_id}
 📅 Date: {formatted_date}
-💰 Amount: {payment.total_amount} Stars
-⏰ Duration: {duration_days} days
+💰 Amount: {payload['amount']} Stars
+⏰ Duration: {payload['duration_days']} days
 
 💬 Click the name to message them directly!
 """
-            bot.send_message(OWNER_ID, owner_notification, parse_mode='Markdown')
+    try:
+        bot.send_message(job.chat_id, owner_notification, parse_mode='Markdown')
+    except Exception as e:
+        # Names can break Markdown parsing, so fall back to plain text
+        logger.error(f"Error sending owner notification: {e}")
+        bot.send_message(job.chat_id, f"💎 NEW VIP SUBSCRIPTION!\n👤 {first_name}\n💰 {payload['amount']} Stars\n🆔 ID: {user_id}")
+
+def fulfill_notify_owner_sale(job, payload):
+    """Notify the owner of a content sale"""
+    user_id = job.user_id
+    with app_context_scope():
+        user = User.query.filter_by(user_id=user_id).first()
+        first_name = (user.first_name if user else None) or "N/A"
+        total_spent = (user.total_stars_spent if user else None) or 0
+    
+    bot.send_message(job.chat_id, f"""
+💰 **NEW SALE!** 💰
+
+👤 [{first_name}](tg://user?id={user_id})
+🛒 Item: {payload['content_name']}
+⭐ Amount: {payload['amount']} Stars
+💎 Total Spent: {total_spent} Stars
+🆔 User ID: {user_id}
+
+💬 Click the name to message them directly!
+""", parse_mode='Markdown')
+
+FULFILLMENT_HANDLERS = {
+    'deliver_content': fulfill_deliver_content,
+    'vip_welcome': fulfill_vip_welcome,
+    'notify_owner_vip': fulfill_notify_owner_vip,
+    'notify_owner_sale': fulfill_notify_owner_sale,
+}
+
+def claim_fulfillment_jobs(limit=FULFILLMENT_BATCH_SIZE):
+    """Mark up to limit due jobs as running and return them"""
+    with app_context_scope():
+        jobs = FulfillmentJob.query.filter(
+            FulfillmentJob.status == 'pending',
+            FulfillmentJob.run_after <= datetime.datetime.now()
+        ).order_by(FulfillmentJob.id).limit(limit).with_for_update(skip_locked=True).all()
+        
+        claimed = []
+        for job in jobs:
+            job.status = 'running'
+            job.attempts += 1
+            claimed.append(ClaimedFulfillmentJob(job.id, job.job_type, job.chat_id, job.user_id, job.payload, job.attempts))
+        db.session.commit()
+        return claimed
+
+def finish_fulfillment_job(job, error=None):
+    """Remove a completed job, or schedule a retry with exponential backoff"""
+    with app_context_scope():
+        stored = FulfillmentJob.query.filter_by(id=job.id).first()
+        if not stored:
+            return
+        
+        if error is None:
+            db.session.delete(stored)
+        elif job.attempts >= FULFILLMENT_MAX_ATTEMPTS:
+            stored.status = 'failed'
+            stored.last_error = str(error)[:1000]
+        else:
+            stored.status = 'pending'
+            stored.last_error = str(error)[:1000]
+            stored.run_after = datetime.datetime.now() + datetime.timedelta(seconds=30 * 2 ** (job.attempts - 1))
+        db.session.commit()
+
+def process_fulfillment_queue(limit=FULFILLMENT_BATCH_SIZE):
+    """Run one batch of due fulfillment jobs, returning how many were claimed"""
+    jobs = claim_fulfillment_jobs(limit)
+    
+    for job in jobs:
+        handler = FULFILLMENT_HANDLERS.get(job.job_type)
+        try:
+            if not handler:
+                raise ValueError(f"Unknown fulfillment job type: {job.job_type}")
+            # Each job is its own unit of work with one app context and session
+            with app.app_context(), outbound_priority('fulfillment'):
+                handler(job, json.loads(job.payload or '{}'))
         except Exception as e:
-            logger.error(f"Error sending owner notification: {e}")
-            # Fallback notification
-            try:
-                bot.send_message(OWNER_ID, f"💎 NEW VIP SUBSCRIPTION!\n👤 {message.from_user.first_name}\n💰 {payment.total_amount} Stars\n🆔 ID: {user_id}")
-            except:
-                pass
+            logger.error(f"Fulfillment job {job.id} ({job.job_type}) attempt {job.attempts} failed: {e}")
+            finish_fulfillment_job(job, e)
             
-    elif len(payload_parts) >= 3 and payload_parts[0] == 'content':
-        content_name = payload_parts[1]
-        user_id = int(payload_parts[2])
+            if job.attempts >= FULFILLMENT_MAX_ATTEMPTS and job.job_type == 'deliver_content':
+                try:
+                    bot.send_message(job.chat_id, "⚠️ There was an issue delivering your content. Please contact me and I'll send it manually!")
+                except Exception:
+                    pass
+        else:
+            finish_fulfillment_job(job)
+    
+    return len(jobs)
+
+def run_fulfillment_worker():
+    """Process fulfillment jobs until the process exits"""
+    # Jobs left running by a previous process never finished, so run them again
+    with app_context_scope():
+        FulfillmentJob.query.filter_by(status='running').update({FulfillmentJob.status: 'pending'}, synchronize_session=False)
+        db.session.commit()
+    
+    logger.info("Fulfillment worker started")
+    while True:
+        try:
+            if process_fulfillment_queue():
+                continue
+        except Exception as e:
+            logger.error(f"Fulfillment worker error: {e}")
         
-        # Update user's total spent and record purchase
-        with app.app_context():
-            # Update user's total spent
-            user = User.query.filter_by(user_id=user_id).first()
-            if user:
-                user.total_stars_spent = (user.total_stars_spent or 0) + payment.total_amount
+        fulfillment_wakeup.wait(FULFILLMENT_POLL_SECONDS)
+        fulfillment_wakeup.clear()
+
+# Post scheduler - ScheduledPost rows due soon wait in an in-memory timing wheel and fire as broadcasts
+
+SCHEDULER_LOAD_SECONDS = 60  # how often posts scheduled by other processes are picked up
+SCHEDULER_HORIZON_SECONDS = 3600  # posts due within this window are held in the wheel
+SCHEDULED_POST_GRACE_SECONDS = int(os.getenv('SCHEDULED_POST_GRACE_SECONDS', '3600'))  # later than this is reported missed
+scheduler_wakeup = threading.Event()
+
+def scheduler_tick():
+    """Current time in wheel ticks (milliseconds)"""
+    return int(time.monotonic() * 1000)
+
+class TimingWheel:
+    """Hierarchical timing wheel with millisecond ticks.
+
+    Level 0 has 256 one-tick slots and each higher level has 64 slots covering
+    a full turn of the level below (256ms, ~16s, ~17min, ~18.6h in total).
+    Adding, cancelling and processing a tick are O(1): timers drop a level when
+    their slot comes round. Ticks are only walked one by one while something is
+    due within 256ms; otherwise the wheel jumps to the next boundary of the
+    lowest occupied level.
+    """
+    
+    LEVEL_BITS = (8, 6, 6, 6)
+    
+    def __init__(self, now_tick):
+        self.now = now_tick
+        self._shifts = []
+        shift = 0
+        for bits in self.LEVEL_BITS:
+            self._shifts.append(shift)
+            shift += bits
+        self.span = 1 << shift
+        self._slots = [[{} for _ in range(1 << bits)] for bits in self.LEVEL_BITS]
+        self._counts = [0] * len(self.LEVEL_BITS)
+        self._where = {}  # key -> (level, slot index)
+    
+    def __len__(self):
+        return len(self._where)
+    
+    def __contains__(self, key):
+        return key in self._where
+    
+    def add(self, key, deadline):
+        """Arm a timer for key at tick deadline; returns False (and arms nothing) if it is already due"""
+        self.cancel(key)
+        delta = deadline - self.now
+        if delta <= 0:
+            return False
+        if delta >= self.span:
+            raise ValueError("Deadline is beyond the timing wheel's span")
+        
+        level = 0
+        while delta >= 1 << (self._shifts[level] + self.LEVEL_BITS[level]):
+            level += 1
+        index = (deadline >> self._shifts[level]) & ((1 << self.LEVEL_BITS[level]) - 1)
+        self._slots[level][index][key] = deadline
+        self._counts[level] += 1
+        self._where[key] = (level, index)
+        return True
+    
+    def cancel(self, key):
+        location = self._where.pop(key, None)
+        if location:
+            level, index = location
+            del self._slots[level][index][key]
+            self._counts[level] -= 1
+    
+    def next_tick(self):
+        """The next tick that can fire or cascade anything, or None when the wheel is empty"""
+        if self._counts[0]:
+            return self.now + 1
+        for level in range(1, len(self.LEVEL_BITS)):
+            if self._counts[level]:
+                step = 1 << self._shifts[level]
+                return (self.now // step + 1) * step
+        return None
+    
+    def advance(self, to_tick):
+        """Move the wheel to to_tick and return the (key, deadline) pairs that fell due"""
+        due = []
+        while self.now < to_tick:
+            tick = self.next_tick()
+            if tick is None or tick > to_tick:
+                self.now = to_tick
+                break
+            self.now = tick
             
-            # Record the purchase for permanent access (check for duplicates)
-            existing_purchase = UserPurchase.query.filter_by(user_id=user_id, content_name=content_name).first()
-            if not existing_purchase:
-                purchase = UserPurchase()
-                purchase.user_id = user_id
-                purchase.content_name = content_name
-                purchase.purchase_date = datetime.datetime.now()
-                purchase.price_paid = payment.total_amount
-                db.session.add(purchase)
+            # Cascade from the top so a timer can drop several levels at once
+            for level in range(len(self.LEVEL_BITS) - 1, 0, -1):
+                if tick & ((1 << self._shifts[level]) - 1) == 0:
+                    self._cascade(level, (tick >> self._shifts[level]) & ((1 << self.LEVEL_BITS[level]) - 1), due)
             
-            # Get content details
-            content_item = ContentItem.query.filter_by(name=content_name).first()
-            db.session.commit()
+            slot = self._slots[0][tick & ((1 << self.LEVEL_BITS[0]) - 1)]
+            if slot:
+                for key, deadline in slot.items():
+                    del self._where[key]
+                    due.append((key, deadline))
+                self._counts[0] -= len(slot)
+                slot.clear()
+        return due
+    
+    def _cascade(self, level, index, due):
+        slot = self._slots[level][index]
+        if not slot:
+            return
+        timers = list(slot.items())
+        slot.clear()
+        self._counts[level] -= len(timers)
+        for key, deadline in timers:
+            del self._where[key]
+            if not self.add(key, deadline):
+                due.append((key, deadline))
+
+class PostScheduler:
+    """Fires scheduled posts from a TimingWheel.
+
+    The wheel thread only moves timers and hands due post ids to the sender
+    thread, which claims each post in the database and broadcasts it through
+    the rate-limited notification path. A loader thread tops the wheel up with
+    posts that come within SCHEDULER_HORIZON_SECONDS.
+    """
+    
+    def __init__(self):
+        self.wheel = TimingWheel(scheduler_tick())
+        self._cond = threading.Condition()
+        self._send_queue = queue.Queue()
+        self.stats = {'armed': 0, 'fired': 0, 'max_late_ms': 0}
+    
+    def arm(self, post_id, when):
+        """Put a post in the wheel, or straight on the send queue if it is already due"""
+        delay_ms = int((when - datetime.datetime.now()).total_seconds() * 1000)
+        with self._cond:
+            if post_id in self.wheel:
+                return
+            # The wheel only moves while it has timers, so catch it up before measuring the deadline from it
+            now = scheduler_tick()
+            due = self._advance(now)
+            if delay_ms >= self.wheel.span:
+                logger.warning(f"Scheduled post {post_id} is too far out for the timing wheel; it will be armed later")
+            elif self.wheel.add(post_id, now + max(delay_ms, 0)):
+                self.stats['armed'] += 1
+                self._cond.notify()
+            else:
+                due.append(post_id)
+        for due_post_id in due:
+            self._send_queue.put(due_post_id)
+    
+    def disarm(self, post_id):
+        with self._cond:
+            self.wheel.cancel(post_id)
+    
+    def _advance(self, now):
+        """Move the wheel to now and return the post ids that fell due (call with the lock held)"""
+        due = []
+        for post_id, deadline in self.wheel.advance(now):
+            self.stats['fired'] += 1
+            self.stats['max_late_ms'] = max(self.stats['max_late_ms'], now - deadline)
+            due.append(post_id)
+        return due
+    
+    def run_wheel(self):
+        """Fire timers as they fall due"""
+        while True:
+            with self._cond:
+                now = scheduler_tick()
+                due = self._advance(now)
+                if not due:
+                    next_tick = self.wheel.next_tick()
+                    self._cond.wait((next_tick - now) / 1000 if next_tick else None)
+                    continue
             
-            content = (content_item.file_path, content_item.description) if content_item else None
+            for post_id in due:
+                self._send_queue.put(post_id)
+    
+    def run_sender(self):
+        """Claim and broadcast fired posts one at a time"""
+        while True:
+            post_id = self._send_queue.get()
+            try:
+                send_scheduled_post(post_id)
+            except Exception as e:
+                logger.error(f"Scheduled post {post_id} failed: {e}")
+    
+    def run_loader(self):
+        """Arm posts that come due within the horizon, including ones other processes scheduled"""
+        while True:
+            try:
+                due_posts = load_due_scheduled_posts()
+            except Exception as e:
+                logger.error(f"Error loading scheduled posts: {e}")
+                due_posts = []
+            # One bad post must not keep the rest of the batch out of the wheel
+            for post_id, when in due_posts:
+                try:
+                    self.arm(post_id, when)
+                except Exception as e:
+                    logger.error(f"Error arming scheduled post {post_id}: {e}")
+            scheduler_wakeup.wait(SCHEDULER_LOAD_SECONDS)
+            scheduler_wakeup.clear()
+    
+    def get_stats(self):
+        with self._cond:
+            return dict(self.stats, waiting=len(self.wheel), queued=self._send_queue.qsize())
+
+post_scheduler = None
+
+def scheduler_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"[:100]
+
+def load_due_scheduled_posts():
+    """Return (post_id, datetime) of pending posts due within the horizon; long-overdue ones are marked missed"""
+    now = datetime.datetime.now()
+    with app_context_scope():
+        missed = ScheduledPostState.query.filter(
+            ScheduledPostState.status == 'pending',
+            ScheduledPostState.post_id.in_(select(ScheduledPost.id).where(
+                ScheduledPost.datetime < now - datetime.timedelta(seconds=SCHEDULED_POST_GRACE_SECONDS)))
+        ).update({ScheduledPostState.status: 'missed', ScheduledPostState.finished_at: now}, synchronize_session=False)
+        if missed:
+            logger.warning(f"{missed} scheduled post(s) were overdue by more than {SCHEDULED_POST_GRACE_SECONDS}s and marked missed")
+        db.session.commit()
         
-        if content:
-            file_path, description = content
-            
-            # Send content to user
-            thank_you_message = f"""
-🎉 **PAYMENT SUCCESSFUL!** 🎉
+        return db.session.query(ScheduledPost.id, ScheduledPost.datetime).join(
+            ScheduledPostState, ScheduledPostState.post_id == ScheduledPost.id
+        ).filter(
+            ScheduledPostState.status == 'pending',
+            ScheduledPost.datetime <= now + datetime.timedelta(seconds=SCHEDULER_HORIZON_SECONDS)
+        ).all()
 
-Thank you for your purchase! Here's your exclusive content:
+def queue_scheduled_post(when, content, target_group='all', segment=None):
+    """Save a pending post for the scheduler and wake it; returns the post id"""
+    with app_context_scope():
+        post = ScheduledPost()
+        post.datetime = when
+        post.content = content
+        db.session.add(post)
+        db.session.flush()
+        
+        state = ScheduledPostState()
+        state.post_id = post.id
+        state.target_group = target_group
+        state.segment = segment
+        state.status = 'pending'
+        db.session.add(state)
+        db.session.commit()
+        post_id = post.id
+    
+    # Let the scheduler arm it now instead of on its next load
+    scheduler_wakeup.set()
+    return post_id
+
+def claim_scheduled_post(post_id):
+    """Move a pending post to sending and return (content, target_group, segment), or None if another worker has it"""
+    with app_context_scope():
+        # Another worker holding the row lock is already claiming it - skip rather than wait
+        state = ScheduledPostState.query.filter_by(post_id=post_id, status='pending').with_for_update(skip_locked=True).first()
+        if not state:
+            db.session.rollback()
+            return None
+        
+        # The conditional update is what makes the claim exclusive on databases without row locks
+        claimed = ScheduledPostState.query.filter_by(post_id=post_id, status='pending').update({
+            ScheduledPostState.status: 'sending',
+            ScheduledPostState.claimed_by: scheduler_worker_id(),
+            ScheduledPostState.claimed_at: datetime.datetime.now()
+        }, synchronize_session=False)
+        post = db.session.get(ScheduledPost, post_id)
+        if claimed != 1 or not post:
+            db.session.rollback()
+            return None
+        
+        claim = (post.content, state.target_group, state.segment)
+        db.session.commit()
+        return claim
 
-**{content_name}**
-{description}
+def send_scheduled_post(post_id):
+    """Broadcast a fired post if this worker wins the claim"""
+    claim = claim_scheduled_post(post_id)
+    if not claim:
+        return
+    content, target_group, segment = claim
+    
+    try:
+        users = get_audience_users(target_group, segment)
+        markup = types.InlineKeyboardMarkup()
+        markup.add(types.InlineKeyboardButton("🏠 Back to Main", callback_data="cmd_start"))
+        stats = send_notification_to_users(users, content, markup, pin_message=target_group == 'vip')
+    except Exception as e:
+        with app_context_scope():
+            ScheduledPostState.query.filter_by(post_id=post_id).update({
+                ScheduledPostState.status: 'failed',
+                ScheduledPostState.finished_at: datetime.datetime.now(),
+                ScheduledPostState.last_error: str(e)[:1000]
+            }, synchronize_session=False)
+            db.session.commit()
+        raise
+    
+    with app_context_scope():
+        ScheduledPostState.query.filter_by(post_id=post_id).update({
+            ScheduledPostState.status: 'sent',
+            ScheduledPostState.finished_at: datetime.datetime.now(),
+            ScheduledPostState.sent_count: stats['sent'],
+            ScheduledPostState.failed_count: stats['failed'] + stats['blocked']
+        }, synchronize_session=False)
+        db.session.commit()
+    
+    logger.info(f"Scheduled post {post_id} sent to {stats['sent']}/{stats['total_targeted']} users")
+    try:
+        bot.send_message(OWNER_ID, f"""📬 <b>POST #{post_id} SENT</b>
 
-💕 You’re absolutely amazing for supporting me, babe! Now sit back, relax, and enjoy the content made just for YOU.
-"""
-            
-            bot.send_message(message.chat.id, thank_you_message, parse_mode='Markdown')
-            
-            # Send the actual content (photo/video/document)
+✅ <b>Delivered:</b> {stats['sent']} users
+❌ <b>Failed:</b> {stats['failed']} users
+🚫 <b>Blocked:</b> {stats['blocked']} users""", parse_mode='HTML')
+    except Exception as e:
+        logger.error(f"Failed to notify owner about scheduled post {post_id}: {e}")
+
+def recover_scheduled_posts():
+    """Mark posts this host was sending when its process died as interrupted (they are never re-sent)"""
+    host = socket.gethostname()
+    with app_context_scope():
+        sending = ScheduledPostState.query.filter(
+            ScheduledPostState.status == 'sending',
+            ScheduledPostState.claimed_by.like(f"{host}:%")
+        ).all()
+        for state in sending:
             try:
-                if file_path.startswith('http'):
-                    # It's a URL
-                    if any(ext in file_path.lower() for ext in ['.jpg', '.jpeg', '.png', '.gif']):
-                        bot.send_photo(message.chat.id, file_path, caption=f"🎁 {content_name}")
-                    elif any(ext in file_path.lower() for ext in ['.mp4', '.mov', '.avi']):
-                        bot.send_video(message.chat.id, file_path, caption=f"🎁 {content_name}")
-                    else:
-                        bot.send_document(message.chat.id, file_path, caption=f"🎁 {content_name}")
-                elif len(file_path) > 50 and not file_path.startswith('/'):
-                    # It's a Telegram file_id (file_ids are long strings)
-                    try:
-                        # Try to send as photo first (most common)
-                        bot.send_photo(message.chat.id, file_path, caption=f"🎁 {content_name}")
-                    except:
-                        try:
-                            # Try as video
-                            bot.send_video(message.chat.id, file_path, caption=f"🎁 {content_name}")
-                        except:
-                            try:
-                                # Try as document
-                                bot.send_document(message.chat.id, file_path, caption=f"🎁 {content_name}")
-                            except:
-                                # Last resort - show file_id
-                                bot.send_message(message.chat.id, f"🎁 Your content: {content_name}\n\nFile ID: {file_path}\n\n⚠️ If you have trouble accessing this content, please contact me!")
-                else:
-                    # It's a local file path
-                    with open(file_path, 'rb') as file:
-                        if any(ext in file_path.lower() for ext in ['.jpg', '.jpeg', '.png', '.gif']):
-                            bot.send_photo(message.chat.id, file, caption=f"🎁 {content_name}")
-                        elif any(ext in file_path.lower() for ext in ['.mp4', '.mov', '.avi']):
-                            bot.send_video(message.chat.id, file, caption=f"🎁 {content_name}")
-                        else:
-                            bot.send_document(message.chat.id, file, caption=f"🎁 {content_name}")
-            except Exception as e:
-                bot.send_message(message.chat.id, f"🎁 Your content: {content_name}\n\n⚠️ There was an issue delivering your content. Please contact me and I'll send it manually!")
-                logger.error(f"Error sending content {content_name}: {e}")
+                os.kill(int(state.claimed_by.rsplit(':', 1)[1]), 0)
+                continue  # that process is still running
+            except (ProcessLookupError, ValueError):
+                pass
+            except PermissionError:
+                continue
+            state.status = 'interrupted'
+            state.finished_at = datetime.datetime.now()
+            logger.warning(f"Scheduled post {state.post_id} was interrupted while sending")
+        db.session.commit()
+
+def parse_schedule_time(tokens):
+    """Parse the leading 'in 30m', 'HH:MM' or 'YYYY-MM-DD HH:MM' of tokens into (datetime, remaining tokens).
+
+    Raises ValueError with a user-facing message on bad input.
+    """
+    now = datetime.datetime.now()
+    if len(tokens) >= 2 and tokens[0].lower() == 'in':
+        match = re.fullmatch(r'(\d+)([mhd])', tokens[1].lower())
+        if not match:
+            raise ValueError("Expected a delay like 30m, 2h or 1d after 'in'")
+        unit = {'m': 'minutes', 'h': 'hours', 'd': 'days'}[match.group(2)]
+        return now + datetime.timedelta(**{unit: int(match.group(1))}), tokens[2:]
+    
+    try:
+        if len(tokens) >= 2 and re.fullmatch(r'\d{4}-\d{2}-\d{2}', tokens[0]):
+            when = datetime.datetime.strptime(f"{tokens[0]} {tokens[1]}", '%Y-%m-%d %H:%M')
+            rest = tokens[2:]
+        elif tokens and re.fullmatch(r'\d{1,2}:\d{2}', tokens[0]):
+            clock = datetime.datetime.strptime(tokens[0], '%H:%M').time()
+            when = datetime.datetime.combine(now.date(), clock)
+            if when <= now:
+                when += datetime.timedelta(days=1)
+            rest = tokens[1:]
+        else:
+            raise ValueError("Expected a time: 'in 30m', 'HH:MM' or 'YYYY-MM-DD HH:MM'")
+    except ValueError as e:
+        raise ValueError(str(e) if str(e).startswith('Expected') else "Invalid date or time")
+    
+    if when <= now:
+        raise ValueError("That time is in the past")
+    return when, rest
+
+def start_post_scheduler():
+    """Start the scheduler's wheel, sender and loader threads"""
+    global post_scheduler
+    recover_scheduled_posts()
+    post_scheduler = PostScheduler()
+    for target in (post_scheduler.run_wheel, post_scheduler.run_sender, post_scheduler.run_loader):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+    logger.info("Post scheduler started")
+    return post_scheduler
+
+# User snapshots - users are copied into user_backups or a gzip file in batches, never loaded whole into memory
+
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', 'backups')
+SNAPSHOT_BATCH_SIZE = int(os.getenv('SNAPSHOT_BATCH_SIZE', '50000'))
+SNAPSHOT_OVERLAP_SECONDS = 300  # incremental windows overlap so rows committed late are not skipped
+SNAPSHOT_FILE_FORMATS = ('jsonl', 'csv')
+SNAPSHOT_RESTORED_KEY = 'users_restored_at'  # a restore rewinds last_interaction, so the next snapshot must be full
+SNAPSHOT_COLUMNS = ('user_id', 'username', 'first_name', 'join_date', 'total_stars_spent', 'interaction_count', 'last_interaction')
+snapshot_lock = threading.Lock()
+
+def key_ranges(key_column, filters, batch_size):
+    """Yield consecutive (low, high] ranges of key_column holding up to batch_size matching rows each.
+
+    low is None for the first range and high is None for the last one.
+    """
+    low = None
+    while True:
+        query = select(key_column).where(*filters, *key_range_filter(key_column, low, None))
+        high = db.session.execute(query.order_by(key_column).offset(batch_size - 1).limit(1)).scalar()
+        yield low, high
+        if high is None:
+            return
+        low = high
+
+def key_range_filter(key_column, low, high):
+    filters = []
+    if low is not None:
+        filters.append(key_column > low)
+    if high is not None:
+        filters.append(key_column <= high)
+    return filters
+
+def json_rows_query(query):
+    """Rewrite a select to return each row as JSON text built by the database, or None if it can't"""
+    dialect = db.session.get_bind().dialect.name
+    pairs = [part for column in query.selected_columns for part in (literal(column.name, db.String), column)]
+    if dialect == 'sqlite':
+        # SQLite stores booleans as 0/1, so turn them back into JSON true/false
+        pairs = [func.json(case((value == True, 'true'), (value == False, 'false')))
+                 if index % 2 and isinstance(value.type, db.Boolean) else value
+                 for index, value in enumerate(pairs)]
+        expression = func.json_object(*pairs)
+    elif dialect == 'postgresql':
+        expression = func.json_build_object(*pairs).cast(db.Text)
+    else:
+        return None
+    return query.with_only_columns(expression, maintain_column_froms=True)
+
+def iter_export_batches(query, file_format, session=None):
+    """Yield (text, row count) for each batch of a select rendered as CSV or JSONL.
+
+    Rows are fetched SNAPSHOT_BATCH_SIZE at a time (a server-side cursor on
+    PostgreSQL), so memory stays flat however large the table is. JSONL rows are
+    rendered by the database where possible.
+    """
+    connection = (session or db.session).connection()
+    if file_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([column.name for column in query.selected_columns])
+        # Write timestamps as the driver returns them rather than parsing them into datetimes first
+        raw_query = query.with_only_columns(*[
+            type_coerce(column, db.String).label(column.name) if isinstance(column.type, db.DateTime) else column
+            for column in query.selected_columns
+        ], maintain_column_froms=True)
+        for batch in connection.execute(raw_query.execution_options(yield_per=SNAPSHOT_BATCH_SIZE)).partitions():
+            writer.writerows(batch)
+            yield buffer.getvalue(), len(batch)
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue(), 0  # header of an empty result
+        return
+    
+    json_query = json_rows_query(query)
+    if json_query is not None:
+        for batch in connection.execute(json_query.execution_options(yield_per=SNAPSHOT_BATCH_SIZE)).partitions():
+            yield ''.join(f"{row[0]}\n" for row in batch), len(batch)
+        return
+    
+    columns = [column.name for column in query.selected_columns]
+    encoder = json.JSONEncoder(ensure_ascii=False, default=str)
+    for batch in connection.execute(query.execution_options(yield_per=SNAPSHOT_BATCH_SIZE)).partitions():
+        yield ''.join(f"{encoder.encode(dict(zip(columns, row)))}\n" for row in batch), len(batch)
+
+def export_query_to_gzip(path, query, file_format, session=None):
+    """Stream a select into a gzip-compressed JSONL or CSV file and return how many rows were written.
+
+    The file appears at path only once it is complete.
+    """
+    partial_path = path + '.part'
+    count = 0
+    with gzip.open(partial_path, 'wt', encoding='utf-8', newline='', compresslevel=1) as output:
+        for text, rows in iter_export_batches(query, file_format, session):
+            output.write(text)
+            count += rows
+    os.replace(partial_path, path)
+    return count
+
+def read_gzip_rows(path, file_format):
+    """Yield rows of a file written by export_query_to_gzip as dicts of strings (CSV) or JSON values"""
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as source:
+        if file_format == 'csv':
+            yield from csv.DictReader(source)
+        else:
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+
+def copy_users_to_backups(taken_at, filters):
+    """Copy matching users into user_backups with INSERT ... SELECT; returns the number of rows copied"""
+    columns = [getattr(User, column) for column in SNAPSHOT_COLUMNS]
+    target = list(SNAPSHOT_COLUMNS) + ['backup_date']
+    
+    def copy_range(range_filters):
+        source = select(*columns, literal(taken_at, db.DateTime)).where(*filters, *range_filters)
+        return db.session.execute(insert(UserBackup).from_select(target, source)).rowcount
+    
+    with app_context_scope():
+        if db.engine.dialect.name != 'sqlite':
+            copied = copy_range([])
+            db.session.commit()
+            return copied
+        
+        # SQLite has a single writer, so commit per key range to let bot writes in between
+        copied = 0
+        for low, high in key_ranges(User.user_id, filters, SNAPSHOT_BATCH_SIZE):
+            copied += copy_range(key_range_filter(User.user_id, low, high))
+            db.session.commit()
+        return copied
+
+def write_users_file(taken_at, filters, file_format, kind):
+    """Stream matching users into a gzip file under SNAPSHOT_DIR; returns (path, row count)"""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    path = os.path.join(SNAPSHOT_DIR, f"users-{taken_at.strftime('%Y%m%d-%H%M%S')}-{kind}.{file_format}.gz")
+    columns = [getattr(User, column) for column in SNAPSHOT_COLUMNS]
+    
+    with app_context_scope():
+        return path, export_query_to_gzip(path, select(*columns).where(*filters).order_by(User.user_id), file_format)
+
+def take_user_snapshot(full=False, destination='table'):
+    """Snapshot users into user_backups (destination 'table') or a 'jsonl'/'csv' gzip file.
+
+    Incremental snapshots copy users whose last_interaction moved since the previous
+    complete snapshot to the same destination; the first one is always full.
+    Returns the UserSnapshot id.
+    """
+    with snapshot_lock:
+        started = time.monotonic()
+        taken_at = datetime.datetime.now()
+        with app_context_scope():
+            previous = UserSnapshot.query.filter_by(status='complete', destination=destination).order_by(UserSnapshot.id.desc()).first()
+            restored_at = get_vip_settings(SNAPSHOT_RESTORED_KEY)
+            if previous and restored_at and datetime.datetime.fromisoformat(restored_at) >= previous.taken_at:
+                previous = None  # users were restored since, so the incremental chain is broken
+            since = None if full or not previous else previous.taken_at - datetime.timedelta(seconds=SNAPSHOT_OVERLAP_SECONDS)
             
-            # Notify owner of sale
-            try:
-                user_data = get_user_data(user_id)
-                if user_data:
-                    username = user_data[1] or "none"
-                    first_name = user_data[2] or "N/A"
-                    total_spent = user_data[4]  # Don't add payment.total_amount again - it's already updated in DB
-                    
-                    bot.send_message(OWNER_ID, f"""
-💰 **NEW SALE!** 💰
+            snapshot = UserSnapshot()
+            snapshot.kind = 'full' if since is None else 'incremental'
+            snapshot.destination = destination
+            snapshot.since = since
+            snapshot.taken_at = taken_at
+            snapshot.status = 'running'
+            db.session.add(snapshot)
+            db.session.commit()
+            snapshot_id = snapshot.id
+            kind = snapshot.kind
+        
+        filters = [User.last_interaction > since] if since else []
+        try:
+            if destination == 'table':
+                file_path, row_count = None, copy_users_to_backups(taken_at, filters)
+            else:
+                file_path, row_count = write_users_file(taken_at, filters, destination, kind)
+        except Exception as e:
+            with app_context_scope():
+                if destination == 'table':
+                    # Drop the rows already copied by a partial SQLite snapshot
+                    UserBackup.query.filter_by(backup_date=taken_at).delete(synchronize_session=False)
+                UserSnapshot.query.filter_by(id=snapshot_id).update({
+                    UserSnapshot.status: 'failed',
+                    UserSnapshot.error: str(e)[:1000],
+                    UserSnapshot.duration_ms: int((time.monotonic() - started) * 1000)
+                }, synchronize_session=False)
+                db.session.commit()
+            raise
+        
+        with app_context_scope():
+            UserSnapshot.query.filter_by(id=snapshot_id).update({
+                UserSnapshot.status: 'complete',
+                UserSnapshot.file_path: file_path,
+                UserSnapshot.row_count: row_count,
+                UserSnapshot.duration_ms: int((time.monotonic() - started) * 1000)
+            }, synchronize_session=False)
+            db.session.commit()
+        
+        logger.info(f"{kind.capitalize()} user snapshot #{snapshot_id} to {destination}: {row_count} rows")
+        return snapshot_id
 
-👤 [{first_name}](tg://user?id={user_id})
-🛒 Item: {content_name}
-⭐ Amount: {payment.total_amount} Stars
-💎 Total Spent: {total_spent} Stars
-🆔 User ID: {user_id}
+def upsert_users_statement(source=None):
+    """INSERT ... ON CONFLICT (user_id) DO UPDATE on users, from a select or for executemany when source is None"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        raise ValueError(f"Restoring snapshots is not supported on {dialect}")
+    
+    statement = dialect_insert(User.__table__)
+    if source is not None:
+        statement = statement.from_select(SNAPSHOT_COLUMNS, source)
+    return statement.on_conflict_do_update(
+        index_elements=['user_id'],
+        set_={column: statement.excluded[column] for column in SNAPSHOT_COLUMNS[1:]}
+    )
 
-💬 Click the name to message them directly!
-""", parse_mode='Markdown')
-            except Exception as e:
-                logger.error(f"Error notifying owner: {e}")
+def parse_snapshot_value(column, value):
+    """Convert a value read back from a snapshot file to the users column type"""
+    if value is None or value == '':
+        return None
+    if column in ('join_date', 'last_interaction'):
+        return datetime.datetime.fromisoformat(value)
+    if column in ('user_id', 'total_stars_spent', 'interaction_count'):
+        return int(value)
+    return value
+
+def restore_user_snapshot(snapshot_id):
+    """Bring users back to how they were at a complete snapshot; returns the number of rows applied.
+
+    Replays the snapshot's chain - the last full snapshot before it, then every
+    incremental up to it - as upserts keyed by user_id in batches. Users created
+    after the snapshot are left as they are.
+    """
+    with app_context_scope():
+        target = db.session.get(UserSnapshot, snapshot_id)
+        if not target or target.status != 'complete':
+            raise ValueError(f"Snapshot #{snapshot_id} is not a complete snapshot")
+        
+        chain_query = UserSnapshot.query.filter(
+            UserSnapshot.id <= snapshot_id,
+            UserSnapshot.status == 'complete',
+            UserSnapshot.destination == target.destination
+        )
+        base = chain_query.filter_by(kind='full').order_by(UserSnapshot.id.desc()).first()
+        if not base:
+            raise ValueError(f"No full snapshot to restore snapshot #{snapshot_id} from")
+        chain = [(snapshot.taken_at, snapshot.file_path) for snapshot in chain_query.filter(UserSnapshot.id >= base.id).order_by(UserSnapshot.id)]
+        destination = target.destination
+    
+    applied = 0
+    with snapshot_lock, app_context_scope():
+        # Recorded before any rows change so even a failed restore forces the next snapshot to be full
+        update_vip_settings(SNAPSHOT_RESTORED_KEY, datetime.datetime.now().isoformat())
+        if destination == 'table':
+            # Each user's newest row within the chain
+            dates = [taken_at for taken_at, _ in chain]
+            for low, high in key_ranges(UserBackup.user_id, [UserBackup.backup_date.in_(dates)], SNAPSHOT_BATCH_SIZE):
+                latest = select(
+                    *[getattr(UserBackup, column) for column in SNAPSHOT_COLUMNS],
+                    func.row_number().over(partition_by=UserBackup.user_id, order_by=UserBackup.backup_date.desc()).label('position')
+                ).where(UserBackup.backup_date.in_(dates), *key_range_filter(UserBackup.user_id, low, high)).subquery()
+                source = select(*[latest.c[column] for column in SNAPSHOT_COLUMNS]).where(latest.c.position == 1)
+                applied += db.session.execute(upsert_users_statement(source)).rowcount
+                db.session.commit()
+        else:
+            # Files are applied oldest first so later snapshots win
+            for _, file_path in chain:
+                batch = []
+                for row in read_gzip_rows(file_path, destination):
+                    batch.append({column: parse_snapshot_value(column, row.get(column)) for column in SNAPSHOT_COLUMNS})
+                    if len(batch) >= SNAPSHOT_BATCH_SIZE:
+                        db.session.execute(upsert_users_statement(), batch)
+                        db.session.commit()
+                        applied += len(batch)
+                        batch = []
+                if batch:
+                    db.session.execute(upsert_users_statement(), batch)
+                    db.session.commit()
+                    applied += len(batch)
+    
+    # total_stars_spent was rewritten, so paying_users and revenue_stars must be recounted
+    rebuild_analytics_counters()
+    bump_audience_version()
+    logger.info(f"Restored user snapshot #{snapshot_id}: {applied} rows applied")
+    return applied
+
+# Data exports - users, purchases and VIP subscriptions streamed as gzip CSV/JSONL
+
+EXPORT_QUERIES = {
+    'users': select(*[getattr(User, column) for column in SNAPSHOT_COLUMNS]).order_by(User.user_id),
+    'purchases': select(
+        UserPurchase.id, UserPurchase.user_id, UserPurchase.content_name, UserPurchase.purchase_date, UserPurchase.price_paid
+    ).order_by(UserPurchase.id),
+    'vips': select(
+        VipSubscription.user_id, VipSubscription.start_date, VipSubscription.expiry_date,
+        VipSubscription.is_active, VipSubscription.total_payments
+    ).order_by(VipSubscription.user_id),
+}
+EXPORT_LINK_TTL_SECONDS = 3600
+TELEGRAM_DOCUMENT_MAX_BYTES = 50 * 1024 * 1024  # Bot API upload limit
+
+EXPORT_CHUNK_BYTES = 256 * 1024
+
+def write_export_file(dataset, file_format):
+    """Export a dataset into a gzip file in a new temporary directory; returns (directory, path, row_count).
+
+    The database is only read while the file is written, so whoever consumes the
+    file afterwards - Telegram or a slow HTTP client - never holds a connection.
+    """
+    export_dir = tempfile.mkdtemp(prefix='export-')
+    file_name = f"{dataset}-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.{file_format}.gz"
+    path = os.path.join(export_dir, file_name)
+    try:
+        with app_context_scope():
+            row_count = export_query_to_gzip(path, EXPORT_QUERIES[dataset], file_format, get_read_session())
+    except Exception:
+        remove_export_dir(export_dir)
+        raise
+    return export_dir, path, row_count
+
+def remove_export_dir(export_dir):
+    """Delete a temporary export directory and whatever is left in it"""
+    for name in os.listdir(export_dir):
+        os.remove(os.path.join(export_dir, name))
+    os.rmdir(export_dir)
+
+def iter_export_file(export_dir, path):
+    """Yield a finished export file in chunks for an HTTP download, then delete it"""
+    try:
+        with open(path, 'rb') as export_file:
+            for chunk in iter(lambda: export_file.read(EXPORT_CHUNK_BYTES), b''):
+                yield chunk
+    finally:
+        remove_export_dir(export_dir)
+
+def run_export_job(chat_id, dataset, file_format):
+    """Export a dataset to a temporary gzip file and send it to the owner as a document"""
+    export_dir = None
+    try:
+        started = time.monotonic()
+        export_dir, path, row_count = write_export_file(dataset, file_format)
+        size = os.path.getsize(path)
+        logger.info(f"Exported {row_count} {dataset} rows to {file_format} ({size} bytes) in {time.monotonic() - started:.1f}s")
+        
+        if size > TELEGRAM_DOCUMENT_MAX_BYTES:
+            bot.send_message(chat_id, f"""📦 The {dataset} export is {size / 1024 / 1024:.0f}MB, over Telegram's 50MB limit.
+
+⬇️ Download it here instead (link valid for {EXPORT_LINK_TTL_SECONDS // 60} minutes):
+{generate_export_url(dataset, file_format)}""")
+            return
+        
+        with open(path, 'rb') as document:
+            bot.send_document(chat_id, document, visible_file_name=os.path.basename(path),
+                              caption=f"📦 Export of {dataset} - {row_count:,} rows")
+    except Exception as e:
+        logger.error(f"Export of {dataset} failed: {e}")
+        bot.send_message(chat_id, f"❌ Export failed: {str(e)[:300]}")
+    finally:
+        if export_dir:
+            remove_export_dir(export_dir)
+
+def validate_pre_checkout(pre_checkout_query):
+    """Check a pre-checkout query against the in-memory catalog index (no database access).
+
+    Returns:
+        str: error message to show the buyer, or None if the payment may proceed
+    """
+    decoded = decode_invoice_payload(pre_checkout_query.invoice_payload)
+    if not decoded:
+        return "This invoice is no longer valid. Please start your purchase again."
+    
+    kind, user_id, content_name = decoded
+    if user_id != pre_checkout_query.from_user.id:
+        return "This invoice was created for a different account."
+    if pre_checkout_query.currency != 'XTR':
+        return "Only Telegram Stars payments are supported."
+    
+    index = catalog_index
+    if kind == 'vip':
+        expected_price = index['vip_price']
+    else:
+        item = index['content'].get(content_name)
+        if not item or item[1] != 'browse':
+            return "Sorry, this content is no longer available."
+        expected_price = item[0]
+    
+    if pre_checkout_query.total_amount != expected_price:
+        return "The price has changed since this invoice was created. Please request a new invoice."
+    return None
+
+@bot.pre_checkout_query_handler(func=lambda query: True)
+def pre_checkout_handler(pre_checkout_query):
+    """Handle pre-checkout queries for Telegram Stars payments"""
+    # Telegram cancels the payment if we don't answer within 10 seconds
+    if catalog_index['version'] is None:
+        refresh_catalog_index()
+    
+    error_message = validate_pre_checkout(pre_checkout_query)
+    if error_message:
+        logger.warning(f"Rejected pre-checkout for {pre_checkout_query.from_user.id} ({pre_checkout_query.invoice_payload}): {error_message}")
+        bot.answer_pre_checkout_query(pre_checkout_query.id, ok=False, error_message=error_message)
+        return
+    
+    bot.answer_pre_checkout_query(pre_checkout_query.id, ok=True)
+
+@bot.message_handler(content_types=['successful_payment'])
+@safe_handler
+def successful_payment_handler(message):
+    """Handle successful payment and deliver content"""
+    # Check if user is blocked before processing payment
+    if is_user_blocked(message.from_user.id):
+        bot.send_message(message.chat.id, "🚫 You have been blocked from using this bot. Contact the owner if you believe this is an error.")
+        return
+    
+    # Delivery and owner notifications are queued and sent by the fulfillment worker
+    process_successful_payment(message)
 
 # Notification message handler (must be before general text handler for priority)
 
-@bot.message_handler(func=lambda message: message.from_user.id == OWNER_ID and is_session_valid(message.chat.id) and notification_sessions[message.chat.id].get('waiting_for_message'))
+@bot.message_handler(func=lambda message: message.from_user.id == OWNER_ID and is_session_valid(message.chat.id) and (get_notification_session(message.chat.id) or {}).get('waiting_for_message'))
 def handle_notification_message_input(message):
     """Handle notification message input from owner"""
     # Clean up expired sessions first
@@ -6878,9 +10156,8 @@ def handle_notification_message_input(message):
         bot.send_message(message.chat.id, "❌ Notification session expired. Please start over from the notification menu.")
         return
     
-    session = notification_sessions[message.chat.id]
+    session = get_notification_session(message.chat.id)
     target_group = session['target_group']
-    users = session['users']
     notification_text = message.text
     
     # Update session timestamp to keep it alive
@@ -6894,11 +10171,12 @@ def handle_notification_message_input(message):
     target_names = {
         'all': 'All Users',
         'vip': 'VIP Members', 
-        'non_vip': 'Non-VIP Users'
+        'non_vip': 'Non-VIP Users',
+        'segment': 'Custom Segment'
     }
     
     target_name = target_names.get(target_group, 'Unknown')
-    user_count = len(users)
+    user_count = session.get('user_count') or count_audience(target_group, session.get('segment'))
     
     # Show preview and confirmation
     preview_text = f"""
@@ -6920,9 +10198,12 @@ def handle_notification_message_input(message):
     bot.send_message(message.chat.id, preview_text, reply_markup=markup, parse_mode='HTML')
     
     # Store the message for confirmation and update timestamp
-    notification_sessions[message.chat.id]['message_text'] = notification_text
-    notification_sessions[message.chat.id]['waiting_for_message'] = False
-    notification_sessions[message.chat.id]['timestamp'] = time.time()
+    session.update({
+        'message_text': notification_text,
+        'waiting_for_message': False,
+        'timestamp': time.time()
+    })
+    notification_sessions.touch(message.chat.id)
 
 # Natural text message handler
 
@@ -6971,6 +10252,23 @@ def generate_secure_access_token(content_name):
     
     return token
 
+def generate_export_token(dataset, file_format, expires):
+    """Generate the HMAC token for an export download link that expires at the given Unix time"""
+    import hashlib
+    import hmac
+    
+    token_key = BOT_TOKEN or "dummy_key_for_web_mode"
+    message = f"export:{dataset}:{file_format}:{expires}:owner_access".encode('utf-8')
+    return hmac.new(token_key.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+def generate_export_url(dataset, file_format):
+    """Generate a time-limited download URL for an export"""
+    expires = int(time.time()) + EXPORT_LINK_TTL_SECONDS
+    token = generate_export_token(dataset, file_format, expires)
+    domain = os.environ.get('REPL_SLUG', 'localhost:5000')
+    
+    return f"https://{domain}/export/{dataset}.{file_format}.gz?expires={expires}&token={token}"
+
 def generate_owner_access_url(content_name):
     """Generate secure access URL for owner to preview content"""
     token = generate_secure_access_token(content_name)
@@ -7009,7 +10307,7 @@ def preview_content(content_name):
     
     try:
         # Get content details from database
-        with app.app_context():
+        with app_context_scope():
             content_item = ContentItem.query.filter_by(name=content_name).first()
             content = (content_item.file_path, content_item.description, content_item.content_type) if content_item else None
         
@@ -7025,6 +10323,37 @@ def preview_content(content_name):
         logger.error(f"Error serving content preview {content_name}: {e}")
         abort(500, f"Error serving content: {str(e)}")
 
+@app.route('/export/<dataset>.<file_format>.gz')
+def export_download(dataset, file_format):
+    """Serve a data export as a gzip download - OWNER ONLY ACCESS via signed links"""
+    from flask import abort, Response, request
+    import hmac
+    
+    if dataset not in EXPORT_QUERIES or file_format not in SNAPSHOT_FILE_FORMATS:
+        abort(404)
+    
+    access_token = request.args.get('token') or request.headers.get('X-Access-Token')
+    expires = request.args.get('expires', '')
+    if not access_token or not expires.isdigit():
+        logger.warning(f"Unauthorized export attempt for '{dataset}' from {request.remote_addr}")
+        abort(403, "Access denied: Authentication required")
+    
+    if not hmac.compare_digest(access_token, generate_export_token(dataset, file_format, int(expires))):
+        logger.warning(f"Invalid export token for '{dataset}' from {request.remote_addr}")
+        abort(403, "Access denied: Invalid authentication token")
+    
+    if int(expires) < time.time():
+        abort(403, "Access denied: Link expired")
+    
+    logger.info(f"Authorized {file_format} export of '{dataset}' to {request.remote_addr}")
+    # Written to a temporary file first, so the download is paced by the client without holding a DB connection
+    export_dir, path, _ = write_export_file(dataset, file_format)
+    response = Response(iter_export_file(export_dir, path), mimetype='application/gzip')
+    response.headers['Content-Length'] = str(os.path.getsize(path))
+    response.headers['Content-Disposition'] = f'attachment; filename="{dataset}.{file_format}.gz"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 # REMOVED: Dangerous /content/file/<file_id> endpoint that acted as open Telegram proxy
 
 def serve_content_file(file_path, content_name="Content", description=""):
@@ -7118,7 +10447,7 @@ def serve_content_file(file_path, content_name="Content", description=""):
                 file_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file_info.file_path}"
                 
                 # Stream download with size limit enforcement
-                with requests.get(file_url, timeout=30, stream=True) as response:
+                with http_session.get(file_url, timeout=30, stream=True) as response:
                     response.raise_for_status()
                     
                     # Check Content-Length header for size validation
@@ -7223,7 +10552,7 @@ def handle_loyal_fan_reason_input(message):
             return
         
         # Mark user as loyal fan using SQLAlchemy
-        with app.app_context():
+        with app_context_scope():
             # Check if user exists
             user = User.query.filter_by(user_id=user_id).first()
             
@@ -7245,6 +10574,7 @@ def handle_loyal_fan_reason_input(message):
                     db.session.add(new_loyal_fan)
                 
                 db.session.commit()
+                bump_audience_version()
                 
                 success_text = f"""
 ✅ <b>LOYAL FAN MARKED SUCCESSFULLY!</b> ✅
@@ -7327,16 +10657,269 @@ def clear_webhook_and_polling():
     except Exception as e:
         logger.warning(f"Error clearing webhook (this is usually fine): {e}")
 
+# Update lanes - incoming updates are classified so payments never queue behind chatter
+
+# Highest priority first; payments are never shed, bulk traffic is shed first
+UPDATE_LANE_ORDER = ('payment', 'interactive', 'bulk')
+UPDATE_BACKLOG_LIMIT = int(os.getenv('UPDATE_BACKLOG_LIMIT', '1000'))
+UPDATE_POLL_TIMEOUT = 20
+
+def classify_update(raw_update):
+    """Pick the lane for a raw update: payment, interactive or bulk"""
+    if raw_update.get('pre_checkout_query'):
+        return 'payment'
+    if raw_update.get('callback_query'):
+        return 'interactive'
+    
+    message = raw_update.get('message')
+    if message:
+        if message.get('successful_payment'):
+            return 'payment'
+        # Commands and anything the owner sends (uploads included) must not be shed
+        if message.get('text', '').startswith('/') or is_owner(message.get('from', {}).get('id')):
+            return 'interactive'
+    return 'bulk'
+
+class UpdateLanes:
+    """Priority queues of raw updates served by a pool of handler threads.
+
+    General threads always take the highest priority update waiting. Reserved
+    payment threads only serve the payment lane, so a pre-checkout query is
+    picked up at once even while every general thread is busy. Once the
+    backlog reaches its limit the oldest bulk update is dropped to make room;
+    payment updates are always accepted.
+    """
+    
+    def __init__(self, general_threads, payment_threads, backlog_limit):
+        self.general_threads = general_threads
+        self.payment_threads = payment_threads
+        self.backlog_limit = backlog_limit
+        self._queues = {lane: deque() for lane in UPDATE_LANE_ORDER}
+        self._cond = threading.Condition()
+        self.stats = {lane: {'handled': 0, 'shed': 0} for lane in UPDATE_LANE_ORDER}
+    
+    def start(self):
+        for index in range(self.payment_threads):
+            thread = threading.Thread(target=self._work, args=(('payment',),), name=f"lane-payment-{index}")
+            thread.daemon = True
+            thread.start()
+        for index in range(self.general_threads):
+            thread = threading.Thread(target=self._work, args=(UPDATE_LANE_ORDER,), name=f"lane-general-{index}")
+            thread.daemon = True
+            thread.start()
+        return self
+    
+    def submit(self, raw_update, lane=None):
+        """Queue an update, returning False if it was shed"""
+        lane = lane or classify_update(raw_update)
+        with self._cond:
+            if lane != 'payment' and self.backlog() >= self.backlog_limit:
+                if self._queues['bulk']:
+                    self._queues['bulk'].popleft()
+                    self._record_shed('bulk')
+                else:
+                    self._record_shed(lane)
+                    return False
+            self._queues[lane].append(raw_update)
+            self._cond.notify()
+        return True
+    
+    def backlog(self):
+        return sum(len(lane_queue) for lane_queue in self._queues.values())
+    
+    def _record_shed(self, lane):
+        self.stats[lane]['shed'] += 1
+        if self.stats[lane]['shed'] % 100 == 1:
+            logger.warning(f"Update backlog full - shedding {lane} updates ({self.stats[lane]['shed']} so far)")
+    
+    def _take(self, lanes):
+        with self._cond:
+            while True:
+                for lane in lanes:
+                    if self._queues[lane]:
+                        return lane, self._queues[lane].popleft()
+                self._cond.wait()
+    
+    def _work(self, lanes):
+        while True:
+            lane, raw_update = self._take(lanes)
+            try:
+                bot.process_new_updates([types.Update.de_json(raw_update)])
+            except Exception as e:
+                logger.error(f"Update {raw_update.get('update_id')} failed in {lane} lane: {e}")
+            with self._cond:
+                self.stats[lane]['handled'] += 1
+    
+    def get_stats(self):
+        with self._cond:
+            return {lane: dict(self.stats[lane], queued=len(self._queues[lane])) for lane in UPDATE_LANE_ORDER}
+
+update_lanes = None
+
+def start_update_lanes(general_threads):
+    """Start the lane threads that run handlers in this process"""
+    global update_lanes
+    # Lane threads run the handlers themselves, so skip the TeleBot thread pool
+    bot.threaded = False
+    update_lanes = UpdateLanes(general_threads, PAYMENT_LANE_THREADS, UPDATE_BACKLOG_LIMIT).start()
+    return update_lanes
+
+def iter_update_batches():
+    """Long-poll Telegram and yield each batch of raw updates"""
+    offset = None
+    try:
+        # Match infinity_polling(skip_pending=True): drop updates queued while the bot was down
+        pending = apihelper.get_updates(bot.token, offset=-1, timeout=0)
+        if pending:
+            offset = pending[-1]['update_id'] + 1
+    except Exception as e:
+        logger.warning(f"Could not skip pending updates: {e}")
+    
+    while True:
+        try:
+            updates = apihelper.get_updates(bot.token, offset=offset, timeout=UPDATE_POLL_TIMEOUT,
+                                            long_polling_timeout=UPDATE_POLL_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Update polling failed: {e}")
+            time.sleep(3)
+            continue
+        
+        if updates:
+            offset = updates[-1]['update_id'] + 1
+        yield updates
+
 def run_bot():
-    """Run the bot with simple polling"""
+    """Poll Telegram and hand every update to its priority lane"""
     try:
         logger.info("Starting bot polling...")
-        bot.infinity_polling(skip_pending=True)
-        logger.info("Bot polling started successfully!")
+        lanes = start_update_lanes(BOT_WORKER_THREADS)
+        for updates in iter_update_batches():
+            for raw_update in updates:
+                lanes.submit(raw_update)
     except Exception as e:
         logger.error(f"Bot polling failed: {e}")
         logger.info("Flask server will continue running for health checks.")
 
+# Sharded worker mode - one receiver polls Telegram and fans updates out to worker
+# processes by chat_id, so each chat's updates stay in order while CPU and database
+# work spread across cores
+BOT_SHARDS = int(os.getenv('BOT_SHARDS', '1'))
+SHARD_QUEUE_SIZE = int(os.getenv('SHARD_QUEUE_SIZE', '1000'))
+outbound_bucket = None
+
+def update_chat_id(raw_update):
+    """Return the chat (or user) id an incoming update belongs to, 0 if it has none"""
+    for field in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        if raw_update.get(field):
+            return raw_update[field]['chat']['id']
+    
+    callback = raw_update.get('callback_query')
+    if callback:
+        if callback.get('message'):
+            return callback['message']['chat']['id']
+        return callback['from']['id']
+    
+    for field in ('pre_checkout_query', 'shipping_query', 'inline_query', 'chosen_inline_result',
+                  'my_chat_member', 'chat_member', 'chat_join_request'):
+        item = raw_update.get(field)
+        if item:
+            chat = item.get('chat')
+            return chat['id'] if chat else item['from']['id']
+    return 0
+
+def shard_for_chat(chat_id, shards):
+    """Pick the worker for a chat - stable, so one chat always lands on the same worker"""
+    return chat_id % shards
+
+def run_shard_worker(shard, update_queue, wakeups, outbound_bucket):
+    """Handle one shard's updates in arrival order (runs in a worker process started by the forkserver)"""
+    global fulfillment_wakeup, scheduler_wakeup
+    # Payments and posts queued here must wake the fulfillment worker and scheduler in the main process
+    fulfillment_wakeup, scheduler_wakeup = wakeups
+    
+    # Replies from every worker and the receiver's broadcasts draw on one global send budget
+    outbound_governor.share_global_bucket(outbound_bucket)
+    
+    # Updates for a chat must run one after another, so skip the TeleBot thread pool
+    bot.threaded = False
+    
+    catalog_thread = threading.Thread(target=run_catalog_refresher)
+    catalog_thread.daemon = True
+    catalog_thread.start()
+    
+    logger.info(f"Shard worker {shard} started (pid {os.getpid()})")
+    while True:
+        raw_update = update_queue.get()
+        if raw_update is None:
+            break
+        try:
+            bot.process_new_updates([types.Update.de_json(raw_update)])
+        except Exception as e:
+            logger.error(f"Shard worker {shard} failed on update {raw_update.get('update_id')}: {e}")
+
+def start_shard_workers(shards):
+    """Start the shard worker processes.
+
+    Workers come from a forkserver rather than a fork of this process, so starting
+    or restarting one from the receiver thread never copies another thread's held
+    locks or open connections into the child.
+    """
+    global fulfillment_wakeup, scheduler_wakeup, outbound_bucket
+    ctx = multiprocessing.get_context('forkserver')
+    # This process still sends confirmations, fulfillment and every broadcast
+    outbound_bucket = new_outbound_bucket(ctx)
+    outbound_governor.share_global_bucket(outbound_bucket)
+    # Payments handled in a worker must wake the fulfillment worker in this process
+    fulfillment_wakeup = ctx.Event()
+    # Posts scheduled from a worker must wake the scheduler's loader in this process
+    scheduler_wakeup = ctx.Event()
+    
+    workers = []
+    for shard in range(shards):
+        update_queue = ctx.Queue(SHARD_QUEUE_SIZE)
+        workers.append((start_shard_process(ctx, shard, update_queue), update_queue))
+    return ctx, workers
+
+def start_shard_process(ctx, shard, update_queue):
+    """Start the worker process for one shard"""
+    process = ctx.Process(target=run_shard_worker,
+                          args=(shard, update_queue, (fulfillment_wakeup, scheduler_wakeup), outbound_bucket),
+                          daemon=True)
+    process.start()
+    return process
+
+def run_shard_receiver(ctx, workers):
+    """Poll Telegram once and route every update to the worker that owns its chat.
+
+    Payment updates skip the shards and run on this process's payment lane. The
+    receiver never blocks on a shard: when a shard's queue is full its updates are
+    shed, so one stalled worker can't hold up the chats on every other shard.
+    """
+    lanes = start_update_lanes(0)
+    shed = {'interactive': 0, 'bulk': 0}
+    
+    logger.info(f"Update receiver started with {len(workers)} shard workers")
+    for updates in iter_update_batches():
+        for shard, (process, update_queue) in enumerate(workers):
+            if not process.is_alive():
+                logger.error(f"Shard worker {shard} exited (code {process.exitcode}), restarting")
+                workers[shard] = (start_shard_process(ctx, shard, update_queue), update_queue)
+        
+        for raw_update in updates:
+            lane = classify_update(raw_update)
+            if lane == 'payment':
+                lanes.submit(raw_update, lane)
+                continue
+            
+            shard = shard_for_chat(update_chat_id(raw_update), len(workers))
+            try:
+                workers[shard][1].put_nowait(raw_update)
+            except queue.Full:
+                shed[lane] += 1
+                if shed[lane] % 100 == 1:
+                    log = logger.error if lane == 'interactive' else logger.warning
+                    log(f"Shard {shard} queue full - shedding {lane} updates ({shed[lane]} so far)")
+
 # Flask Routes
 @app.route('/')
 def home():
@@ -7399,14 +10982,17 @@ def health():
     """Health check endpoint"""
     try:
         # Test database connection
-        with app.app_context():
+        with app_context_scope():
             user_count = User.query.count()
         
         response_data = {
             'status': 'healthy',
             'database': 'connected',
             'user_count': user_count,
-            'bot_mode': 'active' if os.getenv('BOT_TOKEN') and int(os.getenv('OWNER_ID', '0')) != 0 else 'web-only'
+            'bot_mode': 'active' if os.getenv('BOT_TOKEN') and int(os.getenv('OWNER_ID', '0')) != 0 else 'web-only',
+            'http': get_http_metrics(),
+            'update_lanes': update_lanes.get_stats() if update_lanes else None,
+            'scheduler': post_scheduler.get_stats() if post_scheduler else None
         }
         response = jsonify(response_data)
         response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
@@ -7432,12 +11018,45 @@ def main():
     original_bot_token = os.getenv('BOT_TOKEN')
     original_owner_id = int(os.getenv('OWNER_ID', '0'))
     
-    if original_bot_token and original_owner_id != 0:
+    if original_bot_token and original_owner_id != 0 and BOT_SHARDS > 1:
+        logger.info(f"Valid credentials found - starting {BOT_SHARDS} shard workers...")
+        # Workers run their own catalog refreshers
+        ctx, workers = start_shard_workers(BOT_SHARDS)
+        bot_thread = threading.Thread(target=run_shard_receiver, args=(ctx, workers))
+        bot_thread.daemon = True
+        bot_thread.start()
+        
+        # A single fulfillment worker serves every shard
+        fulfillment_thread = threading.Thread(target=run_fulfillment_worker)
+        fulfillment_thread.daemon = True
+        fulfillment_thread.start()
+        
+        # Scheduled posts fire from this process only
+        start_post_scheduler()
+        
+        # Pre-checkout queries are answered here, so keep this process's price index fresh too
+        catalog_thread = threading.Thread(target=run_catalog_refresher)
+        catalog_thread.daemon = True
+        catalog_thread.start()
+    elif original_bot_token and original_owner_id != 0:
         logger.info("Valid credentials found - starting bot polling...")
         # Start bot in a separate thread
         bot_thread = threading.Thread(target=run_bot)
         bot_thread.daemon = True
         bot_thread.start()
+        
+        # Deliver paid content and notifications off the update thread
+        fulfillment_thread = threading.Thread(target=run_fulfillment_worker)
+        fulfillment_thread.daemon = True
+        fulfillment_thread.start()
+        
+        # Fire scheduled posts
+        start_post_scheduler()
+        
+        # Keep the pre-checkout price index in step with catalog changes from other processes
+        catalog_thread = threading.Thread(target=run_catalog_refresher)
+        catalog_thread.daemon = True
+        catalog_thread.start()
     else:
         logger.info("Missing bot credentials - running in web-only mode")
         logger.info("Add BOT_TOKEN and OWNER_ID to Replit Secrets to enable Telegram bot functionality")
@@ -1,6 +1,6 @@
 from app import db
 from sqlalchemy.sql import func
-from sqlalchemy import Integer, BigInteger, String, Text, DateTime, Boolean
+from sqlalchemy import Integer, BigInteger, String, Text, DateTime, Date, Boolean
 
 
 class User(db.Model):
@@ -19,6 +19,12 @@ class User(db.Model):
     vip_subscription = db.relationship('VipSubscription', backref='user', uselist=False, cascade='all, delete-orphan')
     loyal_fan = db.relationship('LoyalFan', backref='user', uselist=False, cascade='all, delete-orphan')
     backups = db.relationship('UserBackup', backref='user', lazy=True, cascade='all, delete-orphan')
+    
+    # Keyset pagination order for the paying customers list; last_interaction backs activity segments
+    __table_args__ = (
+        db.Index('ix_users_stars_spent_user_id', 'total_stars_spent', 'user_id'),
+        db.Index('ix_users_last_interaction', 'last_interaction'),
+    )
 
 
 class LoyalFan(db.Model):
@@ -27,6 +33,8 @@ class LoyalFan(db.Model):
     user_id = db.Column(BigInteger, db.ForeignKey('users.user_id'), primary_key=True)
     reason = db.Column(Text, nullable=True)
     date_marked = db.Column(DateTime, default=func.now())
+    
+    __table_args__ = (db.Index('ix_loyal_fans_date_marked_user_id', 'date_marked', 'user_id'),)
 
 
 class Response(db.Model):
@@ -59,7 +67,11 @@ class UserPurchase(db.Model):
     purchase_date = db.Column(DateTime, default=func.now())
     price_paid = db.Column(Integer, nullable=False)
     
-    __table_args__ = (db.UniqueConstraint('user_id', 'content_name'),)
+    # The content-first index backs "owns content X" segments
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'content_name'),
+        db.Index('ix_user_purchases_content_user', 'content_name', 'user_id'),
+    )
 
 
 class ScheduledPost(db.Model):
@@ -71,6 +83,25 @@ class ScheduledPost(db.Model):
     created_date = db.Column(DateTime, default=func.now())
 
 
+class ScheduledPostState(db.Model):
+    __tablename__ = 'scheduled_post_states'
+    
+    # Audience and delivery state of a ScheduledPost - a separate table because
+    # create_all never adds columns to a table that already exists
+    post_id = db.Column(Integer, db.ForeignKey('scheduled_posts.id'), primary_key=True, autoincrement=False)
+    target_group = db.Column(String(20), nullable=False, default='all')  # all, vip, non_vip or segment
+    segment = db.Column(Text, nullable=True)  # canonical segment predicates for target_group='segment'
+    status = db.Column(String(20), nullable=False, default='pending')  # pending, sending, sent, failed, cancelled, missed or interrupted
+    claimed_by = db.Column(String(100), nullable=True)  # host:pid of the worker that fired it
+    claimed_at = db.Column(DateTime, nullable=True)
+    finished_at = db.Column(DateTime, nullable=True)
+    sent_count = db.Column(Integer, nullable=False, default=0)
+    failed_count = db.Column(Integer, nullable=False, default=0)
+    last_error = db.Column(Text, nullable=True)
+    
+    __table_args__ = (db.Index('ix_scheduled_post_states_status', 'status'),)
+
+
 class UserBackup(db.Model):
     __tablename__ = 'user_backups'
     
@@ -83,6 +114,25 @@ class UserBackup(db.Model):
     interaction_count = db.Column(Integer, default=0)
     last_interaction = db.Column(DateTime, nullable=True)
     backup_date = db.Column(DateTime, default=func.now())
+    
+    # Restores pick each user's latest row within a snapshot chain
+    __table_args__ = (db.Index('ix_user_backups_user_id_backup_date', 'user_id', 'backup_date'),)
+
+
+class UserSnapshot(db.Model):
+    __tablename__ = 'user_snapshots'
+    
+    # One run of the snapshot engine; a table snapshot is the user_backups rows whose backup_date equals taken_at
+    id = db.Column(Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(String(20), nullable=False)  # full or incremental
+    destination = db.Column(String(20), nullable=False)  # table, jsonl or csv
+    file_path = db.Column(String(255), nullable=True)
+    since = db.Column(DateTime, nullable=True)  # incremental snapshots copy users with last_interaction after this
+    taken_at = db.Column(DateTime, nullable=False)
+    status = db.Column(String(20), nullable=False, default='running')  # running, complete or failed
+    row_count = db.Column(Integer, nullable=False, default=0)
+    duration_ms = db.Column(Integer, nullable=True)
+    error = db.Column(Text, nullable=True)
 
 
 class VipSubscription(db.Model):
@@ -93,6 +143,8 @@ class VipSubscription(db.Model):
     expiry_date = db.Column(DateTime, nullable=False)
     is_active = db.Column(Boolean, default=True)
     total_payments = db.Column(Integer, default=0)
+    
+    __table_args__ = (db.Index('ix_vip_subscriptions_expiry_user_id', 'expiry_date', 'user_id'),)
 
 
 class VipSetting(db.Model):
@@ -111,6 +163,9 @@ class Teaser(db.Model):
     description = db.Column(Text, nullable=True)
     created_date = db.Column(DateTime, default=func.now())
     vip_only = db.Column(Boolean, default=False)
+    
+    # Backs the newest-first teaser pages for each tier
+    __table_args__ = (db.Index('ix_teasers_vip_only_created_date', 'vip_only', 'created_date'),)
 
 
 class BlockedUser(db.Model):
@@ -119,4 +174,90 @@ class BlockedUser(db.Model):
     user_id = db.Column(BigInteger, primary_key=True, autoincrement=False)
     blocked_date = db.Column(DateTime, default=func.now())
     reason = db.Column(Text, nullable=True)
-    blocked_by = db.Column(BigInteger, nullable=False)
\ No newline at end of file
+    blocked_by = db.Column(BigInteger, nullable=False)
+
+
+class AnalyticsCounter(db.Model):
+    __tablename__ = 'analytics_counters'
+    
+    # bucket is a day ('YYYY-MM-DD') or 'all' for the running total
+    bucket = db.Column(String(10), primary_key=True)
+    metric = db.Column(String(50), primary_key=True)
+    value = db.Column(BigInteger, nullable=False, default=0)
+
+
+class Payment(db.Model):
+    __tablename__ = 'payments'
+    
+    # Append-only ledger of every Telegram Stars payment
+    id = db.Column(Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(BigInteger, nullable=False)
+    kind = db.Column(String(20), nullable=False)  # 'content' or 'vip'
+    content_name = db.Column(String(200), nullable=True)
+    amount = db.Column(Integer, nullable=False)
+    telegram_payment_charge_id = db.Column(String(255), nullable=True, unique=True)
+    paid_at = db.Column(DateTime, nullable=False, default=func.now(), index=True)
+    
+    __table_args__ = (db.Index('ix_payments_user_paid_at', 'user_id', 'paid_at'),)
+
+
+class RevenueRollup(db.Model):
+    __tablename__ = 'revenue_rollups'
+    
+    period = db.Column(String(5), primary_key=True)  # 'day', 'week' or 'month'
+    bucket_start = db.Column(Date, primary_key=True)
+    payments = db.Column(Integer, nullable=False, default=0)
+    revenue = db.Column(BigInteger, nullable=False, default=0)
+    content_revenue = db.Column(BigInteger, nullable=False, default=0)
+    vip_revenue = db.Column(BigInteger, nullable=False, default=0)
+
+
+class CohortActivity(db.Model):
+    __tablename__ = 'cohort_activity'
+    
+    # Cohorts are keyed by the month of a user's first payment
+    cohort_month = db.Column(Date, primary_key=True)
+    activity_month = db.Column(Date, primary_key=True)
+    users = db.Column(Integer, nullable=False, default=0)
+    revenue = db.Column(BigInteger, nullable=False, default=0)
+
+
+class FulfillmentJob(db.Model):
+    __tablename__ = 'fulfillment_jobs'
+    
+    # Durable queue of post-payment deliveries and notifications
+    id = db.Column(Integer, primary_key=True, autoincrement=True)
+    job_type = db.Column(String(30), nullable=False)
+    chat_id = db.Column(BigInteger, nullable=False)
+    user_id = db.Column(BigInteger, nullable=False)
+    payload = db.Column(Text, nullable=True)  # JSON encoded job arguments
+    status = db.Column(String(20), nullable=False, default='pending')  # pending, running or failed
+    attempts = db.Column(Integer, nullable=False, default=0)
+    run_after = db.Column(DateTime, nullable=False, default=func.now())
+    last_error = db.Column(Text, nullable=True)
+    created_at = db.Column(DateTime, default=func.now())
+    
+    __table_args__ = (db.Index('ix_fulfillment_jobs_status_run_after', 'status', 'run_after'),)
+
+
+class BotSession(db.Model):
+    __tablename__ = 'bot_sessions'
+    
+    # Conversation state shared by all worker processes (SESSION_BACKEND=sql)
+    namespace = db.Column(String(32), primary_key=True)  # upload or notification
+    key = db.Column(String(100), primary_key=True)
+    data = db.Column(Text, nullable=False)  # JSON encoded session dict
+    expires_at = db.Column(DateTime, nullable=False, index=True)
+
+
+class MediaAsset(db.Model):
+    __tablename__ = 'media_assets'
+    
+    # One row per distinct media file - ContentItem and Teaser file_path hold its file_id
+    id = db.Column(Integer, primary_key=True, autoincrement=True)
+    file_id = db.Column(Text, nullable=False)
+    file_unique_id = db.Column(String(100), nullable=True, unique=True)  # Telegram's stable id for the file
+    content_hash = db.Column(String(64), nullable=True, unique=True)  # sha256 of downloaded or local bytes
+    file_type = db.Column(String(50), nullable=True)
+    source = db.Column(Text, nullable=True)  # original URL or local path
+    created_date = db.Column(DateTime, default=func.now())
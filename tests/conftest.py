@@ -0,0 +1,166 @@
+"""Shared fixtures - main.py is imported once, in web-only mode, against a throwaway SQLite database"""
+import http.server
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from urllib.parse import parse_qsl, urlparse
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DIR = tempfile.mkdtemp(prefix='bot-tests-')
+
+# Must be set before app.py is imported; never touch a real database or bot token
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TEST_DIR, 'test.db')
+os.environ.pop('DATABASE_REPLICA_URL', None)
+os.environ.pop('BOT_TOKEN', None)
+os.environ.setdefault('SNAPSHOT_DIR', os.path.join(TEST_DIR, 'backups'))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def main():
+    import main as bot_main
+    bot_main.init_database()
+    return bot_main
+
+
+@pytest.fixture
+def sent(main, monkeypatch):
+    """Replace every Telegram call the handlers make; returns the list of (chat_id, text) sent"""
+    messages = []
+    
+    def send_message(chat_id, text, *args, **kwargs):
+        messages.append((chat_id, text))
+        return SimpleNamespace(message_id=len(messages), photo=None)
+    
+    monkeypatch.setattr(main.bot, 'send_message', send_message)
+    monkeypatch.setattr(main.bot, 'get_me', lambda: SimpleNamespace(id=999))
+    for name in ('answer_callback_query', 'answer_pre_checkout_query', 'edit_message_text', 'pin_chat_message',
+                 'send_photo', 'send_video', 'send_document', 'send_animation', 'send_invoice'):
+        monkeypatch.setattr(main.bot, name, lambda *args, **kwargs: SimpleNamespace(message_id=1, photo=None))
+    return messages
+
+
+def message_update(update_id, user_id, text):
+    """Raw Telegram update for a private text message"""
+    message = {'message_id': update_id, 'date': 0, 'text': text,
+               'chat': {'id': user_id, 'type': 'private'},
+               'from': {'id': user_id, 'is_bot': False, 'first_name': 'Fan'}}
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def pre_checkout_update(update_id, user_id, payload, amount):
+    """Raw Telegram update for a Stars pre-checkout query"""
+    return {'update_id': update_id, 'pre_checkout_query': {
+        'id': f'q{update_id}', 'currency': 'XTR', 'total_amount': amount, 'invoice_payload': payload,
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Fan'}}}
+
+
+class FakeTelegramApi:
+    """Local stand-in for the Bot API: serves queued updates to getUpdates and answers every
+    other method after `latency` seconds, counting sends. Sends to chats in `blocked` get
+    Telegram's 403. Point TELEGRAM_API_URL at `url`."""
+    
+    def __init__(self, latency=0.02):
+        self.latency = latency
+        self.blocked = set()
+        self.updates = []
+        self.polls = 0
+        self.sends = 0
+        self.last_send = None
+        self.lock = threading.Condition()
+        api = self
+        
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.do_POST()
+            
+            def do_POST(self):
+                url = urlparse(self.path)
+                params = dict(parse_qsl(url.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                if self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+                    params.update(parse_qsl(body.decode()))
+                try:
+                    status, reply = 200, {'ok': True, 'result': api.call(url.path.rsplit('/', 1)[-1], params)}
+                except PermissionError as e:
+                    status, reply = 403, {'ok': False, 'error_code': 403, 'description': f'Forbidden: {e}'}
+                payload = json.dumps(reply).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # a worker the test killed
+            
+            def log_message(self, *args):
+                pass
+        
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    def push(self, raw_updates):
+        with self.lock:
+            self.updates.extend(raw_updates)
+            self.lock.notify_all()
+    
+    def wait_for_polling(self, timeout=30):
+        """Wait until a receiver is long-polling past its startup getUpdates"""
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            polls = self.polls
+            while self.polls < polls + 2 and time.monotonic() < deadline:
+                self.lock.wait(0.1)
+    
+    def wait_for_sends(self, count, timeout=120):
+        """Wait until `count` messages were sent; returns the monotonic time of the last one"""
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while self.sends < count and time.monotonic() < deadline:
+                self.lock.wait(0.1)
+            assert self.sends >= count, f"only {self.sends}/{count} messages sent"
+            return self.last_send
+    
+    def call(self, method, params):
+        if method == 'getUpdates':
+            offset = int(params.get('offset') or 0)
+            with self.lock:
+                self.polls += 1
+                self.lock.notify_all()
+                if offset < 0:
+                    return self.updates[offset:]
+                if offset > 0:
+                    self.updates = [update for update in self.updates if update['update_id'] >= offset]
+                if not self.updates:
+                    self.lock.wait(min(float(params.get('timeout') or 0), 0.5))
+                return self.updates[:100]
+        if method == 'getMe':
+            return {'id': 999, 'is_bot': True, 'first_name': 'Bot', 'username': 'test_bot'}
+        
+        time.sleep(self.latency)
+        if not method.startswith('send'):
+            return True
+        chat_id = int(params.get('chat_id') or 0)
+        if chat_id in self.blocked:
+            raise PermissionError('bot was blocked by the user')
+        with self.lock:
+            self.sends += 1
+            self.last_send = time.monotonic()
+            self.lock.notify_all()
+            message_id = self.sends
+        return {'message_id': message_id, 'date': 0, 'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')}
+    
+    def close(self):
+        self.server.shutdown()
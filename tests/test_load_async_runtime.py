@@ -0,0 +1,50 @@
+"""Broadcast delivery on the sync runtime versus the asyncio runtime against a fake Bot API (user-039)"""
+import time
+
+import pytest
+from telebot import apihelper
+
+from conftest import FakeTelegramApi
+
+pytestmark = pytest.mark.load
+
+API_LATENCY = 0.02  # seconds added to every bot call, like a round trip to Telegram
+SEND_RATE = 100000  # lift Telegram's send limits - this measures the runtimes, not the governor
+RECIPIENTS = {'sync': 300, 'async': 2000}
+
+
+@pytest.fixture
+def fake_api(main, monkeypatch):
+    api = FakeTelegramApi(API_LATENCY)
+    monkeypatch.setattr(apihelper, 'API_URL', api.url + '/bot{0}/{1}')
+    # Read when the async runtime starts, which happens on its first broadcast
+    monkeypatch.setattr(main, 'TELEGRAM_API_URL', api.url)
+    monkeypatch.setattr(main, 'BOT_TOKEN', '12345:TEST')
+    monkeypatch.setattr(main, 'outbound_governor', main.OutboundGovernor(SEND_RATE, SEND_RATE, SEND_RATE))
+    yield api
+    api.close()
+
+
+def test_async_runtime_broadcast_throughput(main, fake_api, monkeypatch):
+    rates = {}
+    for runtime, count in RECIPIENTS.items():
+        monkeypatch.setattr(main, 'TELEGRAM_RUNTIME', runtime)
+        base = 3_000_000 if runtime == 'sync' else 4_000_000
+        recipients = [(base + i, f'Fan {i}', None) for i in range(count)]
+        # Every tenth recipient has blocked the bot
+        fake_api.blocked.update(user_id for user_id, _, _ in recipients[::10])
+
+        started = time.monotonic()
+        stats = main.send_notification_to_users(recipients, 'New drop!')
+        elapsed = time.monotonic() - started
+
+        rates[runtime] = count / elapsed
+        print(f"\n{runtime}: {count} recipients in {elapsed:.2f}s ({rates[runtime]:.0f} msg/s), "
+              f"{stats['sent']} sent, {stats['blocked']} blocked, {stats['failed']} failed")
+        assert stats['blocked'] == count // 10
+        assert stats['sent'] == count - count // 10
+        assert stats['failed'] == 0
+
+    print(f"\nasync runtime: {rates['async'] / rates['sync']:.1f}x the sync runtime with "
+          f"{main.ASYNC_SEND_CONCURRENCY} sends in flight and {API_LATENCY * 1000:.0f}ms per call")
+    assert rates['async'] > 5 * rates['sync']
@@ -0,0 +1,58 @@
+"""Pre-checkout validation against the cached catalog price index (user-031)"""
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytestmark = pytest.mark.load
+
+
+@pytest.fixture
+def priced_item(main):
+    with main.app_context_scope():
+        item = main.ContentItem.query.filter_by(name='bench_pack').first()
+        if not item:
+            item = main.ContentItem()
+            item.name = 'bench_pack'
+            item.price_stars = 25
+            item.file_path = 'x' * 60
+            item.description = 'Benchmark pack'
+            item.content_type = 'browse'
+            main.db.session.add(item)
+            main.db.session.commit()
+    main.bump_catalog_version()
+    return 'bench_pack'
+
+
+def query(payload, amount, user_id=1):
+    return SimpleNamespace(id='q', invoice_payload=payload, total_amount=amount, currency='XTR',
+                           from_user=SimpleNamespace(id=user_id))
+
+
+def test_pre_checkout_validation_latency(main, priced_item):
+    assert main.validate_pre_checkout(query(f'c:1:{priced_item}', 25)) is None
+    assert main.validate_pre_checkout(query(f'c:1:{priced_item}', 24)) is not None
+
+    timings = []
+    for _ in range(20000):
+        started = time.perf_counter()
+        main.validate_pre_checkout(query(f'c:1:{priced_item}', 25))
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    p50, p99 = timings[len(timings) // 2] * 1000, timings[int(len(timings) * 0.99)] * 1000
+    print(f"\npre-checkout validation: p50 {p50:.3f}ms p99 {p99:.3f}ms over {len(timings)} queries")
+    # Telegram gives us 10 seconds; an index lookup must stay far below a database round trip
+    assert p99 < 5
+
+
+def test_concurrent_catalog_bumps_are_not_lost(main, priced_item):
+    start = int(main.get_vip_settings(main.CATALOG_VERSION_KEY))
+    threads = [threading.Thread(target=lambda: [main.bump_catalog_version() for _ in range(25)]) for _ in range(8)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"\n200 catalog bumps from 8 threads in {time.monotonic() - started:.2f}s")
+    assert int(main.get_vip_settings(main.CATALOG_VERSION_KEY)) == start + 200
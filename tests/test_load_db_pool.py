@@ -0,0 +1,121 @@
+"""Engine profile: pool sizing and hot-handler throughput against the old settings (user-032)"""
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from telebot import types
+
+from app import (BOT_WORKER_THREADS, DB_BACKGROUND_THREADS, build_engine_options,
+                 configure_sqlite_connection, handle_database_error)
+from conftest import TEST_DIR, message_update
+
+pytestmark = pytest.mark.load
+
+HANDLER_THREADS = BOT_WORKER_THREADS + 4  # update workers plus background writers competing for the database
+UPDATES_PER_THREAD = 150
+
+
+def test_pool_covers_every_database_thread(main):
+    threads = BOT_WORKER_THREADS + DB_BACKGROUND_THREADS
+    all_checked_out = threading.Barrier(threads, timeout=30)
+    errors = []
+    queries = [0]
+    lock = threading.Lock()
+
+    def worker():
+        try:
+            with main.app.app_context():
+                main.db.session.execute(text('SELECT 1'))
+                # Hold the connection until every other thread has one too
+                all_checked_out.wait()
+                for _ in range(200):
+                    main.db.session.execute(text('SELECT COUNT(*) FROM users')).scalar()
+                with lock:
+                    queries[0] += 200
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.monotonic()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    with main.app.app_context():
+        pool = main.db.engine.pool
+    print(f"\n{threads} threads ran {queries[0]} queries in {elapsed:.2f}s ({queries[0] / elapsed:.0f}/s); {pool.status()}")
+    assert errors == []
+    assert pool.size() >= threads
+
+
+def copy_database(main, name, journal_mode):
+    """Copy the test database to a new file so each profile starts from the same rows"""
+    path = os.path.join(TEST_DIR, name)
+    with main.app.app_context():
+        source = sqlite3.connect(main.db.engine.url.database)
+    target = sqlite3.connect(path)
+    source.backup(target)
+    target.execute(f"PRAGMA journal_mode={journal_mode}")
+    target.close()
+    source.close()
+    return f'sqlite:///{path}'
+
+
+def old_engine(url):
+    """The settings before the engine profile: per-checkout pre-ping and the default pool"""
+    return create_engine(url, pool_pre_ping=True)
+
+
+def new_engine(url):
+    """The engine profile app.py builds: sized pool, no pre-ping, WAL and busy_timeout"""
+    engine = create_engine(url, **build_engine_options(url))
+    event.listen(engine, 'connect', configure_sqlite_connection)
+    event.listen(engine, 'handle_error', handle_database_error)
+    return engine
+
+
+def run_hot_handlers(main, engine, monkeypatch):
+    """Push /start and chatter updates through the bot from HANDLER_THREADS threads; returns (updates/s, errors)"""
+    with main.app.app_context():
+        monkeypatch.setitem(main.db.engines, None, engine)
+    errors = []
+    monkeypatch.setattr(main.logger, 'error', lambda message, *args, **kwargs: errors.append(message))
+
+    def worker(index):
+        for i in range(UPDATES_PER_THREAD):
+            update_id = index * UPDATES_PER_THREAD + i + 1
+            text_ = '/start' if i % 3 == 0 else 'hello there'
+            update = types.Update.de_json(message_update(update_id, 700000 + update_id % 400, text_))
+            main.bot.process_new_updates([update])
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(HANDLER_THREADS)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    return HANDLER_THREADS * UPDATES_PER_THREAD / elapsed, errors
+
+
+def test_hot_handler_throughput_by_engine_profile(main, sent, monkeypatch):
+    monkeypatch.setattr(main.bot, 'threaded', False)
+    results = {}
+    for name, make_engine, journal_mode in (('old', old_engine, 'DELETE'), ('new', new_engine, 'WAL')):
+        engine = make_engine(copy_database(main, f'profile-{name}.db', journal_mode))
+        try:
+            with monkeypatch.context() as patch:
+                results[name] = run_hot_handlers(main, engine, patch)
+        finally:
+            engine.dispose()
+
+    for name, (rate, errors) in results.items():
+        print(f"\n{name} profile: {HANDLER_THREADS} threads x {UPDATES_PER_THREAD} updates, "
+              f"{rate:.0f} updates/s, {len(errors)} handler errors")
+    # The tuned profile waits out SQLite's write lock instead of failing handlers
+    assert results['new'][1] == []
@@ -0,0 +1,138 @@
+"""Sharded workers: restarts after a crash, a stalled shard never blocks the receiver,
+and throughput scales with the number of workers against a fake Bot API (user-038)"""
+import os
+import signal
+import threading
+import time
+
+import pytest
+from telebot import apihelper
+
+from conftest import FakeTelegramApi, message_update
+
+pytestmark = pytest.mark.load
+
+API_LATENCY = 0.02  # seconds added to every bot call, like a round trip to Telegram
+SCALING_UPDATES = 600
+SCALING_USERS = 150
+SEND_RATE = 100000  # lift Telegram's send limits - this measures the workers, not the governor
+
+
+def wait_until(condition, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.1)
+    return condition()
+
+
+@pytest.fixture(scope='module')
+def fake_api(main):
+    """Fake Bot API for this process and, through the environment, every worker the forkserver starts"""
+    api = FakeTelegramApi(API_LATENCY)
+    settings = {'TELEGRAM_API_URL': api.url, 'TELEGRAM_GLOBAL_RATE': str(SEND_RATE),
+                'TELEGRAM_CHAT_RATE': str(SEND_RATE), 'TELEGRAM_CHAT_BURST': str(SEND_RATE)}
+    previous = {name: os.environ.get(name) for name in settings}
+    os.environ.update(settings)
+    patch = pytest.MonkeyPatch()
+    patch.setattr(apihelper, 'API_URL', api.url + '/bot{0}/{1}')
+    patch.setattr(main, 'TELEGRAM_GLOBAL_RATE', float(SEND_RATE))
+    yield api
+    patch.undo()
+    for name, value in previous.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+    api.close()
+
+
+def stop_workers(workers):
+    for process, update_queue in workers:
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGCONT)
+            process.terminate()
+        process.join(10)
+        update_queue.cancel_join_thread()
+
+
+@pytest.fixture
+def shards(main, fake_api, monkeypatch):
+    monkeypatch.setattr(main, 'SHARD_QUEUE_SIZE', 50)
+    monkeypatch.setattr(main, 'BOT_SHARDS', 2)
+    ctx, workers = main.start_shard_workers(2)
+    yield ctx, workers
+    stop_workers(workers)
+
+
+def test_receiver_restarts_dead_workers_and_sheds_for_a_stalled_shard(main, shards, monkeypatch):
+    ctx, workers = shards
+    assert wait_until(lambda: all(process.is_alive() for process, _ in workers))
+
+    crashed = workers[0][0]
+    os.kill(crashed.pid, signal.SIGKILL)
+    crashed.join(10)
+    stalled = workers[1][0]
+    os.kill(stalled.pid, signal.SIGSTOP)
+
+    # Chat 3 belongs to the stalled shard; far more updates than its queue holds
+    flood = [message_update(i, 3, '/help') for i in range(1, 501)]
+    monkeypatch.setattr(main, 'iter_update_batches', lambda: iter([flood]))
+    started = time.monotonic()
+    main.run_shard_receiver(ctx, workers)
+    elapsed = time.monotonic() - started
+
+    print(f"\nrouted {len(flood)} updates to a stalled shard in {elapsed * 1000:.0f}ms")
+    assert elapsed < 5
+    assert workers[0][0] is not crashed
+    assert wait_until(lambda: workers[0][0].is_alive())
+
+
+def measure_shards(main, fake_api, shard_count, monkeypatch):
+    """Route SCALING_UPDATES text messages through shard_count workers; returns updates per second"""
+    monkeypatch.setattr(main, 'BOT_SHARDS', shard_count)
+    ctx, workers = main.start_shard_workers(shard_count)
+    stop = threading.Event()
+    poll = main.iter_update_batches
+
+    def batches_until_stopped():
+        for updates in poll():
+            yield updates
+            if stop.is_set():
+                return
+
+    monkeypatch.setattr(main, 'iter_update_batches', batches_until_stopped)
+    receiver = threading.Thread(target=main.run_shard_receiver, args=(ctx, workers), daemon=True)
+    receiver.start()
+    try:
+        fake_api.wait_for_polling()
+        # One message per shard first, so every worker has finished importing before the clock starts
+        base_id = fake_api.sends + 1_000_000
+        fake_api.push([message_update(base_id + shard, 1000 + shard, 'warm up') for shard in range(shard_count)])
+        fake_api.wait_for_sends(fake_api.sends + shard_count)
+
+        sends = fake_api.sends
+        flood = [message_update(base_id + shard_count + i, 20000 + i % SCALING_USERS, f'hello there {i}')
+                 for i in range(SCALING_UPDATES)]
+        started = time.monotonic()
+        fake_api.push(flood)
+        finished = fake_api.wait_for_sends(sends + SCALING_UPDATES)
+        return SCALING_UPDATES / (finished - started)
+    finally:
+        stop.set()
+        receiver.join(10)
+        stop_workers(workers)
+
+
+def test_throughput_scales_with_shard_workers(main, fake_api, monkeypatch):
+    rates = {}
+    for shard_count in (1, 2, 4, 8):
+        with monkeypatch.context() as patch:
+            rates[shard_count] = measure_shards(main, fake_api, shard_count, patch)
+        print(f"\nshards={shard_count}: {SCALING_UPDATES} updates from {SCALING_USERS} users, "
+              f"{API_LATENCY * 1000:.0f}ms per bot call, {rates[shard_count]:.1f} updates/s")
+
+    print(f"\n{os.cpu_count()} CPU(s); speedup over one worker: "
+          + ', '.join(f"{count}x {rate / rates[1]:.2f}" for count, rate in rates.items()))
+    # Even on one core, workers overlap their API round trips
+    assert rates[4] > 1.5 * rates[1]
+    assert rates[8] >= rates[4] * 0.9
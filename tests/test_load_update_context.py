@@ -0,0 +1,49 @@
+"""One app context and session per update through the TeleBot middleware (user-033)"""
+import time
+
+import pytest
+from flask import appcontext_pushed
+from sqlalchemy import event
+from telebot import types
+
+from conftest import message_update
+
+pytestmark = pytest.mark.load
+
+
+@pytest.fixture
+def counters(main):
+    counts = {'contexts': 0, 'checkouts': 0}
+
+    def context_pushed(sender, **kwargs):
+        counts['contexts'] += 1
+
+    def checked_out(*args):
+        counts['checkouts'] += 1
+
+    with main.app.app_context():
+        engine = main.db.engine
+    appcontext_pushed.connect(context_pushed, main.app)
+    event.listen(engine, 'checkout', checked_out)
+    yield counts
+    event.remove(engine, 'checkout', checked_out)
+    appcontext_pushed.disconnect(context_pushed, main.app)
+
+
+def test_each_update_runs_in_one_app_context(main, sent, counters, monkeypatch):
+    monkeypatch.setattr(main.bot, 'threaded', False)
+    updates = [types.Update.de_json(message_update(i, 50000 + i % 50, '/start' if i % 2 else 'hello there'))
+               for i in range(1, 501)]
+
+    started = time.monotonic()
+    for update in updates:
+        main.bot.process_new_updates([update])
+    elapsed = time.monotonic() - started
+
+    print(f"\n{len(updates)} updates in {elapsed:.2f}s ({len(updates) / elapsed:.0f}/s), "
+          f"{counters['contexts']} app contexts, {counters['checkouts']} connection checkouts")
+    assert counters['contexts'] == len(updates)
+    # Helpers reuse the update's session instead of checking out connections of their own
+    assert counters['checkouts'] <= 2 * len(updates)
+    assert len(sent) >= len(updates)
+    assert not main.has_app_context()
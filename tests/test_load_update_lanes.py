@@ -0,0 +1,51 @@
+"""Pre-checkout queries stay fast while bulk chatter floods the update lanes (user-042)"""
+import time
+
+import pytest
+
+from conftest import message_update, pre_checkout_update
+
+pytestmark = pytest.mark.load
+
+FLOOD_SECONDS = 8
+FLOOD_RATE = 1000  # bulk updates per second
+
+
+def test_pre_checkout_is_answered_during_a_flood(main, sent, monkeypatch):
+    answered = {}
+    monkeypatch.setattr(main.bot, 'answer_pre_checkout_query',
+                        lambda query_id, *args, **kwargs: answered.setdefault(query_id, time.monotonic()))
+    lanes = main.start_update_lanes(main.BOT_WORKER_THREADS)
+
+    submitted = {}
+    update_id = 0
+    started = time.monotonic()
+    ticks = 0
+    while time.monotonic() - started < FLOOD_SECONDS:
+        tick = time.monotonic()
+        for _ in range(FLOOD_RATE // 20):
+            update_id += 1
+            lanes.submit(message_update(update_id, 200000 + update_id % 5000, 'hey how are you'))
+        ticks += 1
+        if ticks % 10 == 0:
+            update_id += 1
+            submitted[f'q{update_id}'] = time.monotonic()
+            lanes.submit(pre_checkout_update(update_id, 300000 + update_id, 'v:1', 399))
+        time.sleep(max(0, 0.05 - (time.monotonic() - tick)))
+
+    deadline = time.monotonic() + 30
+    while len(answered) < len(submitted) and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+    # Let the lane threads finish the backlog before the fake bot is removed
+    while lanes.backlog() and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+    latencies = sorted(answered[query_id] - submitted[query_id] for query_id in submitted if query_id in answered)
+    stats = lanes.get_stats()
+    print(f"\n{update_id} updates in {FLOOD_SECONDS}s, pre-checkout answered {len(latencies)}/{len(submitted)}, "
+          f"p50 {latencies[len(latencies) // 2] * 1000:.0f}ms max {latencies[-1] * 1000:.0f}ms; {stats}")
+    assert len(latencies) == len(submitted)
+    assert stats['payment']['shed'] == 0
+    # Well inside Telegram's 10 second pre-checkout deadline
+    assert latencies[-1] < 1